@@ -22,6 +22,7 @@ __status__ = "Development"
 
 from analytics_engine.heuristics.beans.infograph import InfoGraphNode, InfoGraphNodeType, \
     InfoGraphNodeCategory, InfoGraphNodeLayer
+from analytics_engine.infrastructure_manager import graphs
 import pandas
 import math
 
@@ -70,7 +71,7 @@ class Fingerprint(object):
             counter[category] = 0
 
         # calculation of the fingerprint on top of the virtual resources
-        local_subgraph = annotated_subgraph.copy()
+        local_subgraph = graphs.cow_copy(annotated_subgraph)
         local_subgraph.filter_nodes('layer', "physical")
         local_subgraph.filter_nodes('layer', "service")
 
@@ -114,7 +115,7 @@ class Fingerprint(object):
             counter[category] = 0
 
         # calculation of the fingerprint on top of the virtual resources
-        local_subgraph = annotated_subgraph.copy()
+        local_subgraph = graphs.cow_copy(annotated_subgraph)
         local_subgraph.filter_nodes('layer', "virtual")
         local_subgraph.filter_nodes('layer', "service")
         local_subgraph.filter_nodes('type', 'machine')
@@ -162,9 +163,8 @@ class Fingerprint(object):
         statistics[memory] = {'mean': 0, 'median': 0, 'min': 0, 'max': 0, 'var': 0, 'std_dev': 0}
 
         # Calculation of the fingerprint on top of the virtual resources
-        local_subgraph = annotated_subgraph.copy()
-
-        for node in local_subgraph.nodes(data=True):
+        # Nodes are only read: no need to copy the graph
+        for node in annotated_subgraph.nodes(data=True):
             layer = InfoGraphNode.get_layer(node)
             is_machine = InfoGraphNode.node_is_machine(node)
             if is_machine:
@@ -224,9 +224,8 @@ class Fingerprint(object):
         statistics = dict()
 
         # Calculation of the fingerprint on top of the virtual resources
-        local_subgraph = annotated_subgraph.copy()
-
-        for node in local_subgraph.nodes(data=True):
+        # Nodes are only read: no need to copy the graph
+        for node in annotated_subgraph.nodes(data=True):
             layer = InfoGraphNode.get_layer(node)
             if layer == InfoGraphNodeLayer.VIRTUAL:
                 continue
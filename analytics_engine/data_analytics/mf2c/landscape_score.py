@@ -21,7 +21,8 @@ __status__ = "Development"
 
 import pandas
 import analytics_engine.common as common
-from analytics_engine.heuristics.beans.infograph import InfoGraphNode, InfoGraphNodeType
+from analytics_engine.heuristics.beans.infograph import InfoGraphNode, InfoGraphNodeType, \
+    InfoGraphUtilities
 
 # from lib_analytics
 
@@ -31,16 +32,21 @@ LOG = common.LOG
 class LandscapeScore(object):
 
     @staticmethod
-    def utilization_scores(graph):
+    def utilization_scores(graph, node_types=None):
         """
         Returns a dictionary with the scores of
         all the nodes of the graph.
 
         :param graph: InfoGraph
+        :param node_types: (list of str) if provided, only nodes of these
+                           types are scored
         :return: dict[node_name] = score
         """
         res = dict()
-        for node in graph.nodes(data=True):
+        nodes = graph.nodes(data=True)
+        if node_types:
+            nodes = InfoGraphUtilities.filter_by_types(graph, node_types)
+        for node in nodes:
             node_name = InfoGraphNode.get_name(node)
             res[node_name] = dict()
             util = InfoGraphNode.get_utilization(node)
@@ -79,22 +85,22 @@ class LandscapeScore(object):
             if InfoGraphNode.node_is_machine(node):
                 # mean from all cpu columns
                 cpu_util = InfoGraphNode.get_compute_utilization(node)
-                cpu_util['total'] = [sum(row) / len(row) for index, row in cpu_util.iterrows()]
-                res[node_name]['compute'] = cpu_util['total'].mean() / 100
+                res[node_name]['compute'] = \
+                    LandscapeScore._row_average(cpu_util).mean() / 100
                 # mean from all disk columns
                 disk_util = InfoGraphNode.get_disk_utilization(node)
                 if disk_util.empty:
                     res[node_name]['disk'] = 0.0
                 else:
-                    disk_util['total'] = [sum(row) / len(row) for index, row in disk_util.iterrows()]
-                    res[node_name]['disk'] = disk_util['total'].mean() / 100
+                    res[node_name]['disk'] = \
+                        LandscapeScore._row_average(disk_util).mean() / 100
                 # mean from all nic columns
                 net_util = InfoGraphNode.get_network_utilization(node)
                 if net_util.empty:
                     res[node_name]['network'] = 0.0
                 else:
-                    net_util['total'] = [sum(row) / len(row) for index, row in net_util.iterrows()]
-                    res[node_name]['network'] = net_util['total'].mean() / 100
+                    res[node_name]['network'] = \
+                        LandscapeScore._row_average(net_util).mean() / 100
                 # custom metric
 
             if InfoGraphNode.get_type(node)==InfoGraphNodeType.DOCKER_CONTAINER:
@@ -119,16 +125,21 @@ class LandscapeScore(object):
         return res
 
     @staticmethod
-    def saturation_scores(graph):
+    def saturation_scores(graph, node_types=None):
         """
         Returns a dictionary with the scores of
         all the nodes of the graph.
 
         :param graph: InfoGraph
+        :param node_types: (list of str) if provided, only nodes of these
+                           types are scored
         :return: dict[node_name] = score
         """
         res = dict()
-        for node in graph.nodes(data=True):
+        nodes = graph.nodes(data=True)
+        if node_types:
+            nodes = InfoGraphUtilities.filter_by_types(graph, node_types)
+        for node in nodes:
             node_name = InfoGraphNode.get_name(node)
             res[node_name] = dict()
             sat = InfoGraphNode.get_saturation(node)
@@ -155,6 +166,18 @@ class LandscapeScore(object):
                 res[node_name]['network'] = (sat.get('intel/use/network/saturation').mean()) / 100.0
         return res
 
+    @staticmethod
+    def _row_average(frame):
+        """
+        Returns the average of the columns of each row of the frame, e.g.
+        the utilization of a machine from the utilization of its PUs.
+        A missing value makes the average of its row missing.
+
+        :param frame: (pandas.DataFrame)
+        :return: (pandas.Series)
+        """
+        return frame.sum(axis=1, skipna=False) / float(frame.shape[1])
+
     @staticmethod
     def _calc_score(utilization=1, saturation=0, capacity=1):
         """
@@ -25,6 +25,7 @@ from analytics_engine.heuristics.beans.workload import Workload
 from analytics_engine.heuristics.pipes.annotated_telemetry_pipe import AnnotatedTelemetryPipe
 from analytics_engine.heuristics.pipes.mf2c.avg_heuristic import AvgHeuristicPipe
 from analytics_engine.heuristics.pipes.optimal_pipe import OptimalPipe
+from analytics_engine.heuristics.pipes.annotation_daemon import AnnotationDaemon
 from analytics_engine.heuristics.pipes.mf2c.refine_recipe_pipe import RefineRecipePipe
 from analytics_engine.heuristics.sinks.mf2c.rest_api_sink import RestiAPI
 from analytics_engine.utilities import misc as utils
@@ -72,12 +73,17 @@ class Engine:
             LOG.info('running in online mode')
             RestiAPI().run()
 
+        elif self.pipe == 'daemon':
+            LOG.info('running in online mode with continuous annotation')
+            AnnotationDaemon.start_daemon()
+            RestiAPI().run()
+
         else:
             LOG.error('Please specify at least 1 task to be performed '
                       '"{} --help" to see available options'.format(
                      common.SERVICE_NAME))
             exit()
-        if self.pipe != 'rest':
+        if self.pipe not in ['rest', 'daemon']:
             LOG.info('Analyzing Workload: {}'.format(self.workload.get_workload_name()))
             res = pipe_exec.run(self.workload)
         return res
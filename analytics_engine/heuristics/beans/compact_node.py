@@ -0,0 +1,327 @@
+# Copyright (c) 2017, Intel Research and Development Ireland Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = 'Giuliana Carullo'
+__copyright__ = "Copyright (c) 2017, Intel Research and Development Ireland Ltd."
+__license__ = "Apache 2.0"
+__maintainer__ = "Giuliana Carullo"
+__email__ = "giuliana.carullo@intel.com"
+__status__ = "Development"
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+from analytics_engine import common
+from analytics_engine.heuristics.beans.infograph import InfoGraphNodeProperty
+
+LOG = common.LOG
+
+# Values shared by all the records: types, layers and categories
+_INTERNED = dict()
+
+_MISSING = object()
+
+# Attributes which are a copy of the other properties of the node
+_DERIVED = object()
+
+# Values of properties packed with the record: they are never modified in
+# place, so that records can share them
+try:
+    _SCALARS = (basestring, int, long, float, bool, type(None))
+except NameError:
+    _SCALARS = (str, bytes, int, float, bool, type(None))
+
+
+def intern_value(value):
+    """
+    Returns the instance of the value shared by all the compact records,
+    so that each type, layer or category is stored once.
+
+    :param value: (str) value to be interned
+    :return: (str) equal to value
+    """
+    try:
+        return _INTERNED.setdefault(value, value)
+    except TypeError:
+        return value
+
+
+class AttributeSchema(object):
+    """
+    Ordered keys of a dict of attributes, shared by all the records whose
+    attributes have the same keys: each record only stores the values.
+    """
+
+    __slots__ = ('keys', 'positions')
+
+    # tuple of keys -> AttributeSchema
+    _schemas = dict()
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.positions = dict((key, position)
+                              for position, key in enumerate(keys))
+
+    @staticmethod
+    def get(keys):
+        """
+        :param keys: (tuple) ordered keys of the attributes
+        :return: (AttributeSchema) shared by the attributes with those keys
+        """
+        schema = AttributeSchema._schemas.get(keys)
+        if schema is None:
+            schema = AttributeSchema._schemas.setdefault(
+                keys, AttributeSchema(keys))
+        return schema
+
+
+class PackedAttributes(object):
+    """
+    Immutable dict of attributes stored as a shared schema and a tuple of
+    values, nested dicts being packed as well.
+    """
+
+    __slots__ = ('schema', 'values')
+
+    def __init__(self, schema, values):
+        self.schema = schema
+        self.values = values
+
+    @staticmethod
+    def pack(value):
+        """
+        :param value: any value, dicts being packed
+        :return: (PackedAttributes) for dicts, the value itself otherwise
+        """
+        if type(value) is not dict:
+            return value
+        keys = tuple(value)
+        return PackedAttributes(
+            AttributeSchema.get(keys),
+            tuple(PackedAttributes.pack(value[key]) for key in keys))
+
+    @staticmethod
+    def unpack(value):
+        """
+        :return: (dict) new dict for PackedAttributes, the value otherwise
+        """
+        if not isinstance(value, PackedAttributes):
+            return value
+        return dict(zip(value.schema.keys,
+                        [PackedAttributes.unpack(item)
+                         for item in value.values]))
+
+    @staticmethod
+    def pack_items(items):
+        """
+        :param items: (dict) values not to be packed themselves
+        :return: (PackedAttributes) items stored in the order of their
+                 sorted keys, None if there are none
+        """
+        if not items:
+            return None
+        keys = tuple(sorted(items))
+        return PackedAttributes(AttributeSchema.get(keys),
+                                tuple(items[key] for key in keys))
+
+
+class CompactNodeRecord(MutableMapping):
+    """
+    Properties of a landscape node using a fraction of the memory of a
+    dict, to hold whole landscapes in memory.
+
+    Name, type, layer and category are stored in slots, types, layers and
+    categories being interned; attributes are stored as PackedAttributes.
+    The other scalar properties of the node (e.g. allocation or os_index,
+    which the Landscaper sets next to the attributes) are packed as well,
+    with a schema shared by the records having the same properties. Any
+    other property (e.g. telemetry) is kept in a dict created when the
+    first one is set. Attributes which are a copy of the other properties
+    but layer and category (see InfoGraph.add_node_link_data) are not
+    stored, but rebuilt from the properties when read.
+
+    A record can be used wherever node properties are expected, e.g. by
+    the InfoGraphNode accessors, with one difference: attributes are
+    returned as new dicts, so changes to them are only kept if they are set
+    back on the node (e.g. through InfoGraphNode.set_attributes).
+    """
+
+    __slots__ = ('_name', '_type', '_layer', '_category', '_attributes',
+                 '_packed', '_extra')
+
+    # property -> slot
+    SLOTS = {'name': '_name',
+             InfoGraphNodeProperty.TYPE: '_type',
+             InfoGraphNodeProperty.LAYER: '_layer',
+             InfoGraphNodeProperty.CATEGORY: '_category',
+             'attributes': '_attributes'}
+
+    INTERNED = frozenset([InfoGraphNodeProperty.TYPE,
+                          InfoGraphNodeProperty.LAYER,
+                          InfoGraphNodeProperty.CATEGORY])
+
+    def __init__(self, properties=None):
+        """
+        :param properties: (dict) properties of the node
+        """
+        for slot in CompactNodeRecord.SLOTS.values():
+            setattr(self, slot, _MISSING)
+        self._packed = None
+        self._extra = None
+        if properties:
+            packed = dict()
+            for key, value in properties.items():
+                if key not in CompactNodeRecord.SLOTS and \
+                        isinstance(value, _SCALARS):
+                    packed[key] = value
+                else:
+                    self[key] = value
+            self._packed = PackedAttributes.pack_items(packed)
+            attributes = properties.get('attributes')
+            if type(attributes) is dict and self._extra is None and \
+                    attributes == self._derived_attributes():
+                self._attributes = _DERIVED
+
+    def _derived_attributes(self):
+        res = dict(zip(self._packed.schema.keys, self._packed.values)) \
+            if self._packed is not None else dict()
+        for key in ['name', InfoGraphNodeProperty.TYPE]:
+            value = getattr(self, CompactNodeRecord.SLOTS[key])
+            if value is not _MISSING:
+                res[key] = value
+        return res
+
+    def _store_attributes(self, key):
+        # Attributes rebuilt from a property about to change are stored
+        if self._attributes is _DERIVED and key != 'attributes' and \
+                (key in ['name', InfoGraphNodeProperty.TYPE] or
+                 self._packed_position(key) is not None):
+            self._attributes = PackedAttributes.pack(
+                self._derived_attributes())
+
+    def _packed_position(self, key):
+        if self._packed is None:
+            return None
+        return self._packed.schema.positions.get(key)
+
+    def _unpack_property(self, key):
+        # Moves a packed property out of the packed properties
+        items = dict(zip(self._packed.schema.keys, self._packed.values))
+        value = items.pop(key)
+        self._packed = PackedAttributes.pack_items(items)
+        return value
+
+    def __getitem__(self, key):
+        slot = CompactNodeRecord.SLOTS.get(key)
+        if slot is not None:
+            value = getattr(self, slot)
+            if value is _DERIVED:
+                return self._derived_attributes()
+            if value is not _MISSING:
+                return PackedAttributes.unpack(value)
+        elif self._extra is not None and key in self._extra:
+            return self._extra[key]
+        else:
+            position = self._packed_position(key)
+            if position is not None:
+                return self._packed.values[position]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        self._store_attributes(key)
+        slot = CompactNodeRecord.SLOTS.get(key)
+        if slot is None:
+            if self._packed_position(key) is not None:
+                self._unpack_property(key)
+            if self._extra is None:
+                self._extra = dict()
+            self._extra[key] = value
+        elif key in CompactNodeRecord.INTERNED:
+            setattr(self, slot, intern_value(value))
+        else:
+            setattr(self, slot, PackedAttributes.pack(value))
+
+    def __delitem__(self, key):
+        self._store_attributes(key)
+        slot = CompactNodeRecord.SLOTS.get(key)
+        if slot is not None:
+            if getattr(self, slot) is _MISSING:
+                raise KeyError(key)
+            setattr(self, slot, _MISSING)
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+        elif self._packed_position(key) is not None:
+            self._unpack_property(key)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        slot = CompactNodeRecord.SLOTS.get(key)
+        if slot is not None:
+            return getattr(self, slot) is not _MISSING
+        return (self._extra is not None and key in self._extra) or \
+            self._packed_position(key) is not None
+
+    def __iter__(self):
+        for key, slot in CompactNodeRecord.SLOTS.items():
+            if getattr(self, slot) is not _MISSING:
+                yield key
+        if self._packed is not None:
+            for key in self._packed.schema.keys:
+                yield key
+        if self._extra is not None:
+            for key in list(self._extra):
+                yield key
+
+    def __len__(self):
+        return sum(1 for slot in CompactNodeRecord.SLOTS.values()
+                   if getattr(self, slot) is not _MISSING) + \
+            len(self._packed.values if self._packed is not None else ()) + \
+            len(self._extra or ())
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def __reduce__(self):
+        return CompactNodeRecord, (dict(self),)
+
+    def copy(self):
+        """
+        :return: (CompactNodeRecord) shallow copy of the record, sharing its
+                 values (packed attributes are never modified)
+        """
+        res = CompactNodeRecord.__new__(CompactNodeRecord)
+        for slot in CompactNodeRecord.SLOTS.values():
+            setattr(res, slot, getattr(self, slot))
+        res._packed = self._packed
+        res._extra = dict(self._extra) if self._extra is not None else None
+        return res
+
+    @staticmethod
+    def compact_graph(graph):
+        """
+        Replaces the properties of all the nodes of the graph with compact
+        records, in place.
+
+        :param graph: (NetworkX Graph)
+        :return: (NetworkX Graph) the graph itself
+        """
+        for node in graph.nodes():
+            properties = graph.node[node]
+            if not isinstance(properties, CompactNodeRecord):
+                graph.node[node] = CompactNodeRecord(properties)
+        LOG.debug("Compacted the properties of {} nodes".
+                  format(len(graph.node)))
+        return graph
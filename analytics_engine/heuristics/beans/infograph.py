@@ -22,10 +22,16 @@ __status__ = "Development"
 import re
 import ast
 import json
-import copy
 import yaml
 import pandas
+import threading
 from analytics_engine import common
+from analytics_engine.infrastructure_manager.graphs import AllocationIndex
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 
 LOG = common.LOG
 
@@ -94,6 +100,130 @@ class InfoGraphNodeProperty():
     SATURATION_MEMORY = 'saturation_memory'
     SATURATION_DISK = 'saturation_disk'
     SATURATION_NETWORK = 'saturation_network'
+    TELEMETRY_HANDLE = 'telemetry_handle'
+    TELEMETRY_STORE = 'telemetry_store'
+    TELEMETRY_INCOMPLETE = 'telemetry_incomplete'
+    SATURATION = 'saturation'
+
+
+class InfoGraphNodeAttributes(Mapping):
+    """
+    Read-only view on the properties of a node, but its layer and category.
+
+    The view is built in constant time on the property dict of the node:
+    nothing is copied, telemetry DataFrames included, and changes made to
+    the node (e.g. through InfoGraphNode.set_attributes) are visible
+    through the view.
+    """
+
+    __slots__ = ('_properties',)
+
+    HIDDEN = frozenset([InfoGraphNodeProperty.LAYER,
+                        InfoGraphNodeProperty.CATEGORY])
+
+    def __init__(self, properties):
+        self._properties = properties
+
+    def __getitem__(self, key):
+        if key in self.HIDDEN:
+            raise KeyError(key)
+        return self._properties[key]
+
+    def __contains__(self, key):
+        return key not in self.HIDDEN and key in self._properties
+
+    def __iter__(self):
+        return (key for key in self._properties if key not in self.HIDDEN)
+
+    def __len__(self):
+        return len(self._properties) - \
+            len(self.HIDDEN.intersection(self._properties))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class InfoGraphNodeTelemetry(object):
+    """
+    Lazy handle on the telemetry of a node.
+
+    The handle is attached to the node together with its queries and fetches
+    the telemetry (and whatever is derived from it) the first time one of
+    the telemetry accessors of InfoGraphNode is used on the node.
+    The loader is called at most once and is expected to store its results
+    in the node through the InfoGraphNode setters.
+    """
+
+    def __init__(self, graph, loader):
+        """
+        :param graph: (InfoGraph) graph the node belongs to
+        :param loader: (callable) loader(graph, node) fetching the telemetry
+        """
+        self.graph = graph
+        self.loaded = False
+        self._loader = loader
+        self._loading = False
+        self._warned = False
+        self._lock = threading.RLock()
+
+    def load(self, node):
+        """
+        Fetches the telemetry of the node, if not fetched already.
+        Concurrent calls wait for the first one to complete, while nested
+        calls from the loader itself return straight away.
+
+        :param node: InfoGraph node the handle is attached to
+        :return: None
+        """
+        if self.loaded:
+            return
+        with self._lock:
+            if self.loaded or self._loading:
+                return
+            if self._loader is None:
+                # Restored from a serialized graph: the telemetry stays
+                # missing and the handle not loaded
+                if not self._warned:
+                    self._warned = True
+                    LOG.warning("Telemetry for node {} was not fetched "
+                                "before the graph was serialized".
+                                format(node[0]))
+                return
+            self._loading = True
+            try:
+                self._loader(self.graph, node)
+            except Exception as e:
+                LOG.error("Telemetry for node {} could not be loaded: {}".
+                          format(node[0], e))
+            finally:
+                self._loading = False
+                self.loaded = True
+
+    def copy(self, graph):
+        """
+        Returns a handle with the same loader bound to another graph, e.g.
+        a copy of the graph, so that telemetry loaded through either graph
+        is stored in that graph only.
+
+        :param graph: (InfoGraph) graph the new handle belongs to
+        :return: (InfoGraphNodeTelemetry)
+        """
+        res = InfoGraphNodeTelemetry(graph, self._loader)
+        res.loaded = self.loaded
+        return res
+
+    def __deepcopy__(self, memo):
+        # Graph copies keep the loader but bind the handle to the new graph
+        return self.copy(memo.get(id(self.graph), self.graph))
+
+    def __getstate__(self):
+        # Telemetry clients cannot be serialized: a restored handle is inert
+        # and telemetry not fetched yet is reported as not loaded
+        return {'loaded': self.loaded}
+
+    def __setstate__(self, state):
+        self.__init__(None, None)
+        self.loaded = state['loaded']
 
 
 class InfoGraphNode(object):
@@ -153,28 +283,94 @@ class InfoGraphNode(object):
 
     @staticmethod
     def get_attributes(node):
+        """
+        Returns a read-only view on the properties of the node, but its
+        layer and category. Use dict() on the view to get a copy which can
+        be modified.
+
+        :param node: InfoGraph node
+        :return: (InfoGraphNodeAttributes)
+        """
         if len(node) == 2:
-            attrs = copy.deepcopy(node[1])
-            attrs.pop("category")
-            attrs.pop("layer")
-            res = InfoGraphUtilities.str_to_dict(attrs)
-            return res
+            return InfoGraphNodeAttributes(node[1])
         return None
 
     @staticmethod
-    def set_queries(node, queries):
+    def set_queries(node, queries, handle=None):
         """
         Store the telemetry queries into the node properties.
+        If a telemetry handle is provided, the telemetry is not expected to
+        be set on the node: it will be fetched through the handle when first
+        accessed.
 
         :param node:
         :param queries: (list of str) Queries to get all metrics related to
                         the node.
+        :param handle: (InfoGraphNodeTelemetry) lazy telemetry handle
         :return: None
         """
         if not len(node) == 2:
             raise ValueError("Node format is not correct. NODE: {}".
                              format(node))
         node[1][InfoGraphNodeProperty.QUERIES] = queries
+        if handle:
+            node[1][InfoGraphNodeProperty.TELEMETRY_HANDLE] = handle
+
+    @staticmethod
+    def load_telemetry(node):
+        """
+        Fetches the telemetry of the node if it has a lazy telemetry handle
+        which has not been used yet.
+
+        :param node: InfoGraph node
+        :return: None
+        """
+        if len(node) == 2:
+            handle = node[1].get(InfoGraphNodeProperty.TELEMETRY_HANDLE)
+            if handle and not handle.loaded:
+                handle.load(node)
+
+    @staticmethod
+    def telemetry_loaded(node):
+        """
+        Returns False if the node has telemetry still to be fetched.
+
+        :param node: InfoGraph node
+        :return: (bool)
+        """
+        if len(node) == 2:
+            handle = node[1].get(InfoGraphNodeProperty.TELEMETRY_HANDLE)
+            if handle:
+                return handle.loaded
+        return True
+
+    @staticmethod
+    def set_telemetry_incomplete(node, incomplete=True):
+        """
+        Marks the node as annotated with partial telemetry, e.g. because its
+        queries did not complete within the annotation deadline.
+
+        :param node: InfoGraph node
+        :param incomplete: (bool)
+        :return: None
+        """
+        if not len(node) == 2:
+            raise ValueError("Node format is not correct. NODE: {}".
+                             format(node))
+        node[1][InfoGraphNodeProperty.TELEMETRY_INCOMPLETE] = incomplete
+
+    @staticmethod
+    def is_telemetry_incomplete(node):
+        """
+        Returns True if the telemetry of the node is known to be partial.
+
+        :param node: InfoGraph node
+        :return: (bool)
+        """
+        if len(node) == 2:
+            return bool(node[1].get(
+                InfoGraphNodeProperty.TELEMETRY_INCOMPLETE, False))
+        return False
 
     @staticmethod
     def get_queries(node):
@@ -187,6 +383,14 @@ class InfoGraphNode(object):
         # if len(node) == 2 and InfoGraphNodeProperty.UTILIZATION in node[1]:
         #     return node[1][InfoGraphNodeProperty.UTILIZATION]
         # return pandas.DataFrame()
+        stored = InfoGraphNode._get_stored_frame(
+            node, InfoGraphNodeProperty.UTILIZATION,
+            InfoGraphNodeProperty.UTILIZATION_COMPUTE,
+            InfoGraphNodeProperty.UTILIZATION_MEMORY,
+            InfoGraphNodeProperty.UTILIZATION_DISK,
+            InfoGraphNodeProperty.UTILIZATION_NETWORK)
+        if stored is not None:
+            return stored
         node_utilization_compute = InfoGraphNode.get_compute_utilization(node)
         node_utilization_memory = InfoGraphNode.get_memory_utilization(node)
         node_utilization_disk = InfoGraphNode.get_disk_utilization(node)
@@ -198,27 +402,35 @@ class InfoGraphNode(object):
 
     @staticmethod
     def get_compute_utilization(node):
+        InfoGraphNode.load_telemetry(node)
         if len(node) == 2 and InfoGraphNodeProperty.UTILIZATION_COMPUTE in node[1]:
             return node[1][InfoGraphNodeProperty.UTILIZATION_COMPUTE]
-        return pandas.DataFrame()
+        return InfoGraphNode._get_stored_frame(
+            node, InfoGraphNodeProperty.UTILIZATION_COMPUTE)
 
     @staticmethod
     def get_memory_utilization(node):
+        InfoGraphNode.load_telemetry(node)
         if len(node) == 2 and InfoGraphNodeProperty.UTILIZATION_MEMORY in node[1]:
             return node[1][InfoGraphNodeProperty.UTILIZATION_MEMORY]
-        return pandas.DataFrame()
+        return InfoGraphNode._get_stored_frame(
+            node, InfoGraphNodeProperty.UTILIZATION_MEMORY)
 
     @staticmethod
     def get_network_utilization(node):
+        InfoGraphNode.load_telemetry(node)
         if len(node) == 2 and InfoGraphNodeProperty.UTILIZATION_NETWORK in node[1]:
             return node[1][InfoGraphNodeProperty.UTILIZATION_NETWORK]
-        return pandas.DataFrame()
+        return InfoGraphNode._get_stored_frame(
+            node, InfoGraphNodeProperty.UTILIZATION_NETWORK)
 
     @staticmethod
     def get_disk_utilization(node):
+        InfoGraphNode.load_telemetry(node)
         if len(node) == 2 and InfoGraphNodeProperty.UTILIZATION_DISK in node[1]:
             return node[1][InfoGraphNodeProperty.UTILIZATION_DISK]
-        return pandas.DataFrame()
+        return InfoGraphNode._get_stored_frame(
+            node, InfoGraphNodeProperty.UTILIZATION_DISK)
 
     @staticmethod
     def set_utilization(node, utilization):
@@ -277,30 +489,46 @@ class InfoGraphNode(object):
 
     @staticmethod
     def get_disk_saturation(node):
+        InfoGraphNode.load_telemetry(node)
         if len(node) == 2 and InfoGraphNodeProperty.SATURATION_DISK in node[1]:
             return node[1][InfoGraphNodeProperty.SATURATION_DISK]
-        return pandas.DataFrame()
+        return InfoGraphNode._get_stored_frame(
+            node, InfoGraphNodeProperty.SATURATION_DISK)
 
     @staticmethod
     def get_compute_saturation(node):
+        InfoGraphNode.load_telemetry(node)
         if len(node) == 2 and InfoGraphNodeProperty.SATURATION_COMPUTE in node[1]:
             return node[1][InfoGraphNodeProperty.SATURATION_COMPUTE]
-        return pandas.DataFrame()
+        return InfoGraphNode._get_stored_frame(
+            node, InfoGraphNodeProperty.SATURATION_COMPUTE)
 
     @staticmethod
     def get_memory_saturation(node):
+        InfoGraphNode.load_telemetry(node)
         if len(node) == 2 and InfoGraphNodeProperty.SATURATION_MEMORY in node[1]:
             return node[1][InfoGraphNodeProperty.SATURATION_MEMORY]
-        return pandas.DataFrame()
+        return InfoGraphNode._get_stored_frame(
+            node, InfoGraphNodeProperty.SATURATION_MEMORY)
 
     @staticmethod
     def get_network_saturation(node):
+        InfoGraphNode.load_telemetry(node)
         if len(node) == 2 and InfoGraphNodeProperty.SATURATION_NETWORK in node[1]:
             return node[1][InfoGraphNodeProperty.SATURATION_NETWORK]
-        return pandas.DataFrame()
+        return InfoGraphNode._get_stored_frame(
+            node, InfoGraphNodeProperty.SATURATION_NETWORK)
 
     @staticmethod
     def get_saturation(node):
+        stored = InfoGraphNode._get_stored_frame(
+            node, InfoGraphNodeProperty.SATURATION,
+            InfoGraphNodeProperty.SATURATION_COMPUTE,
+            InfoGraphNodeProperty.SATURATION_MEMORY,
+            InfoGraphNodeProperty.SATURATION_DISK,
+            InfoGraphNodeProperty.SATURATION_NETWORK)
+        if stored is not None:
+            return stored
         node_saturation_compute = InfoGraphNode.get_compute_saturation(node)
         node_saturation_memory = InfoGraphNode.get_memory_saturation(node)
         node_saturation_disk = InfoGraphNode.get_disk_saturation(node)
@@ -313,9 +541,13 @@ class InfoGraphNode(object):
     def set_attribute(node, key, value):
         if not len(node) == 2:
             raise ValueError("Node format is not correct.")
-        if not isinstance(InfoGraphNode.get_attributes(node), dict):
+        if not isinstance(InfoGraphNode.get_attributes(node), Mapping):
             raise ValueError("Node has no attributes.")
-        node[1]['attributes'][key] = value
+        # Replaced rather than modified in place, as the attributes may be
+        # shared with another graph (see InfoGraph.cow_copy)
+        attributes = dict(node[1]['attributes'])
+        attributes[key] = value
+        node[1]['attributes'] = attributes
 
     @staticmethod
     def set_attributes(node, attributes):
@@ -323,9 +555,9 @@ class InfoGraphNode(object):
             raise ValueError("Node format is not correct.")
 
         # if 'attributes' not in node[1]:
-        node[1]['attributes'] = dict()
-        for key in attributes:
-            node[1]['attributes'][key] = attributes[key]
+        # Copied before being replaced, as attributes may be a view on the
+        # properties of the node itself
+        node[1]['attributes'] = dict(attributes)
 
     @staticmethod
     def set_telemetry_data(node, data):
@@ -334,10 +566,60 @@ class InfoGraphNode(object):
         node[1][InfoGraphNodeProperty.TELEMETRY_DATA] = data
 
     @staticmethod
-    def get_telemetry_data(node):
+    def get_telemetry_data(node, load=True):
+        """
+        Returns the telemetry of the node.
+
+        :param node: InfoGraph node
+        :param load: (bool) if False, telemetry not fetched yet through the
+                            lazy handle of the node is not fetched
+        :return: (pandas.DataFrame)
+        """
+        if load:
+            InfoGraphNode.load_telemetry(node)
         if len(node) == 2 and InfoGraphNodeProperty.TELEMETRY_DATA in node[1]:
             return node[1][InfoGraphNodeProperty.TELEMETRY_DATA]
-        return pandas.DataFrame()
+        return InfoGraphNode._get_stored_frame(
+            node, InfoGraphNodeProperty.TELEMETRY_DATA)
+
+    @staticmethod
+    def has_telemetry_data(node):
+        """
+        Returns True if telemetry has been collected for the node, either
+        stored on the node or in the telemetry store of its graph.
+
+        :param node: InfoGraph node
+        :return: (bool)
+        """
+        InfoGraphNode.load_telemetry(node)
+        if len(node) != 2:
+            return False
+        if node[1].get(InfoGraphNodeProperty.TELEMETRY_DATA) is not None:
+            return True
+        store = node[1].get(InfoGraphNodeProperty.TELEMETRY_STORE)
+        return bool(store) and store.has_node(
+            InfoGraphNodeProperty.TELEMETRY_DATA, node[0])
+
+    @staticmethod
+    def _get_stored_frame(node, key, *overrides):
+        """
+        Returns the view on the telemetry store of the graph for the given
+        kind of data of the node.
+        With overrides, None is returned if any of the override keys is set
+        directly on the node or if the store has no such data: this lets
+        aggregated getters fall back to the per-node frames.
+        With no overrides, an empty DataFrame is returned instead of None.
+        """
+        store = node[1].get(InfoGraphNodeProperty.TELEMETRY_STORE) \
+            if len(node) == 2 else None
+        if overrides:
+            if not store or any(key in node[1] for key in overrides):
+                return None
+            return store.get_frame(key, node[0])
+        frame = store.get_frame(key, node[0]) if store else None
+        if frame is None:
+            return pandas.DataFrame()
+        return frame
 
     @staticmethod
     def get_core_index(node):
@@ -518,10 +800,8 @@ class InfoGraphUtilities():
         :return:
         """
         res = dict()
-        for node in graph.nodes(data=True):
-            node_layer = InfoGraphNode.get_layer(node)
-            if not node_layer == InfoGraphNodeLayer.PHYSICAL:
-                continue
+        for node in InfoGraphUtilities.filter_by_layer(
+                graph, InfoGraphNodeLayer.PHYSICAL):
             allocation = InfoGraphNode.get_attributes(node)['allocation']
             if allocation not in res:
                 res[allocation] = list()
@@ -542,6 +822,9 @@ class InfoGraphUtilities():
                             this layer
         :return: (list of InfoGraphNodes)
         """
+        if hasattr(graph, 'get_nodes_by_layer'):
+            return [(node, graph.node[node])
+                    for node in graph.get_nodes_by_layer(layer)]
         res = list()
         for node in graph.nodes(data=True):
             node_layer = InfoGraphNode.get_layer(node)
@@ -550,6 +833,52 @@ class InfoGraphUtilities():
             res.append(node)
         return res
 
+    @staticmethod
+    def filter_by_types(graph, node_types):
+        """
+        Returns the nodes of the given types.
+
+        :param graph: (InfoGraph)
+        :param node_types: (list of str) the result will include only nodes
+                           of these types
+        :return: (list of InfoGraphNodes)
+        """
+        if hasattr(graph, 'get_nodes_by_type'):
+            return [(node, graph.node[node]) for node_type in node_types
+                    for node in graph.get_nodes_by_type(node_type)]
+        return [node for node in graph.nodes(data=True)
+                if InfoGraphNode.get_type(node) in node_types]
+
+    @staticmethod
+    def prefetch_telemetry(graph, node_types=None, workers=1):
+        """
+        Fetches the telemetry of all the nodes of the graph which have a lazy
+        telemetry handle, for callers which know they need all of it.
+
+        :param graph: (InfoGraph) annotated graph
+        :param node_types: (list of str) if provided, only the nodes of these
+                           types are fetched
+        :param workers: (int) number of threads fetching in parallel
+        :return: None
+        """
+        nodes = [node for node in graph.nodes(data=True)
+                 if not InfoGraphNode.telemetry_loaded(node) and
+                 (not node_types or
+                  InfoGraphNode.get_type(node) in node_types)]
+        if workers <= 1:
+            for node in nodes:
+                InfoGraphNode.load_telemetry(node)
+            return
+
+        def load(node_pool):
+            for pool_node in node_pool:
+                InfoGraphNode.load_telemetry(pool_node)
+
+        threads = [threading.Thread(target=load, args=(nodes[i::workers],))
+                   for i in range(workers)]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+
     @staticmethod
     def get_vnic_on_phnic(graph, node):
         """
@@ -586,6 +915,9 @@ class InfoGraphUtilities():
             res = ast.literal_eval(str(string))
         elif isinstance(string, dict):
             res = string
+        elif isinstance(string, Mapping):
+            # e.g. a read-only view returned by InfoGraphNode.get_attributes
+            res = dict(string)
         return res
 
     @staticmethod
@@ -628,9 +960,7 @@ class InfoGraphUtilities():
         :return: (dict)
         """
         res = dict()
-
-        # Creates a copy of the graph which is undirected
-        undirected_graph = graph.to_undirected()
+        index = AllocationIndex(graph, higher_layer=[InfoGraphNodeLayer.VIRTUAL])
 
         # Group by hostname
         for hostname in hostnames:
@@ -638,26 +968,14 @@ class InfoGraphUtilities():
 
             # Individuate the node representing the physical machine in the graph
             machine_node_name = "{}_machine_0".format(hostname)
-            # node = InfoGraphNode.get_node(machine_node_name)
-            # hostname = InfoGraphNode.get_attributes(node)['allocation']
-
-            try:
-                InfoGraphNode.get_node(undirected_graph, machine_node_name)
-            except KeyError:
-                continue
 
             # Get all virtual machines deployed on the compute node
-            virtual_machines = InfoGraphUtilities.get_neighbors(
-                undirected_graph, machine_node_name,
-                layer=InfoGraphNodeLayer.VIRTUAL)
-
-            for vm in virtual_machines:
-                res[hostname].append(vm)
-                vm_name = InfoGraphNode.get_name(vm)
-                virtual_resources = InfoGraphUtilities.get_neighbors(
-                    undirected_graph, vm_name,
-                    layer=InfoGraphNodeLayer.VIRTUAL)
-                for virtual_resource in virtual_resources:
-                    res[hostname].append(virtual_resource)
+            for vm_name in index.hosted.get(machine_node_name, []):
+                res[hostname].append(InfoGraphNode.get_node(graph, vm_name))
+                for neighbour in index.neighbours(vm_name):
+                    node = InfoGraphNode.get_node(graph, neighbour)
+                    if InfoGraphNode.get_layer(node) == \
+                            InfoGraphNodeLayer.VIRTUAL:
+                        res[hostname].append(node)
         return res
 
@@ -0,0 +1,260 @@
+# Copyright (c) 2017, Intel Research and Development Ireland Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = 'Giuliana Carullo'
+__copyright__ = "Copyright (c) 2017, Intel Research and Development Ireland Ltd."
+__license__ = "Apache 2.0"
+__maintainer__ = "Giuliana Carullo"
+__email__ = "giuliana.carullo@intel.com"
+__status__ = "Development"
+
+import numpy
+import pandas
+from analytics_engine import common
+
+LOG = common.LOG
+
+TIMESTAMP = 'timestamp'
+
+
+class RingBufferSeries(object):
+    """
+    Time series of a single metric holding at most capacity samples.
+    Timestamps and values are stored in two preallocated arrays used as a
+    ring: once full, each new sample replaces the oldest one, so that the
+    memory used is fixed (see nbytes) and appends are O(1).
+    Samples are expected in timestamp order, which lets windows be found
+    by binary search.
+    """
+
+    __slots__ = ('name', '_timestamps', '_values', '_start', '_size')
+
+    def __init__(self, capacity, name=None):
+        """
+        :param capacity: (int) maximum number of samples kept
+        :param name: (str) name of the metric
+        """
+        if int(capacity) <= 0:
+            raise ValueError("Capacity must be positive")
+        self.name = name
+        self._timestamps = numpy.zeros(int(capacity), dtype=float)
+        self._values = numpy.zeros(int(capacity), dtype=float)
+        self._start = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def capacity(self):
+        return len(self._values)
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by the samples, fixed at creation time.
+        """
+        return self._timestamps.nbytes + self._values.nbytes
+
+    @property
+    def last_timestamp(self):
+        """
+        Timestamp of the latest sample, None if the series is empty.
+        """
+        if not self._size:
+            return None
+        return self._timestamps[(self._start + self._size - 1) %
+                                self.capacity]
+
+    def append(self, timestamp, value):
+        """
+        Adds a sample, dropping the oldest one if the series is full.
+
+        :param timestamp: (float) epoch, not earlier than the last sample
+        :param value: (float)
+        :return: None
+        """
+        last = self.last_timestamp
+        if last is not None and timestamp < last:
+            raise ValueError("Sample at {} is older than the last sample "
+                             "of {} at {}".format(timestamp, self.name, last))
+        end = (self._start + self._size) % self.capacity
+        self._timestamps[end] = timestamp
+        self._values[end] = value
+        if self._size < self.capacity:
+            self._size += 1
+        else:
+            self._start = (self._start + 1) % self.capacity
+
+    def extend(self, timestamps, values):
+        """
+        Adds the samples in order, as many appends would.
+
+        :param timestamps: (list of float) sorted epochs
+        :param values: (list of float)
+        :return: None
+        """
+        timestamps = numpy.asarray(timestamps, dtype=float)
+        values = numpy.asarray(values, dtype=float)
+        if len(timestamps) != len(values):
+            raise ValueError("Timestamps and values differ in length")
+        if not len(timestamps):
+            return
+        last = self.last_timestamp
+        if (last is not None and timestamps[0] < last) or \
+                (numpy.diff(timestamps) < 0).any():
+            raise ValueError("Samples of {} are not in timestamp order".
+                             format(self.name))
+        # Only the latest capacity samples can be kept
+        timestamps = timestamps[-self.capacity:]
+        values = values[-self.capacity:]
+        positions = (self._start + self._size +
+                     numpy.arange(len(values))) % self.capacity
+        self._timestamps[positions] = timestamps
+        self._values[positions] = values
+        overflow = max(0, self._size + len(values) - self.capacity)
+        self._size = min(self.capacity, self._size + len(values))
+        self._start = (self._start + overflow) % self.capacity
+
+    def _ordered(self):
+        positions = (self._start + numpy.arange(self._size)) % self.capacity
+        return self._timestamps[positions], self._values[positions]
+
+    def window(self, ts_from=None, ts_to=None):
+        """
+        Returns the samples between ts_from and ts_to, both included.
+
+        :param ts_from: (float) epoch, from the oldest sample if None
+        :param ts_to: (float) epoch, up to the latest sample if None
+        :return: (tuple of numpy.ndarray) timestamps and values
+        """
+        timestamps, values = self._ordered()
+        start = 0 if ts_from is None else \
+            numpy.searchsorted(timestamps, ts_from, side='left')
+        stop = len(timestamps) if ts_to is None else \
+            numpy.searchsorted(timestamps, ts_to, side='right')
+        return timestamps[start:stop], values[start:stop]
+
+    def mean(self, ts_from=None, ts_to=None):
+        """
+        Mean of the samples in the window, ignoring missing values.
+        """
+        values = self.window(ts_from, ts_to)[1]
+        return numpy.nanmean(values) if len(values) else numpy.nan
+
+    def max(self, ts_from=None, ts_to=None):
+        """
+        Maximum of the samples in the window, ignoring missing values.
+        """
+        values = self.window(ts_from, ts_to)[1]
+        return numpy.nanmax(values) if len(values) else numpy.nan
+
+    def percentile(self, q, ts_from=None, ts_to=None):
+        """
+        Percentile of the samples in the window, ignoring missing values.
+
+        :param q: (float) percentile, between 0 and 100
+        """
+        values = self.window(ts_from, ts_to)[1]
+        return numpy.nanpercentile(values, q) if len(values) else numpy.nan
+
+    def to_series(self, ts_from=None, ts_to=None):
+        """
+        :return: (pandas.Series) samples in the window indexed by timestamp
+        """
+        timestamps, values = self.window(ts_from, ts_to)
+        return pandas.Series(values, name=self.name,
+                             index=pandas.Index(timestamps, name=TIMESTAMP))
+
+
+class RingBufferFrame(object):
+    """
+    Set of RingBufferSeries, one per metric, with the same capacity.
+    Rows appended from a DataFrame are split into the series of their
+    columns, missing values being skipped, so that each metric only uses
+    its own samples of capacity.
+    """
+
+    __slots__ = ('capacity', 'series', 'last_timestamp')
+
+    def __init__(self, capacity):
+        """
+        :param capacity: (int) maximum number of samples kept per metric
+        """
+        if int(capacity) <= 0:
+            raise ValueError("Capacity must be positive")
+        self.capacity = int(capacity)
+        self.series = dict()
+        self.last_timestamp = None
+
+    @property
+    def nbytes(self):
+        return sum(series.nbytes for series in self.series.values())
+
+    def append_frame(self, frame):
+        """
+        Adds the rows of the frame later than the rows already added.
+
+        :param frame: (pandas.DataFrame) either with a 'timestamp' column,
+                      as the telemetry of the nodes, or indexed by
+                      timestamp, as utilization and saturation
+        :return: None
+        """
+        if frame is None or frame.empty:
+            return
+        if TIMESTAMP in frame.columns:
+            timestamps = pandas.to_numeric(frame[TIMESTAMP]).values
+            frame = frame.drop(TIMESTAMP, axis=1)
+        elif frame.index.name == TIMESTAMP:
+            timestamps = numpy.asarray(frame.index, dtype=float)
+        else:
+            raise ValueError("Frame has no timestamps")
+        order = numpy.argsort(timestamps, kind='mergesort')
+        timestamps = timestamps[order]
+        if self.last_timestamp is not None:
+            order = order[timestamps > self.last_timestamp]
+            timestamps = timestamps[timestamps > self.last_timestamp]
+        if not len(order):
+            return
+        for column in frame.columns:
+            values = pandas.to_numeric(frame[column], errors='coerce').\
+                values[order].astype(float)
+            sampled = ~numpy.isnan(values)
+            if not sampled.any():
+                continue
+            if column not in self.series:
+                self.series[column] = RingBufferSeries(self.capacity, column)
+            self.series[column].extend(timestamps[sampled], values[sampled])
+        self.last_timestamp = timestamps[-1]
+
+    def to_frame(self, ts_from=None, ts_to=None, timestamp_column=False):
+        """
+        Returns the samples in the window, one column per metric.
+
+        :param timestamp_column: (bool) if True timestamps are returned as a
+                                 column of strings, as in the telemetry of
+                                 the nodes, otherwise as index
+        :return: (pandas.DataFrame)
+        """
+        columns = [series.to_series(ts_from, ts_to)
+                   for series in self.series.values()]
+        columns = [column for column in columns if len(column)]
+        if not columns:
+            return pandas.DataFrame()
+        res = pandas.concat(columns, axis=1).sort_index()
+        res.index.name = TIMESTAMP
+        if timestamp_column:
+            res = res.reset_index()
+            res[TIMESTAMP] = res[TIMESTAMP].round().astype(int).astype(str)
+        return res
@@ -0,0 +1,357 @@
+# Copyright (c) 2017, Intel Research and Development Ireland Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = 'Giuliana Carullo'
+__copyright__ = "Copyright (c) 2017, Intel Research and Development Ireland Ltd."
+__license__ = "Apache 2.0"
+__maintainer__ = "Giuliana Carullo"
+__email__ = "giuliana.carullo@intel.com"
+__status__ = "Development"
+
+import numpy
+import pandas
+from analytics_engine import common
+from analytics_engine.heuristics.beans.infograph import InfoGraphNodeProperty
+
+LOG = common.LOG
+
+TIMESTAMP = 'timestamp'
+
+
+class TelemetryStoreSection(object):
+    """
+    One kind of telemetry (raw telemetry, utilization or saturation) for all
+    the nodes of a graph, stored in a single float array.
+    Each node has its own block of rows, one row per timestamp at which the
+    node has samples, so that nodes sampled at different times are not
+    padded to each other's timestamps. Within the block of a node the
+    values are laid out column by column, the columns of each group (i.e.
+    utilization category) being contiguous: the data of a node, and of each
+    of its groups, is a slice of the array.
+    """
+
+    def __init__(self, values, timestamps, columns, nodes, groups, rows):
+        """
+        :param values: (numpy.ndarray) values of all the columns, one after
+                       the other, each column having the rows of its node
+        :param timestamps: (numpy.ndarray) timestamps of the rows of all the
+                           nodes, one node after the other
+        :param columns: (list of str) metric name of each column
+        :param nodes: (dict) node name -> (start, stop) column range
+        :param groups: (dict) (node name, group) -> (start, stop) column range
+        :param rows: (dict) node name -> (start, stop) range of its rows in
+                     timestamps
+        """
+        self.values = values
+        self.timestamps = timestamps
+        self.columns = columns
+        self.nodes = nodes
+        self.groups = groups
+        self.rows = rows
+        # Metric and node of each column, for whole-section reductions
+        self.metrics = numpy.array(columns, dtype=object)
+        self.owners = numpy.empty(len(columns), dtype=object)
+        lengths = numpy.zeros(len(columns), dtype=numpy.int64)
+        for node_name, (start, stop) in nodes.items():
+            self.owners[start:stop] = node_name
+            row_start, row_stop = rows[node_name]
+            lengths[start:stop] = row_stop - row_start
+        # Column i is values[offsets[i]:offsets[i + 1]]
+        self.offsets = numpy.concatenate([[0], numpy.cumsum(lengths)]).\
+            astype(numpy.int64)
+
+    def get_timestamps(self, node_name):
+        """
+        :return: (numpy.ndarray) timestamps of the rows of the node
+        """
+        start, stop = self.rows[node_name]
+        return self.timestamps[start:stop]
+
+    def get_block(self, node_name, start, stop):
+        """
+        Returns a view on the columns start to stop, all of the node.
+
+        :return: (numpy.ndarray) rows x columns array
+        """
+        row_start, row_stop = self.rows[node_name]
+        return self.values[self.offsets[start]:self.offsets[stop]].reshape(
+            stop - start, row_stop - row_start).T
+
+
+class TelemetryStore(object):
+    """
+    Columnar telemetry of a whole graph.
+
+    The per-node DataFrames set by the telemetry annotation are moved into a
+    few arrays, one per kind of telemetry, each node keeping its own rows;
+    node accessors of InfoGraphNode then return read-only views on those
+    arrays.
+    """
+
+    # Section -> groups, in the order they are laid out for each node
+    SECTIONS = {
+        InfoGraphNodeProperty.TELEMETRY_DATA: [
+            InfoGraphNodeProperty.TELEMETRY_DATA],
+        InfoGraphNodeProperty.UTILIZATION: [
+            InfoGraphNodeProperty.UTILIZATION_COMPUTE,
+            InfoGraphNodeProperty.UTILIZATION_MEMORY,
+            InfoGraphNodeProperty.UTILIZATION_DISK,
+            InfoGraphNodeProperty.UTILIZATION_NETWORK],
+        InfoGraphNodeProperty.SATURATION: [
+            InfoGraphNodeProperty.SATURATION_COMPUTE,
+            InfoGraphNodeProperty.SATURATION_MEMORY,
+            InfoGraphNodeProperty.SATURATION_DISK,
+            InfoGraphNodeProperty.SATURATION_NETWORK]
+    }
+
+    def __init__(self):
+        self.sections = dict()
+
+    @staticmethod
+    def get_store(graph):
+        """
+        Returns the store attached to the graph, if any.
+
+        :param graph: (InfoGraph)
+        :return: (TelemetryStore) or None
+        """
+        return graph.graph.get(InfoGraphNodeProperty.TELEMETRY_STORE)
+
+    @staticmethod
+    def attach(graph):
+        """
+        Moves the telemetry, utilization and saturation DataFrames of the
+        nodes of the graph into a new store attached to the graph.
+        Frames which cannot be aligned on timestamps or which hold non
+        numeric data are left on the nodes.
+        Telemetry still to be fetched through lazy handles is not fetched.
+
+        :param graph: (InfoGraph) annotated graph
+        :return: (TelemetryStore)
+        """
+        nodes = graph.nodes(data=True)
+        store = TelemetryStore.build(nodes)
+        for node in nodes:
+            for section, groups in TelemetryStore.SECTIONS.items():
+                for group in groups:
+                    if store.has_group(section, node[0], group):
+                        node[1].pop(group, None)
+            node[1][InfoGraphNodeProperty.TELEMETRY_STORE] = store
+        graph.graph[InfoGraphNodeProperty.TELEMETRY_STORE] = store
+        return store
+
+    @staticmethod
+    def build(nodes, sections=None, coerce=False):
+        """
+        Returns a store holding a copy of the DataFrames of the given nodes,
+        leaving the nodes untouched.
+
+        :param nodes: (list of InfoGraph nodes)
+        :param sections: (list of str) sections to be built, all by default
+        :param coerce: (bool) if True non numeric values are stored as NaN
+                       instead of leaving the whole frame out of the store
+        :return: (TelemetryStore)
+        """
+        # section -> node name -> list of (group, timestamps, columns, values)
+        collected = dict()
+        for node in nodes:
+            node_timestamps = TelemetryStore._node_timestamps(node)
+            for section, groups in TelemetryStore.SECTIONS.items():
+                if sections and section not in sections:
+                    continue
+                for group in groups:
+                    frame = node[1].get(group)
+                    if not isinstance(frame, pandas.DataFrame):
+                        continue
+                    aligned = TelemetryStore._align(
+                        frame, node_timestamps, coerce)
+                    if aligned is None:
+                        continue
+                    collected.setdefault(section, dict()).setdefault(
+                        node[0], list()).append((group,) + aligned)
+
+        store = TelemetryStore()
+        for section, node_frames in collected.items():
+            store._add_section(section, node_frames)
+        return store
+
+    @staticmethod
+    def _node_timestamps(node):
+        telemetry = node[1].get(InfoGraphNodeProperty.TELEMETRY_DATA)
+        if isinstance(telemetry, pandas.DataFrame) and \
+                TIMESTAMP in telemetry.columns:
+            return telemetry[TIMESTAMP]
+        return None
+
+    @staticmethod
+    def _align(frame, node_timestamps, coerce=False):
+        """
+        Returns the timestamps and the metric columns of the frame, or None
+        if the frame cannot be stored.
+        """
+        if TIMESTAMP in frame.columns:
+            timestamps = frame[TIMESTAMP]
+            frame = frame.drop(TIMESTAMP, axis=1)
+        elif frame.index.name == TIMESTAMP:
+            timestamps = frame.index
+        elif node_timestamps is not None and \
+                len(node_timestamps) == len(frame):
+            # Derived from the node telemetry row by row
+            timestamps = node_timestamps
+        elif frame.empty:
+            timestamps = []
+        else:
+            return None
+        try:
+            timestamps = numpy.asarray(timestamps, dtype=float)
+            values = frame.values.astype(float)
+        except (TypeError, ValueError):
+            if not coerce:
+                return None
+            try:
+                timestamps = numpy.asarray(
+                    pandas.to_numeric(timestamps, errors='coerce'),
+                    dtype=float)
+            except TypeError:
+                return None
+            values = frame.apply(pandas.to_numeric, errors='coerce').\
+                values.astype(float)
+        valid = ~numpy.isnan(timestamps)
+        return timestamps[valid], list(frame.columns), values[valid]
+
+    def _add_section(self, section, node_frames):
+        timestamp_column = section == InfoGraphNodeProperty.TELEMETRY_DATA
+        columns = list()
+        nodes = dict()
+        groups = dict()
+        rows = dict()
+        blocks = list()
+        all_timestamps = list()
+        n_rows = 0
+        for node_name, entries in node_frames.items():
+            node_timestamps = numpy.unique(numpy.concatenate(
+                [entry[1] for entry in entries]))
+            start = len(columns)
+            # The raw telemetry keeps its timestamp column, as on the nodes
+            with_timestamp = timestamp_column and \
+                any(entry[2] for entry in entries)
+            if with_timestamp:
+                columns.append(TIMESTAMP)
+            for group, timestamps, frame_columns, values in entries:
+                groups[(node_name, group)] = \
+                    (len(columns), len(columns) + len(frame_columns))
+                columns.extend(frame_columns)
+            nodes[node_name] = (start, len(columns))
+            rows[node_name] = (n_rows, n_rows + len(node_timestamps))
+            n_rows += len(node_timestamps)
+            all_timestamps.append(node_timestamps)
+
+            # Column by column: columns x rows of the node
+            block = numpy.full((len(columns) - start, len(node_timestamps)),
+                               numpy.nan)
+            if with_timestamp:
+                block[0] = node_timestamps
+            for group, timestamps, frame_columns, frame_values in entries:
+                group_start, group_stop = groups[(node_name, group)]
+                group_rows = numpy.searchsorted(node_timestamps, timestamps)
+                block[group_start - start:group_stop - start, group_rows] = \
+                    frame_values.T
+            blocks.append(block.ravel())
+
+        values = numpy.concatenate(blocks) if blocks \
+            else numpy.array([], dtype=float)
+        timestamps = numpy.concatenate(all_timestamps) if all_timestamps \
+            else numpy.array([], dtype=float)
+        values.setflags(write=False)
+        timestamps.setflags(write=False)
+        self.sections[section] = TelemetryStoreSection(
+            values, timestamps, columns, nodes, groups, rows)
+
+    def has_node(self, section, node_name):
+        """
+        :param section: (str) InfoGraphNodeProperty of the section
+        :param node_name: (str)
+        :return: (bool) True if the section holds data for the node
+        """
+        return section in self.sections and \
+            node_name in self.sections[section].nodes
+
+    def has_group(self, section, node_name, group):
+        """
+        :return: (bool) True if the section holds the given group of data
+                 (e.g. UTILIZATION_DISK) for the node
+        """
+        return section in self.sections and \
+            (node_name, group) in self.sections[section].groups
+
+    def get_frame(self, key, node_name):
+        """
+        Returns a read-only view on the data of a node.
+
+        :param key: (str) InfoGraphNodeProperty of either a section
+                    (e.g. UTILIZATION) or a group (e.g. UTILIZATION_DISK)
+        :param node_name: (str)
+        :return: (pandas.DataFrame) or None if the store has no such data
+        """
+        for section_name, groups in self.SECTIONS.items():
+            if key == section_name:
+                section = self.sections.get(section_name)
+                column_range = section.nodes.get(node_name) \
+                    if section else None
+                break
+            if key in groups:
+                section = self.sections.get(section_name)
+                column_range = section.groups.get((node_name, key)) \
+                    if section else None
+                break
+        else:
+            raise ValueError("Telemetry store has no data of kind {}".
+                             format(key))
+        if column_range is None:
+            return None
+        start, stop = column_range
+        # Raw telemetry carries the timestamps as a column, as on the nodes
+        index = None if TIMESTAMP in section.columns[start:stop] \
+            else pandas.Index(section.get_timestamps(node_name),
+                              name=TIMESTAMP)
+        return pandas.DataFrame(section.get_block(node_name, start, stop),
+                                index=index,
+                                columns=section.columns[start:stop])
+
+    def metric_means(self, section, metric):
+        """
+        Returns the mean of a metric for all the nodes reporting it, computed
+        in a single pass over the section.
+
+        :param section: (str) InfoGraphNodeProperty of the section
+        :param metric: (str) metric name
+        :return: (pandas.Series) mean indexed by node name
+        """
+        store_section = self.sections.get(section)
+        if not store_section:
+            return pandas.Series()
+        positions = numpy.flatnonzero(store_section.metrics == metric)
+        values = store_section.values
+        sampled = ~numpy.isnan(values)
+        # Sums over the range of each column as differences of prefix sums
+        value_sums = numpy.concatenate(
+            [[0], numpy.cumsum(numpy.where(sampled, values, 0))])
+        sample_counts = numpy.concatenate([[0], numpy.cumsum(sampled)])
+        starts = store_section.offsets[positions]
+        stops = store_section.offsets[positions + 1]
+        sums = value_sums[stops] - value_sums[starts]
+        counts = sample_counts[stops] - sample_counts[starts]
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts
+        return pandas.Series(means, index=store_section.owners[positions])
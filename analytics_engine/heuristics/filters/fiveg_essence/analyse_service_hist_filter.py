@@ -62,30 +62,25 @@ class AnalyseServiceHistoryFilter(Filter):
                         if vm_name:
                             node_id = vm_name
                 if not node_tm.empty:
-                    tm = telemetry.get(node_id)
-                    if not isinstance(tm, pd.DataFrame):
-                    #if not tm:
-                        telemetry[node_id] = node_tm
-                        #telemetry[node_id] = [node_tm]
-                        #node_tm.to_csv(tmp_path+node_id, index=False)
-                    else:
-                        telemetry[node_id] = pd.concat([tm, node_tm])
-                        #telemetry[node_id].append(node_tm)
-                        #node_tm.to_csv(tmp_path + node_id, mode='a', header=False, index=False)
+                    # Frames are concatenated once per node, below, instead
+                    # of growing a frame for each subgraph
+                    telemetry.setdefault(node_id, list()).append(node_tm)
                 InfoGraphNode.set_telemetry_data(node, pd.DataFrame())
+        for node_id, node_tms in telemetry.items():
+            telemetry[node_id] = pd.concat(node_tms) \
+                if len(node_tms) > 1 else node_tms[0]
         print "Data merger finished " + str(time.time())
         print telemetry.keys()
         print len(telemetry)
         # merge subgraphs
-        graph = None
+        merger = graphs.GraphMerger()
         counter = 0
         for subgraph in service_subgraphs:
             counter = counter + 1
-            if not graph and len(subgraph.nodes()) > 0:
-                graph = subgraph
-            elif len(subgraph.nodes()) > 0:
-                graphs.merge_graph(graph, subgraph)
+            if len(subgraph.nodes()) > 0:
+                merger.add(subgraph)
             #print "Merged {} subgraphs out of {} subgraphs in all".format(counter, len(service_subgraphs))
+        graph = merger.merged()
         # merge telemetry data
 
         #for key in telemetry.keys():
@@ -26,10 +26,13 @@ from analytics_engine.infrastructure_manager.config_helper import ConfigHelper
 from analytics_engine.infrastructure_manager import landscape
 from analytics_engine.heuristics.beans.infograph import InfoGraphNode, InfoGraphUtilities
 import time
+import Queue
+import threading
 import cProfile
 
 LOG = common.LOG
 SUBGRAPH_LIMIT = 25
+FETCH_WORKERS = 5
 
 
 class ServiceHistorySubgraphFilter(Filter):
@@ -55,28 +58,12 @@ class ServiceHistorySubgraphFilter(Filter):
             res = sge.get_hist_service_nodes(service_type, workload.get_workload_name())
             nodes = [(node[0], InfoGraphNode.get_attributes(node).get('from'), InfoGraphNode.get_attributes(node).get('to')) for node in res.nodes(data=True)]
             nodes.sort(reverse=True, key=self.node_sort)
-            #pr = cProfile.Profile()
-            counter = 0
-            for node in nodes:
-                #pr.enable()
-                node_id = node[0]
-                from_ts = int(time.time())
-                # to_ts = int(attrs['to'])
-                tf = from_ts * -1
-                subgraph = landscape.get_subgraph(node_id, from_ts, tf)
-                if len(subgraph.nodes()) > 0:
-                    annotated_subgraph = SubgraphUtilities.graph_telemetry_annotation(subgraph, node[1],
-                                                                                      node[2],
-                                                                                      telemetry_system)
-                    service_subgraphs.append(annotated_subgraph)
-                #print "cProfile Stats"+node_id
-                #print "=============="
-                #pr.print_stats(sort='time')
-                #print "=============="
-                #pr.disable()
-                counter = counter + 1
-                if counter == SUBGRAPH_LIMIT:
-                    break
+            limit = int(self._conf('limit', SUBGRAPH_LIMIT))
+            if limit > 0:
+                nodes = nodes[:limit]
+            workers = int(self._conf('workers', FETCH_WORKERS))
+            service_subgraphs = self._fetch_and_annotate(
+                nodes, workers, telemetry_system)
         except Exception as e:
                 LOG.error(e)
                 LOG.error("No topology data has been found for the selected "
@@ -87,5 +74,61 @@ class ServiceHistorySubgraphFilter(Filter):
         workload.save_results(self.__filter_name__, service_subgraphs)
         return service_subgraphs
 
+    def _fetch_and_annotate(self, nodes, workers, telemetry_system):
+        """
+        Fetches the subgraphs of the nodes with a pool of threads and
+        annotates each subgraph as soon as it is fetched, while the others
+        are still being fetched.
+
+        :param nodes: (list) tuples of node id, from and to timestamps
+        :param workers: (int) number of subgraphs fetched concurrently
+        :param telemetry_system: (str) telemetry system used to annotate
+        :return: (list) annotated subgraphs, in the order of the nodes
+        """
+        pending = Queue.Queue()
+        fetched = Queue.Queue()
+        for position, node in enumerate(nodes):
+            pending.put((position, node))
+
+        def fetch():
+            while True:
+                try:
+                    position, node = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    from_ts = int(time.time())
+                    # to_ts = int(attrs['to'])
+                    tf = from_ts * -1
+                    subgraph = landscape.get_subgraph(node[0], from_ts, tf)
+                    fetched.put((position, node, subgraph, None))
+                except Exception as e:
+                    fetched.put((position, node, None, e))
+
+        threads = [threading.Thread(target=fetch)
+                   for _ in range(max(1, min(workers, len(nodes))))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        annotated = dict()
+        for _ in range(len(nodes)):
+            position, node, subgraph, error = fetched.get()
+            if error is not None:
+                raise error
+            if len(subgraph.nodes()) > 0:
+                annotated[position] = \
+                    SubgraphUtilities.graph_telemetry_annotation(
+                        subgraph, node[1], node[2], telemetry_system)
+        return [annotated[position] for position in sorted(annotated)]
+
+    @staticmethod
+    def _conf(attribute, default):
+        try:
+            value = ConfigHelper.get("SERVICE_HISTORY", attribute)
+        except Exception:
+            value = None
+        return value or default
+
     def node_sort(self, elem):
         return elem[1]
\ No newline at end of file
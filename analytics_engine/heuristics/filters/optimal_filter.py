@@ -45,8 +45,10 @@ class OptimalFilter(Filter):
         if not graph:
             raise KeyError('No graph to be processed.')
 
-        scores = LandscapeScore.utilization_scores(graph)
-        scores_sat = LandscapeScore.saturation_scores(graph)
+        node_types = OptimalFilter.ranked_node_types(workload,
+                                                     optimal_node_type)
+        scores = LandscapeScore.utilization_scores(graph, node_types)
+        scores_sat = LandscapeScore.saturation_scores(graph, node_types)
         heuristic_results = pd.DataFrame(columns=['node_name', 'type', 'ipaddress', 
                                                   'compute utilization', 'compute saturation',
                                                   'memory utilization', 'memory saturation',
@@ -62,6 +64,7 @@ class OptimalFilter(Filter):
             heuristic_results[device_id_col_name] = None
 
         telemetry_filter = workload_config.get('telemetry_filter')
+        incomplete = list()
         for node in graph.nodes(data=True):
             node_name = InfoGraphNode.get_name(node)
             node_type = InfoGraphNode.get_type(node)
@@ -87,11 +90,14 @@ class OptimalFilter(Filter):
                     if project == 'mf2c':
                         dev_id = dev_id.replace('_', '-')
                     data[device_id_col_name] = dev_id
-                if InfoGraphNode.get_properties(node).get("telemetry_data") is not None:
+                if InfoGraphNode.is_telemetry_incomplete(node):
+                    # Telemetry not collected within the deadline
+                    incomplete.append(list_node_name)
+                if InfoGraphNode.has_telemetry_data(node):
                     heuristic_results = heuristic_results.append(data,
                                                         ignore_index=True)
                 elif not telemetry_filter:
-                    heuristic_results_nt = heuristic_results.append(data,
+                    heuristic_results_nt = heuristic_results_nt.append(data,
                                                         ignore_index=True)
 
             if not workload.get_workload_name().startswith('optimal_'):
@@ -125,10 +131,30 @@ class OptimalFilter(Filter):
         heuristic_results_nt = heuristic_results_nt.replace([0], [None])
         heuristic_results = heuristic_results.sort_values(by=sort_fields, ascending=True)
         heuristic_results = heuristic_results.append(heuristic_results_nt, ignore_index=True)
+        if incomplete:
+            LOG.warning('Telemetry of {} ranked nodes is incomplete'.
+                        format(len(incomplete)))
+            heuristic_results['telemetry incomplete'] = \
+                heuristic_results['node_name'].isin(incomplete)
         workload.append_metadata(self.__filter_name__, heuristic_results)
         LOG.info('AVG: {}'.format(heuristic_results))
         return heuristic_results
 
+    @staticmethod
+    def ranked_node_types(workload, optimal_node_type='machine'):
+        """
+        Returns the types of the nodes ranked for the workload.
+
+        :param workload: Contains workload related info and results.
+        :param optimal_node_type: (str) type of the nodes to be ranked
+        :return: (list of str)
+        """
+        node_types = [optimal_node_type]
+        if not workload.get_workload_name().startswith('optimal_') and \
+                optimal_node_type == 'machine':
+            node_types.append("docker_container")
+        return node_types
+
 
 
 
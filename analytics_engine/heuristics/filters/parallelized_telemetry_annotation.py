@@ -26,7 +26,7 @@ from analytics_engine.heuristics.beans.infograph import \
     InfoGraphNode, InfoGraphUtilities, InfoGraphNodeType, InfoGraphNodeLayer
 from analytics_engine.heuristics.infrastructure.telemetry.snap_telemetry.snap_graph_telemetry import SnapAnnotation
 from analytics_engine.heuristics.infrastructure.telemetry.prometheus.prometheus_annotation import PrometheusAnnotation
-from analytics_engine.utilities import misc
+from analytics_engine.infrastructure_manager import graphs
 import multiprocessing
 import threading
 import subprocess
@@ -67,7 +67,7 @@ class TelemetryAnnotation():
                             ts_to,
                             utilization=True,
                             saturation=True):
-        internal_graph = graph.copy()
+        internal_graph = graphs.cow_copy(graph)
         i = 0
         threads = []
         cpu_count = multiprocessing.cpu_count()
@@ -94,13 +94,8 @@ class TelemetryAnnotation():
         [t.start() for t in threads]
         [t.join() for t in threads]
 
-        for node in internal_graph.nodes(data=True):
-            if InfoGraphNode.get_type(node) == InfoGraphNodeType.PHYSICAL_PU:
-                self.utils.annotate_machine_pu_util(internal_graph, node)
-            elif InfoGraphNode.node_is_disk(node):
-                self.utils.annotate_machine_disk_util(internal_graph, node)
-            elif InfoGraphNode.node_is_nic(node):
-                self.utils.annotate_machine_network_util(internal_graph, node)
+        self.utils.annotate_machine_utils(internal_graph,
+                                          internal_graph.nodes(data=True))
         return internal_graph
 
 
@@ -298,39 +293,44 @@ class ParallelTelemetryAnnotation(threading.Thread):
         Returns the graph filtered removing all the nodes with no telemetry
         """
         template_mapping = dict()
+        # node_name attribute -> nodes (see name_filtering_support)
+        named_nodes = dict()
 
-        res = graph.copy()
+        res = graphs.cow_copy(graph)
         for node in res.nodes(data=True):
-            # for p in node[1]['attributes']:
-            #     p = str(p)
             template = node[1]['attributes']['template'] \
                 if 'template' in node[1]['attributes'] else None
 
             # If node is a service node, need to remove the template
+            # The attributes are shared with the graph being filtered:
+            # they are replaced, never modified in place
             if template:
                 template_mapping[InfoGraphNode.get_name(node)] = template
-                node[1]['attributes'].pop('template')
-
-            # Fix format for conversion to JSON (happening in analytics)
-            node[1]['attributes'] = \
-                str(misc.convert_unicode_dict_to_string(node[1]['attributes'])).\
-                    replace("'", '"')
-
+                node[1]['attributes'] = dict(
+                    (key, value) for key, value in
+                    node[1]['attributes'].items() if key != 'template')
+
+            if 'node_name' in node[1]['attributes']:
+                named_nodes.setdefault(
+                    node[1]['attributes']['node_name'], list()).append(
+                    InfoGraphNode.get_name(node))
+
+        # Same nodes as res.filter_nodes('node_name', node_name) for each
+        # node with no telemetry, selected in a single pass
+        to_be_filtered = list()
         for node in res.nodes(data=True):
             node_name = InfoGraphNode.get_name(node)
             telemetry = InfoGraphNode.get_telemetry_data(node)
             layer = InfoGraphNode.get_layer(node)
-            # if len(telemetry.columns.values) <= 1:
 
             if len(telemetry.columns) <= 1 and \
                     not layer == InfoGraphNodeLayer.SERVICE:
                 InfoGraphNode.set_telemetry_data(node, dict())
-                res.filter_nodes('node_name', node_name)
+                to_be_filtered.extend(named_nodes.get(node_name, []))
+        res.filter_node_list(to_be_filtered)
 
-        # Convert attributes back to dict()
         for node in res.nodes(data=True):
-            string = InfoGraphNode.get_attributes(node)
-            attrs = InfoGraphUtilities.str_to_dict(string)
+            attrs = dict(InfoGraphNode.get_attributes(node))
             if InfoGraphNode.get_type(node) == \
                     InfoGraphNodeType.SERVICE_COMPUTE:
                 attrs['template'] = \
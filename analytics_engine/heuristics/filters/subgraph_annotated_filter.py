@@ -36,13 +36,27 @@ class SubgraphAnnotatedFilter(Filter):
     """
     __filter_name__ = 'subgraph_annotated_filter'
 
-    def run(self, workload, telemetry_type = "snap"):
+    def run(self, workload, telemetry_type = "snap", lazy=False,
+            columnar=False, previous=None, deadline=None, node_types=None):
         """
         Annotates subgraph present in metadata with telemetry
 
          Add the output of the calculation to the metadata as output
 
         :param workload: Contains workload related info and results.
+        :param lazy: (bool) if True, telemetry of each node is fetched
+                     only when first accessed
+        :param columnar: (bool) if True, telemetry is kept in a graph-wide
+                         TelemetryStore instead of per-node DataFrames
+        :param previous: (InfoGraph) subgraph annotated by a previous run
+                         over an earlier window of the same workload: only
+                         the telemetry after that window is fetched and the
+                         telemetry before the new window is dropped
+        :param deadline: (float) epoch by which the subgraph has to be
+                         annotated, nodes not annotated in time being marked
+                         as telemetry incomplete
+        :param node_types: (list of str) with a deadline, types of the
+                           nodes to be annotated first and only
         :return: subgraph
         """
         
@@ -50,7 +64,9 @@ class SubgraphAnnotatedFilter(Filter):
         if not graph:
             raise KeyError()
         subgraph = SubgraphUtilities.graph_telemetry_annotation(
-                        graph, workload.get_ts_from(), workload.get_ts_to(), telemetry_type)
+                        graph, workload.get_ts_from(), workload.get_ts_to(), telemetry_type,
+                        lazy=lazy, columnar=columnar, previous=previous,
+                        deadline=deadline, node_types=node_types)
 
         workload.save_results(self.__filter_name__, subgraph)
         return subgraph
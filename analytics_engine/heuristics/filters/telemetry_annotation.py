@@ -19,17 +19,28 @@ __maintainer__ = "Giuliana Carullo"
 __email__ = "giuliana.carullo@intel.com"
 __status__ = "Development"
 
+import numpy
 import pandas
+import threading
+import time
+from collections import deque
+from functools import partial
 from analytics_engine import common
 from analytics_engine.heuristics.beans.infograph import \
-    InfoGraphNode, InfoGraphUtilities, InfoGraphNodeType, InfoGraphNodeLayer
+    InfoGraphNode, InfoGraphUtilities, InfoGraphNodeType, InfoGraphNodeLayer, \
+    InfoGraphNodeTelemetry, InfoGraphNodeProperty
 from analytics_engine.heuristics.infrastructure.telemetry.snap_telemetry.snap_graph_telemetry import SnapAnnotation
 from analytics_engine.heuristics.infrastructure.telemetry.prometheus.prometheus_annotation import PrometheusAnnotation
 from analytics_engine.heuristics.infrastructure.telemetry.snap_telemetry.snap_utils import SnapUtils
-from analytics_engine.utilities import misc
+from analytics_engine.heuristics.infrastructure.telemetry.snap_telemetry.derived_metrics import \
+    DerivedMetrics, DERIVED_OUTPUTS, GETTERS, SETTERS, UTILIZATION_TARGETS
+from analytics_engine.infrastructure_manager import graphs
 
 LOG = common.LOG
 
+# Threads fetching telemetry when annotating within a deadline
+DEADLINE_WORKERS = 8
+
 class TelemetryAnnotation(object):
 
     SUPPORTED_TELEMETRY_SYSTEMS = ['snap', 'prometheus', 'local']
@@ -55,7 +66,11 @@ class TelemetryAnnotation(object):
                             ts_from,
                             ts_to,
                             utilization=False,
-                            saturation = False):
+                            saturation = False,
+                            lazy=False,
+                            previous=None,
+                            deadline=None,
+                            node_types=None):
         """
         Collect data from cimmaron tsdb in relation to the specified graph and
          time windows and store an annotated subgraph in specified directory
@@ -65,12 +80,37 @@ class TelemetryAnnotation(object):
         :param ts_to: (str) Epoch time representation of stop time
         :param utilization: (bool) if True the method calculates also
                                     utilization for each node, if available
+        :param lazy: (bool) if True only the queries are stored on the nodes
+                            and the telemetry is fetched when first accessed
+        :param previous: (NetworkX Graph) graph previously annotated over an
+                         earlier window starting no later than ts_from: the
+                         telemetry of its nodes is reused and only the
+                         samples after its window are fetched (snap only,
+                         ignored if lazy)
+        :param deadline: (float) epoch by which the graph has to be
+                         returned: queries still running at the deadline are
+                         abandoned and their nodes marked as telemetry
+                         incomplete (snap only, ignored if lazy or previous
+                         are set)
+        :param node_types: (list of str) with a deadline, only the nodes of
+                           these types, and the PUs, disks and NICs their
+                           utilization is rolled up from, are annotated
         :return: NetworkX Graph annotated with telemetry data
         """
         TelemetryAnnotation._get_annotated_graph_input_validation(
             graph, ts_from, ts_to)
-        internal_graph = graph.copy()
+        internal_graph = graphs.cow_copy(graph)
         self.internal_graph = internal_graph
+        if lazy and self.telemetry:
+            return self._get_lazy_annotated_graph(
+                internal_graph, ts_from, ts_to, utilization, saturation)
+        if deadline is not None and previous is None and \
+                isinstance(self.telemetry, SnapAnnotation):
+            return self._get_deadline_annotated_graph(
+                internal_graph, ts_from, ts_to, utilization, saturation,
+                deadline, node_types)
+        annotated_nodes = list()
+        extended_nodes = list()
         for node in internal_graph.nodes(data=True):
             if isinstance(self.telemetry, SnapAnnotation):
                 queries = list()
@@ -84,21 +124,17 @@ class TelemetryAnnotation(object):
                     traceback.print_exc()
                 if len(queries) != 0:
                     InfoGraphNode.set_queries(node, queries)
-
-                    telemetry_data = self.telemetry.get_data(node)
-                    InfoGraphNode.set_telemetry_data(node, telemetry_data)
-                    if utilization and not telemetry_data.empty:
-                        SnapUtils.utilization(internal_graph, node, self.telemetry)
-                        # if only procfs is available, results needs to be
-                        # propagated at machine level
-                        if InfoGraphNode.get_type(node) == InfoGraphNodeType.PHYSICAL_PU:
-                            SnapUtils.annotate_machine_pu_util(internal_graph, node)
-                        if InfoGraphNode.node_is_disk(node):
-                            SnapUtils.annotate_machine_disk_util(internal_graph, node)
-                        if InfoGraphNode.node_is_nic(node):
-                            SnapUtils.annotate_machine_network_util(internal_graph, node)
-                    if saturation:
-                        SnapUtils.saturation(internal_graph, node, self.telemetry)
+                    extension = None
+                    if previous is not None:
+                        extension = self._extend_node_telemetry(
+                            previous, node, queries, ts_from, ts_to)
+                    if extension:
+                        extended_nodes.append((node, extension))
+                    else:
+                        telemetry_data = self.telemetry.get_data(node)
+                        InfoGraphNode.set_telemetry_data(node, telemetry_data)
+                        if not telemetry_data.empty:
+                            annotated_nodes.append(node)
             elif isinstance(self.telemetry, PrometheusAnnotation):
                 queries = list()
                 try:
@@ -157,8 +193,349 @@ class TelemetryAnnotation(object):
                             LOG.debug('Found use for node {}'.format(InfoGraphNode.get_name(node)))
                 if saturation:
                     self._saturation(internal_graph, node, self.telemetry)
+        if isinstance(self.telemetry, SnapAnnotation):
+            # Derived metrics are computed at once for all the nodes
+            DerivedMetrics.annotate(internal_graph, self.telemetry,
+                                    annotated_nodes, utilization, saturation)
+            if extended_nodes:
+                self._extend_derived_metrics(internal_graph, extended_nodes,
+                                             ts_from, utilization, saturation)
+            if utilization:
+                # if only procfs is available, results needs to be
+                # propagated at machine level
+                SnapUtils.annotate_machine_utils(
+                    internal_graph,
+                    annotated_nodes + [node for node, _ in extended_nodes])
+        return internal_graph
+
+    def _extend_node_telemetry(self, previous, node, queries, ts_from, ts_to):
+        """
+        Sets on the node the telemetry of the same node in the previously
+        annotated graph, trimmed to the new window and extended with the
+        samples collected since the previous window ended.
+
+        :param previous: (InfoGraph) previously annotated graph
+        :param node: InfoGraph node to be annotated
+        :param queries: (list) queries of the node for the new window
+        :return: (tuple) the previous node, the telemetry the derived
+                 metrics of the new samples are computed from and the last
+                 timestamp of the previous telemetry still in the window
+                 (None if there is no such timestamp), or None if the node
+                 has to be annotated from scratch
+        """
+        ts_from = int(ts_from)
+        ts_to = int(ts_to)
+        name = InfoGraphNode.get_name(node)
+        if name not in previous.node:
+            # New in the landscape since the previous window
+            return None
+        previous_node = InfoGraphNode.get_node(previous, name)
+        if not InfoGraphNode.telemetry_loaded(previous_node):
+            return None
+        previous_queries = InfoGraphNode.get_queries(previous_node)
+        if not previous_queries or \
+                self._query_keys(previous_queries) != self._query_keys(queries):
+            return None
+        previous_from = min(int(query['ts_from']) for query in previous_queries)
+        previous_to = max(int(query['ts_to']) for query in previous_queries)
+        if ts_from < previous_from or ts_from > previous_to:
+            return None
+        for getter in GETTERS.values():
+            frame = getter(previous_node)
+            if not frame.empty and frame.index.name != 'timestamp':
+                # Derived metrics cannot be trimmed by time
+                return None
+
+        tail = pandas.DataFrame()
+        if ts_to > previous_to:
+            InfoGraphNode.set_queries(
+                node, [dict(query, ts_from=previous_to) for query in queries])
+            tail = self.telemetry.get_data(node)
+            InfoGraphNode.set_queries(node, queries)
+        previous_data = TelemetryAnnotation._merge_telemetry(
+            [InfoGraphNode.get_telemetry_data(previous_node)], ts_from, ts_to)
+        telemetry_data = TelemetryAnnotation._merge_telemetry(
+            [previous_data, tail], ts_from, ts_to)
+        InfoGraphNode.set_telemetry_data(node, telemetry_data)
+
+        last = None
+        overlap = telemetry_data
+        if not previous_data.empty:
+            last = int(previous_data['timestamp'].iloc[-1])
+            # One previous sample is kept to compute rates
+            overlap = telemetry_data[
+                pandas.to_numeric(telemetry_data['timestamp']) >= last]
+        return previous_node, overlap, last
+
+    def _extend_derived_metrics(self, graph, extended_nodes, ts_from,
+                                utilization, saturation):
+        """
+        Sets on the extended nodes their previous derived metrics, trimmed
+        to the new window, followed by the derived metrics of the new
+        samples only.
+
+        :param graph: (InfoGraph) graph being annotated
+        :param extended_nodes: (list) nodes with the tuple returned by
+                               _extend_node_telemetry
+        """
+        tails = list()
+        for node, (previous_node, overlap, last) in extended_nodes:
+            tail = [node[0], dict(node[1])]
+            InfoGraphNode.set_telemetry_data(tail, overlap)
+            tails.append(tail)
+        DerivedMetrics.annotate(graph, self.telemetry, tails,
+                                utilization, saturation)
+
+        for (node, (previous_node, overlap, last)), tail in \
+                zip(extended_nodes, tails):
+            for target, getter in GETTERS.items():
+                if target in UTILIZATION_TARGETS and not utilization or \
+                        target not in UTILIZATION_TARGETS and not saturation:
+                    continue
+                frames = list()
+                if last is not None:
+                    # Machine level rollups are built again from the children
+                    frame = getter(previous_node)
+                    frame = frame[[column for column in frame.columns
+                                   if column in DERIVED_OUTPUTS]]
+                    frames.append(frame[(frame.index >= int(ts_from)) &
+                                        (frame.index <= last)])
+                frame = tail[1].get(target)
+                if frame is not None:
+                    frames.append(frame if last is None
+                                  else frame[frame.index > last])
+                frames = [frame for frame in frames if len(frame.columns)]
+                if frames:
+                    SETTERS[target](node, pandas.concat(frames))
+
+    @staticmethod
+    def _query_keys(queries):
+        return sorted((query['metric'], sorted(query['tags'].items()))
+                      for query in queries)
+
+    @staticmethod
+    def _merge_telemetry(frames, ts_from, ts_to):
+        """
+        Returns the telemetry in the given frames within the time window,
+        sorted by timestamp. Samples of later frames replace the ones of
+        earlier frames with the same timestamp.
+        """
+        frames = [frame for frame in frames
+                  if frame is not None and not frame.empty]
+        if not frames:
+            return pandas.DataFrame()
+        data = pandas.concat(frames, ignore_index=True)
+        epochs = pandas.to_numeric(data['timestamp']).round().astype(int)
+        data['timestamp'] = epochs.astype(str)
+        keep = ((epochs >= ts_from) & (epochs <= ts_to) &
+                ~epochs.duplicated(keep='last')).values
+        data = data[keep]
+        order = numpy.argsort(epochs.values[keep], kind='mergesort')
+        return data.iloc[order].reset_index(drop=True)
+
+    def _get_deadline_annotated_graph(self, internal_graph, ts_from, ts_to,
+                                      utilization, saturation, deadline,
+                                      node_types=None):
+        """
+        Fetches the telemetry of the nodes in parallel, the nodes of the
+        requested types first, and returns once all of it is fetched or the
+        deadline expires, whichever comes first.
+        Nodes whose telemetry is not fetched in time are left without
+        telemetry and marked as telemetry incomplete.
+        """
+        pending = list()
+        for node in self._prioritized_nodes(internal_graph, node_types,
+                                            utilization):
+            queries = list()
+            try:
+                queries = self.telemetry.get_queries(
+                    internal_graph, node, ts_from, ts_to)
+            except Exception as e:
+                LOG.error("Exception: {}".format(e))
+                LOG.error(e)
+                import traceback
+                traceback.print_exc()
+            if len(queries) != 0:
+                InfoGraphNode.set_queries(node, queries)
+                pending.append(node)
+
+        fetched = self._fetch_within_deadline(pending, deadline)
+        annotated_nodes = list()
+        incomplete = 0
+        for node in pending:
+            telemetry_data = fetched.get(InfoGraphNode.get_name(node))
+            if telemetry_data is None:
+                InfoGraphNode.set_telemetry_incomplete(node)
+                incomplete += 1
+                continue
+            InfoGraphNode.set_telemetry_data(node, telemetry_data)
+            if not telemetry_data.empty:
+                annotated_nodes.append(node)
+        if incomplete:
+            LOG.warning('Telemetry of {} out of {} nodes not fetched within '
+                        'the deadline'.format(incomplete, len(pending)))
+            if utilization:
+                # Utilization of machines rolled up from incomplete children
+                # is partial as well
+                for machine, children in \
+                        self._get_machine_children(internal_graph).items():
+                    if any(InfoGraphNode.is_telemetry_incomplete(
+                            InfoGraphNode.get_node(internal_graph, child))
+                           for child in children):
+                        InfoGraphNode.set_telemetry_incomplete(
+                            InfoGraphNode.get_node(internal_graph, machine))
+
+        DerivedMetrics.annotate(internal_graph, self.telemetry,
+                                annotated_nodes, utilization, saturation)
+        if utilization:
+            SnapUtils.annotate_machine_utils(internal_graph, annotated_nodes)
+        return internal_graph
+
+    def _prioritized_nodes(self, graph, node_types, utilization):
+        """
+        Returns the nodes of the given types followed by the PUs, disks and
+        NICs of the machines among them, or all the nodes if no type is
+        given.
+        """
+        if not node_types:
+            return graph.nodes(data=True)
+        res = InfoGraphUtilities.filter_by_types(graph, node_types)
+        if utilization:
+            machine_children = self._get_machine_children(graph)
+            selected = set(InfoGraphNode.get_name(node) for node in res)
+            for node in list(res):
+                for child_name in machine_children.get(
+                        InfoGraphNode.get_name(node), []):
+                    if child_name not in selected:
+                        selected.add(child_name)
+                        res.append(InfoGraphNode.get_node(graph, child_name))
+        return res
+
+    def _fetch_within_deadline(self, nodes, deadline,
+                               workers=DEADLINE_WORKERS):
+        """
+        Fetches the telemetry of the nodes, in order, with a pool of threads.
+        Nodes not started by the deadline are never queried, while queries
+        still running at the deadline are abandoned: their threads keep
+        running in background but their results are discarded.
+
+        :param nodes: (list) InfoGraph nodes with queries
+        :param deadline: (float) epoch
+        :return: (dict) node name -> telemetry of the nodes fetched in time
+        """
+        pending = deque(nodes)
+        results = dict()
+        lock = threading.Lock()
+
+        def fetch():
+            while time.time() < deadline:
+                try:
+                    node = pending.popleft()
+                except IndexError:
+                    return
+                # Queries run on a copy of the node, which late results
+                # are written to
+                name = InfoGraphNode.get_name(node)
+                detached = [name, {InfoGraphNodeProperty.QUERIES:
+                                   InfoGraphNode.get_queries(node)}]
+                try:
+                    telemetry_data = self.telemetry.get_data(detached,
+                                                             deadline)
+                except Exception as e:
+                    LOG.error("Telemetry of node {} not fetched: {}".
+                              format(name, e))
+                    telemetry_data = pandas.DataFrame()
+                with lock:
+                    if telemetry_data is not None and \
+                            time.time() < deadline:
+                        results[name] = telemetry_data
+
+        threads = [threading.Thread(target=fetch)
+                   for _ in range(min(workers, len(nodes)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join(max(0, deadline - time.time()))
+        with lock:
+            return dict(results)
+
+    def _get_lazy_annotated_graph(self, internal_graph, ts_from, ts_to,
+                                  utilization, saturation):
+        """
+        Stores on each node its queries together with a lazy handle, so that
+        telemetry is only fetched for the nodes which are actually read.
+        """
+        machine_children = dict()
+        if utilization and isinstance(self.telemetry, SnapAnnotation):
+            machine_children = self._get_machine_children(internal_graph)
+        loader = partial(self._load_node_telemetry,
+                         utilization=utilization, saturation=saturation,
+                         machine_children=machine_children)
+        for node in internal_graph.nodes(data=True):
+            queries = list()
+            try:
+                queries = self.telemetry.get_queries(
+                    internal_graph, node, ts_from, ts_to)
+            except Exception as e:
+                LOG.error("Exception: {}".format(e))
+                LOG.error(e)
+                import traceback
+                traceback.print_exc()
+            if len(queries) != 0:
+                InfoGraphNode.set_queries(
+                    node, queries,
+                    handle=InfoGraphNodeTelemetry(internal_graph, loader))
         return internal_graph
 
+    def _load_node_telemetry(self, graph, node, utilization=False,
+                             saturation=False, machine_children=None):
+        """
+        Fetches the telemetry of a single node and derives utilization and
+        saturation from it, as get_annotated_graph does for all the nodes.
+        Machines pull the utilization of their PUs, disks and NICs, which
+        are fetched in turn if needed.
+        """
+        telemetry_data = self.telemetry.get_data(node)
+        InfoGraphNode.set_telemetry_data(node, telemetry_data)
+        if not isinstance(self.telemetry, SnapAnnotation):
+            return
+        if utilization and not telemetry_data.empty:
+            SnapUtils.utilization(graph, node, self.telemetry)
+        if saturation:
+            SnapUtils.saturation(graph, node, self.telemetry)
+        if not machine_children:
+            return
+        children = list()
+        for child_name in machine_children.get(InfoGraphNode.get_name(node), []):
+            child = InfoGraphNode.get_node(graph, child_name)
+            InfoGraphNode.load_telemetry(child)
+            children.append(child)
+        SnapUtils.annotate_machine_utils(graph, children)
+
+    @staticmethod
+    def _get_machine_children(graph):
+        """
+        Returns the names of the PUs, disks and NICs grouped by the name of
+        the machine their utilization is propagated to.
+        """
+        res = dict()
+        for node in InfoGraphUtilities.filter_by_types(
+                graph, [InfoGraphNodeType.PHYSICAL_PU,
+                        InfoGraphNodeType.PHYSICAL_DISK,
+                        InfoGraphNodeType.PHYSICAL_NIC]):
+            if InfoGraphNode.get_type(node) == InfoGraphNodeType.PHYSICAL_PU:
+                machine = InfoGraphNode.get_machine_name_of_pu(node)
+            elif InfoGraphNode.node_is_disk(node) or \
+                    InfoGraphNode.node_is_nic(node):
+                machine = InfoGraphNode.get_attributes(node).get('allocation')
+            else:
+                continue
+            if machine in graph.node:
+                res.setdefault(machine, list()).append(
+                    InfoGraphNode.get_name(node))
+        return res
+
     @staticmethod
     def get_pandas_df_from_graph(graph, metrics='all'):
         return TelemetryAnnotation._create_pandas_data_frame_from_graph(
@@ -208,6 +585,9 @@ class TelemetryAnnotation(object):
 
             # This method supports export of either normal metrics coming
             #  from telemetry agent or utilization type of metrics.
+            # Telemetry not fetched through lazy handles is not exported.
+            if not InfoGraphNode.telemetry_loaded(node):
+                continue
             if metrics == 'all':
                 node_telemetry_data = InfoGraphNode.get_telemetry_data(node)
             else:
@@ -300,39 +680,44 @@ class TelemetryAnnotation(object):
         Returns the graph filtered removing all the nodes with no telemetry
         """
         template_mapping = dict()
+        # node_name attribute -> nodes (see name_filtering_support)
+        named_nodes = dict()
 
-        res = graph.copy()
+        res = graphs.cow_copy(graph)
         for node in res.nodes(data=True):
-            # for p in node[1]['attributes']:
-            #     p = str(p)
             template = node[1]['attributes']['template'] \
                 if 'template' in node[1]['attributes'] else None
 
             # If node is a service node, need to remove the template
+            # The attributes are shared with the graph being filtered:
+            # they are replaced, never modified in place
             if template:
                 template_mapping[InfoGraphNode.get_name(node)] = template
-                node[1]['attributes'].pop('template')
-
-            # Fix format for conversion to JSON (happening in analytics)
-            node[1]['attributes'] = \
-                str(misc.convert_unicode_dict_to_string(node[1]['attributes'])).\
-                    replace("'", '"')
-
+                node[1]['attributes'] = dict(
+                    (key, value) for key, value in
+                    node[1]['attributes'].items() if key != 'template')
+
+            if 'node_name' in node[1]['attributes']:
+                named_nodes.setdefault(
+                    node[1]['attributes']['node_name'], list()).append(
+                    InfoGraphNode.get_name(node))
+
+        # Same nodes as res.filter_nodes('node_name', node_name) for each
+        # node with no telemetry, selected in a single pass
+        to_be_filtered = list()
         for node in res.nodes(data=True):
             node_name = InfoGraphNode.get_name(node)
             telemetry = InfoGraphNode.get_telemetry_data(node)
             layer = InfoGraphNode.get_layer(node)
-            # if len(telemetry.columns.values) <= 1:
 
             if len(telemetry.columns) <= 1 and \
                     not layer == InfoGraphNodeLayer.SERVICE:
                 InfoGraphNode.set_telemetry_data(node, dict())
-                res.filter_nodes('node_name', node_name)
+                to_be_filtered.extend(named_nodes.get(node_name, []))
+        res.filter_node_list(to_be_filtered)
 
-        # Convert attributes back to dict()
         for node in res.nodes(data=True):
-            string = InfoGraphNode.get_attributes(node)
-            attrs = InfoGraphUtilities.str_to_dict(string)
+            attrs = dict(InfoGraphNode.get_attributes(node))
             if InfoGraphNode.get_type(node) == \
                     InfoGraphNodeType.SERVICE_COMPUTE:
                 attrs['template'] = \
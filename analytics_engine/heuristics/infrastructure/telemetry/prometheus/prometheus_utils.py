@@ -20,7 +20,7 @@ __email__ = "giuliana.carullo@intel.com"
 __status__ = "Development"
 
 import pandas
-from analytics_engine.heuristics.beans.infograph import InfoGraphNode
+from analytics_engine.heuristics.beans.infograph import InfoGraphNode, InfoGraphNodeType
 from analytics_engine import common
 
 LOG = common.LOG
@@ -48,6 +48,16 @@ class PrometheusUtils(object):
         machine_util = InfoGraphNode.get_network_utilization(machine)
         InfoGraphNode.set_network_utilization(machine, pandas.DataFrame())
 
+    @staticmethod
+    def annotate_machine_utils(internal_graph, nodes):
+        for node in nodes:
+            if InfoGraphNode.get_type(node) == InfoGraphNodeType.PHYSICAL_PU:
+                PrometheusUtils.annotate_machine_pu_util(internal_graph, node)
+            elif InfoGraphNode.node_is_disk(node):
+                PrometheusUtils.annotate_machine_disk_util(internal_graph, node)
+            elif InfoGraphNode.node_is_nic(node):
+                PrometheusUtils.annotate_machine_network_util(internal_graph, node)
+
     @staticmethod
     def utilization(internal_graph, node, telemetry):
         # machine usage
@@ -0,0 +1,275 @@
+# Copyright (c) 2017, Intel Research and Development Ireland Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = 'Giuliana Carullo'
+__copyright__ = "Copyright (c) 2017, Intel Research and Development Ireland Ltd."
+__license__ = "Apache 2.0"
+__maintainer__ = "Giuliana Carullo"
+__email__ = "giuliana.carullo@intel.com"
+__status__ = "Development"
+
+import numpy
+import pandas
+from analytics_engine import common
+from analytics_engine.heuristics.beans.infograph import \
+    InfoGraphNode, InfoGraphNodeProperty
+from analytics_engine.heuristics.beans.telemetry_store import TelemetryStore
+from analytics_engine.heuristics.infrastructure.telemetry.snap_telemetry.metric_conf import DERIVED_METRICS
+
+LOG = common.LOG
+
+
+def _nic_speed(graph, node, telemetry):
+    """
+    NIC speed in bits per second of the machine the node is running on
+    """
+    machine = InfoGraphNode.get_node(graph, telemetry._source(node))
+    return InfoGraphNode.get_nic_speed_mbps(machine) * 1000000
+
+
+def _local_memory(graph, node, telemetry):
+    """
+    Memory of the machine the node is running on
+    """
+    machine = InfoGraphNode.get_node(graph, telemetry._source(node))
+    return int(InfoGraphNode.get_attributes(machine).get("local_memory"))
+
+
+# Node parameters which can be used as divisor by the rules
+NODE_PARAMETERS = {
+    'nic_speed': _nic_speed,
+    'local_memory': _local_memory
+}
+
+SETTERS = {
+    InfoGraphNodeProperty.UTILIZATION_COMPUTE:
+        InfoGraphNode.set_compute_utilization,
+    InfoGraphNodeProperty.UTILIZATION_MEMORY:
+        InfoGraphNode.set_memory_utilization,
+    InfoGraphNodeProperty.UTILIZATION_DISK:
+        InfoGraphNode.set_disk_utilization,
+    InfoGraphNodeProperty.UTILIZATION_NETWORK:
+        InfoGraphNode.set_network_utilization,
+    InfoGraphNodeProperty.SATURATION_COMPUTE:
+        InfoGraphNode.set_compute_saturation,
+    InfoGraphNodeProperty.SATURATION_MEMORY:
+        InfoGraphNode.set_memory_saturation,
+    InfoGraphNodeProperty.SATURATION_DISK:
+        InfoGraphNode.set_disk_saturation,
+    InfoGraphNodeProperty.SATURATION_NETWORK:
+        InfoGraphNode.set_network_saturation
+}
+
+GETTERS = {
+    InfoGraphNodeProperty.UTILIZATION_COMPUTE:
+        InfoGraphNode.get_compute_utilization,
+    InfoGraphNodeProperty.UTILIZATION_MEMORY:
+        InfoGraphNode.get_memory_utilization,
+    InfoGraphNodeProperty.UTILIZATION_DISK:
+        InfoGraphNode.get_disk_utilization,
+    InfoGraphNodeProperty.UTILIZATION_NETWORK:
+        InfoGraphNode.get_network_utilization,
+    InfoGraphNodeProperty.SATURATION_COMPUTE:
+        InfoGraphNode.get_compute_saturation,
+    InfoGraphNodeProperty.SATURATION_MEMORY:
+        InfoGraphNode.get_memory_saturation,
+    InfoGraphNodeProperty.SATURATION_DISK:
+        InfoGraphNode.get_disk_saturation,
+    InfoGraphNodeProperty.SATURATION_NETWORK:
+        InfoGraphNode.get_network_saturation
+}
+
+# Names of all the metrics computed by the rules
+DERIVED_OUTPUTS = set(rule['output'] for rule in DERIVED_METRICS)
+
+UTILIZATION_TARGETS = [InfoGraphNodeProperty.UTILIZATION_COMPUTE,
+                       InfoGraphNodeProperty.UTILIZATION_MEMORY,
+                       InfoGraphNodeProperty.UTILIZATION_DISK,
+                       InfoGraphNodeProperty.UTILIZATION_NETWORK]
+
+
+class DerivedMetrics(object):
+    """
+    Evaluates the DERIVED_METRICS rules on the telemetry of a set of nodes.
+    The telemetry of all the nodes is laid out in a single TelemetryStore,
+    each node keeping its own block of rows, and each rule is evaluated at
+    once for all the nodes of a type, on the row blocks of those nodes put
+    one after the other.
+    """
+
+    @staticmethod
+    def annotate(graph, telemetry, nodes, utilization=True,
+                 saturation=True, rules=None):
+        """
+        Computes the derived metrics of the nodes and stores them on the
+        nodes, as utilization or saturation.
+
+        :param graph: (InfoGraph) graph the nodes belong to
+        :param telemetry: (SnapAnnotation) telemetry used to annotate the
+                          nodes, resolving the sources of the nodes
+        :param nodes: (list of InfoGraph nodes) nodes with telemetry data
+        :param utilization: (bool) if True utilization rules are evaluated
+        :param saturation: (bool) if True saturation rules are evaluated
+        :param rules: (list of dict) rules to be used instead of
+                      DERIVED_METRICS
+        :return: None
+        """
+        rules = [rule for rule in (rules or DERIVED_METRICS)
+                 if (rule['target'] in UTILIZATION_TARGETS and utilization) or
+                 (rule['target'] not in UTILIZATION_TARGETS and saturation)]
+        if not rules or not nodes:
+            return
+        store = TelemetryStore.build(
+            nodes, sections=[InfoGraphNodeProperty.TELEMETRY_DATA],
+            coerce=True)
+        section = store.sections.get(InfoGraphNodeProperty.TELEMETRY_DATA)
+        if not section:
+            return
+
+        nodes_by_name = dict()
+        batches = dict()
+        for node in nodes:
+            if node[0] in section.nodes:
+                nodes_by_name[node[0]] = node
+                batches.setdefault(
+                    InfoGraphNode.get_type(node), list()).append(node[0])
+
+        # node name -> target -> (output, values)
+        results = dict()
+        positions = dict()
+        for rule in rules:
+            for node_type, node_names in batches.items():
+                if rule.get('scope') and node_type not in rule['scope']:
+                    continue
+                DerivedMetrics._evaluate(
+                    rule, graph, telemetry, section, node_names,
+                    nodes_by_name, positions, results)
+
+        for node_name, targets in results.items():
+            index = pandas.Index(section.get_timestamps(node_name),
+                                 name='timestamp')
+            for target, (output, values) in targets.items():
+                SETTERS[target](nodes_by_name[node_name],
+                                pandas.DataFrame({output: values},
+                                                 index=index))
+
+    @staticmethod
+    def _metric_positions(section, metric, positions):
+        """
+        Returns the column of the metric for each node reporting it, the
+        first column of a metric being used.
+        """
+        if metric not in positions:
+            columns = numpy.flatnonzero(section.metrics == metric)
+            positions[metric] = dict()
+            for column in columns[::-1]:
+                positions[metric][section.owners[column]] = column
+        return positions[metric]
+
+    @staticmethod
+    def _gather(section, columns):
+        """
+        Returns the given columns, each of a different node, one after the
+        other in a single array.
+
+        :param section: (TelemetryStoreSection)
+        :param columns: (numpy.ndarray) column of each node
+        :return: (numpy.ndarray)
+        """
+        starts = section.offsets[columns]
+        lengths = section.offsets[columns + 1] - starts
+        # Position in values of each row: start of the column of the row
+        # plus the position of the row within the column
+        shifts = starts - numpy.concatenate([[0], numpy.cumsum(lengths)[:-1]])
+        return section.values[numpy.repeat(shifts, lengths) +
+                              numpy.arange(lengths.sum())]
+
+    @staticmethod
+    def _evaluate(rule, graph, telemetry, section, node_names,
+                  nodes_by_name, positions, results):
+        inputs = [DerivedMetrics._metric_positions(section, metric, positions)
+                  for metric in rule['inputs']]
+        unless = [DerivedMetrics._metric_positions(section, metric, positions)
+                  for metric in rule.get('unless', [])]
+        names = [name for name in node_names
+                 if all(name in metric for metric in inputs) and
+                 not (unless and all(name in metric for metric in unless))]
+        if not names:
+            return
+
+        divisor = rule.get('divisor', 1)
+        if isinstance(divisor, str):
+            parameter = NODE_PARAMETERS[divisor]
+            selected = list()
+            divisors = list()
+            for name in names:
+                try:
+                    divisors.append(parameter(graph, nodes_by_name[name],
+                                              telemetry))
+                    selected.append(name)
+                except Exception as e:
+                    LOG.error("{} not available for node {}: {}".
+                              format(divisor, name, e))
+            names = selected
+            divisor = numpy.array(divisors, dtype=float)
+        if not names:
+            return
+
+        # Rows of each node, one node after the other
+        lengths = numpy.array([section.rows[name][1] - section.rows[name][0]
+                               for name in names], dtype=numpy.int64)
+        bounds = numpy.concatenate([[0], numpy.cumsum(lengths)])
+        if isinstance(divisor, numpy.ndarray):
+            divisor = numpy.repeat(divisor, lengths)
+
+        values = [DerivedMetrics._gather(
+            section, numpy.array([metric[name] for name in names],
+                                 dtype=numpy.int64))
+            for metric in inputs]
+        if rule.get('fillna'):
+            values = [numpy.where(numpy.isnan(value), 0, value)
+                      for value in values]
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            if rule['formula'] == 'ratio':
+                res = values[0] * rule.get('scale', 1) / values[1]
+            else:
+                res = values[0]
+                for value in values[1:]:
+                    res = res + value
+                if rule['formula'] == 'rate':
+                    res = DerivedMetrics._rate(res, bounds[:-1])
+                res = res * rule.get('scale', 1)
+            res = res / divisor
+
+        for position, name in enumerate(names):
+            results.setdefault(name, dict())[rule['target']] = \
+                (rule['output'], res[bounds[position]:bounds[position + 1]])
+
+    @staticmethod
+    def _rate(values, starts):
+        """
+        Returns the difference between each sample and the previous sample
+        of the same node, NaN for the first sample of each node.
+
+        :param values: (numpy.ndarray) samples of the nodes, one node after
+                       the other
+        :param starts: (numpy.ndarray) position of the first sample of each
+                       node
+        :return: (numpy.ndarray)
+        """
+        res = numpy.full(len(values), numpy.nan)
+        res[1:] = values[1:] - values[:-1]
+        # Blocks of nodes without samples start at the end of the array
+        res[starts[starts < len(values)]] = numpy.nan
+        return res
@@ -20,6 +20,7 @@ __email__ = "giuliana.carullo@intel.com"
 __status__ = "Development"
 
 from analytics_engine.heuristics.beans.infograph import InfoGraphNodeType as NODE_TYPE
+from analytics_engine.heuristics.beans.infograph import InfoGraphNodeProperty as NODE_PROPERTY
 
 # refactored from snap_graph_telemetry
 NODE_METRICS = {NODE_TYPE.PHYSICAL_DISK: ["intel/iostat/device/",
@@ -129,4 +130,117 @@ METRIC_TAGS = [("intel/iostat/device/", ["device_id", "source"]),
                ("intel/docker/stats/network/tx_bytes", ["docker_id", "source"]),
                ("intel/docker/stats/network/rx_bytes", ["docker_id", "source"]),
                ("intel/docker/stats/cgroups/blkio_stats/io_time_recursive/value", ["docker_id", "source"])
-               ]
\ No newline at end of file
+               ]
+
+# Metrics derived from the collected telemetry (see derived_metrics.py).
+# Rules are evaluated in order: when more than one rule applies to a node
+# for the same target, the last one wins.
+#   output: name of the derived metric
+#   target: node property storing the derived metric
+#   formula: 'value' (sum of the inputs), 'ratio' (first input over second
+#            input) or 'rate' (increase of the sum of the inputs between
+#            consecutive samples of the node)
+#   inputs: metrics the formula is applied to; all of them are required
+#   unless: (optional) the rule is skipped for nodes having all of these
+#   fillna: (optional) if True missing input samples are taken as 0
+#   scale: (optional) the result of the formula is multiplied by this
+#   divisor: (optional) number or name of a node parameter
+#            (see derived_metrics.NODE_PARAMETERS) the result is divided by
+#   scope: (optional) node types the rule applies to, all when None
+DERIVED_METRICS = [
+    # machine usage
+    {'output': 'intel/use/compute/utilization',
+     'target': NODE_PROPERTY.UTILIZATION_COMPUTE,
+     'formula': 'value',
+     'inputs': ['intel/use/compute/utilization']},
+    # pu usage
+    {'output': 'intel/procfs/cpu/utilization_percentage',
+     'target': NODE_PROPERTY.UTILIZATION_COMPUTE,
+     'formula': 'value',
+     'inputs': ['intel/procfs/cpu/utilization_percentage']},
+    {'output': 'intel/use/memory/utilization',
+     'target': NODE_PROPERTY.UTILIZATION_MEMORY,
+     'formula': 'value',
+     'inputs': ['intel/use/memory/utilization']},
+    {'output': 'intel/use/disk/utilization',
+     'target': NODE_PROPERTY.UTILIZATION_DISK,
+     'formula': 'value',
+     'inputs': ['intel/use/disk/utilization']},
+    {'output': 'intel/use/network/utilization',
+     'target': NODE_PROPERTY.UTILIZATION_NETWORK,
+     'formula': 'value',
+     'inputs': ['intel/use/network/utilization']},
+    # supporting not available /use/ metrics
+    {'output': 'intel/procfs/memory/utilization_percentage',
+     'target': NODE_PROPERTY.UTILIZATION_MEMORY,
+     'formula': 'ratio',
+     'inputs': ['intel/procfs/meminfo/mem_used',
+                'intel/procfs/meminfo/mem_total'],
+     'fillna': True,
+     'scale': 100},
+    {'output': 'intel/procfs/disk/utilization_percentage',
+     'target': NODE_PROPERTY.UTILIZATION_DISK,
+     'formula': 'value',
+     'inputs': ['intel/procfs/disk/io_time'],
+     'fillna': True,
+     'scale': 100,
+     'divisor': 1000},
+    {'output': 'intel/psutil/net/utilization_percentage',
+     'target': NODE_PROPERTY.UTILIZATION_NETWORK,
+     'formula': 'rate',
+     'inputs': ['intel/psutil/net/bytes_recv',
+                'intel/psutil/net/bytes_sent'],
+     'scale': 100,
+     'divisor': 'nic_speed'},
+    {'output': 'intel/psutil/net/utilization_percentage',
+     'target': NODE_PROPERTY.UTILIZATION_NETWORK,
+     'formula': 'rate',
+     'inputs': ['intel/procfs/iface/bytes_recv',
+                'intel/procfs/iface/bytes_sent'],
+     'unless': ['intel/psutil/net/bytes_recv',
+                'intel/psutil/net/bytes_sent'],
+     'scale': 100,
+     'divisor': 'nic_speed'},
+    # containers, cpu usage is in nanoseconds
+    {'output': 'intel/docker/stats/cgroups/cpu_stats/cpu_usage/percentage',
+     'target': NODE_PROPERTY.UTILIZATION_COMPUTE,
+     'formula': 'rate',
+     'inputs': ['intel/docker/stats/cgroups/cpu_stats/cpu_usage/total'],
+     'divisor': 10000000},
+    {'output': 'intel/docker/stats/cgroups/memory_stats/usage/percentage',
+     'target': NODE_PROPERTY.UTILIZATION_MEMORY,
+     'formula': 'value',
+     'inputs': ['intel/docker/stats/cgroups/memory_stats/usage/usage'],
+     'scale': 100,
+     'divisor': 'local_memory'},
+    {'output': 'intel/docker/stats/network/utilization_percentage',
+     'target': NODE_PROPERTY.UTILIZATION_NETWORK,
+     'formula': 'rate',
+     'inputs': ['intel/docker/stats/network/tx_bytes',
+                'intel/docker/stats/network/rx_bytes'],
+     'scale': 100,
+     'divisor': 'nic_speed'},
+    # containers, io time is in milliseconds
+    {'output': 'intel/docker/stats/cgroups/blkio_stats/io_time_recursive/percentage',
+     'target': NODE_PROPERTY.UTILIZATION_DISK,
+     'formula': 'rate',
+     'inputs': ['intel/docker/stats/cgroups/blkio_stats/io_time_recursive/value'],
+     'divisor': 1000000},
+    # saturation
+    {'output': 'intel/use/compute/saturation',
+     'target': NODE_PROPERTY.SATURATION_COMPUTE,
+     'formula': 'value',
+     'inputs': ['intel/use/compute/saturation']},
+    {'output': 'intel/use/memory/saturation',
+     'target': NODE_PROPERTY.SATURATION_MEMORY,
+     'formula': 'value',
+     'inputs': ['intel/use/memory/saturation']},
+    {'output': 'intel/use/disk/saturation',
+     'target': NODE_PROPERTY.SATURATION_DISK,
+     'formula': 'value',
+     'inputs': ['intel/use/disk/saturation']},
+    {'output': 'intel/use/network/saturation',
+     'target': NODE_PROPERTY.SATURATION_NETWORK,
+     'formula': 'value',
+     'inputs': ['intel/use/network/saturation']}
+]
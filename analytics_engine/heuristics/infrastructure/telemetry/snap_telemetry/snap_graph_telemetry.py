@@ -19,6 +19,7 @@ __maintainer__ = "Giuliana Carullo"
 __email__ = "giuliana.carullo@intel.com"
 __status__ = "Development"
 
+import threading
 import time
 from datetime import datetime
 
@@ -34,6 +35,7 @@ from analytics_engine.heuristics.infrastructure.telemetry.graph_telemetry import
 from metric_conf import METRIC_TAGS
 from metric_conf import NODE_METRICS
 from snap_query import SnapQuery
+from snap_tag_index import SnapTagIndex
 
 LOG = common.LOG
 
@@ -45,19 +47,23 @@ class SnapAnnotation(GraphTelemetry):
         self.metrics = {}
         self.metric_timeout = metric_timeout
         self.landscape = None
-        self.vms = []
+        self.tag_index = None
+        self._index_lock = threading.Lock()
 
     def get_utilization_data(self, node):
         pass
 
-    def get_data(self, node):
+    def get_data(self, node, deadline=None):
         """
         Return telemetry data for the specified node
 
         :param node: InfoGraph node
-        :return: pandas.DataFrame
+        :param deadline: (float) epoch after which no further query is run
+                         for the node
+        :return: pandas.DataFrame, or None if the deadline expired before
+                 all the queries of the node were run
         """
-        data = self._get_data(node)
+        data = self._get_data(node, deadline)
         return data
 
     def get_queries(self, landscape, node, ts_from, ts_to):
@@ -72,23 +78,44 @@ class SnapAnnotation(GraphTelemetry):
         """
 
         queries = []
-        self.landscape = landscape
+        self.index_landscape(landscape)
         node_layer = InfoGraphNode.get_layer(node)
         # Service Layer metrics are not required
         #if node_layer == GRAPH_LAYER.SERVICE:
         #    return []
         for metric in self._get_metrics(node):
-            try:
-                query = self._build_query(metric, node, ts_from, ts_to)
-                queries.append(query)
-            except Exception as e:
-                LOG.error('Exception for metric: {}'.format(metric))
+            nova_uuids = [None]
+            if metric.startswith('intel/libvirt/'):
+                # One query for each VM the metric is reported for
+                nova_uuids = self.tag_index.nova_uuids(node)
+            for nova_uuid in nova_uuids:
+                try:
+                    query = self._build_query(metric, node, ts_from, ts_to,
+                                              nova_uuid)
+                    queries.append(query)
+                except Exception as e:
+                    LOG.error('Exception for metric: {}'.format(metric))
 
 
         return queries
 
-    def _build_query(self, metric, node, ts_from, ts_to):
-        tags = self._tags(metric, node)
+    def index_landscape(self, landscape):
+        """
+        Indexes the tags of all the nodes of the landscape, unless already
+        indexed, so that the queries of its nodes are built with lookups.
+
+        :param landscape: (InfoGraph) graph being annotated
+        :return: (SnapTagIndex)
+        """
+        with self._index_lock:
+            if self.tag_index is None or \
+                    self.tag_index.landscape is not landscape:
+                self.tag_index = SnapTagIndex(landscape)
+                self.landscape = landscape
+        return self.tag_index
+
+    def _build_query(self, metric, node, ts_from, ts_to, nova_uuid=None):
+        tags = self._tags(metric, node, nova_uuid)
         # query = SnapQuery(self.snap, metric, tags, ts_from, ts_to)
         query = dict()
         query['metric'] = metric
@@ -97,10 +124,12 @@ class SnapAnnotation(GraphTelemetry):
         query['ts_to'] = ts_to
         return query
 
-    def _get_data(self, node):
+    def _get_data(self, node, deadline=None):
         # TODO: Create here the object SnapQuery from the string
         results = {}
         for query_vars in InfoGraphNode.get_queries(node):
+            if deadline is not None and time.time() >= deadline:
+                return None
             query = SnapQuery(self.snap,
                               query_vars['metric'],
                               query_vars['tags'],
@@ -156,11 +185,11 @@ class SnapAnnotation(GraphTelemetry):
             #                  join_axes=[dataframes[largest_index].index])
         return pd.DataFrame()
 
-    def _tags(self, metric, node):
+    def _tags(self, metric, node, nova_uuid=None):
         tags = {}
         tag_keys = self._tag_keys(metric, node)
         for tag_key in tag_keys:
-            tag_value = self._tag_value(tag_key, node, metric)
+            tag_value = self._tag_value(tag_key, node, metric, nova_uuid)
             tags[tag_key] = tag_value
         return tags
 
@@ -184,7 +213,7 @@ class SnapAnnotation(GraphTelemetry):
                 return tag_keys
         return None
 
-    def _tag_value(self, tag_key, node, metric):
+    def _tag_value(self, tag_key, node, metric, nova_uuid=None):
         # TODO: fully qualify this with metric name, if metric is this and tag
         tag_value = None
         if tag_key == "source":
@@ -196,7 +225,7 @@ class SnapAnnotation(GraphTelemetry):
         elif tag_key in set(["nic_id", "interface", "network_interface", "interface_name", "hardware_addr"]):
             tag_value = self._nic(node, tag_key)
         elif tag_key == "nova_uuid":
-            tag_value = self._nova_uuid(node)
+            tag_value = nova_uuid
         elif tag_key == "stack_name":
             tag_value = self._stack(node)
         elif tag_key == "dev_id":
@@ -209,103 +238,32 @@ class SnapAnnotation(GraphTelemetry):
         return tag_value
 
     def _source(self, node):
-        attrs = InfoGraphNode.get_attributes(node)
-        if InfoGraphNode.get_layer(node) == GRAPH_LAYER.PHYSICAL:
-            if 'allocation' in attrs:
-                return attrs['allocation']
-            # fix due to the landscape
-            else:
-                while attrs.get('attributes', None):
-                    attrs = attrs['attributes']
-                if 'allocation' in attrs:
-                    return attrs['allocation']
-        if InfoGraphNode.get_type(node) == NODE_TYPE.VIRTUAL_MACHINE:
-            if 'vm_name' in attrs:
-                return attrs['vm_name']
-        if InfoGraphNode.get_type(node) == NODE_TYPE.INSTANCE_DISK:
-            # The machine is the source as this is a libvirt disk.
-            disk_name = InfoGraphNode.get_name(node)
-            vm = self.landscape.get_neighbour_by_type(
-                disk_name, NODE_TYPE.VIRTUAL_MACHINE)
-            machine = self.landscape.get_neighbour_by_type(
-                vm, NODE_TYPE.PHYSICAL_MACHINE)
-            return machine
-        if InfoGraphNode.get_type(node) == NODE_TYPE.PHYSICAL_MACHINE:
-            if 'name' in attrs:
-                return attrs['name']
-        if InfoGraphNode.get_type(node) == NODE_TYPE.DOCKER_CONTAINER:
-            docker_node = self.landscape.get_neighbour_by_type(InfoGraphNode.get_name(node),'docker_node')
-            if docker_node:
-                machine = self.landscape.get_neighbour_by_type(docker_node,'machine')
-                return machine
-        return None
+        return self._tags_of(node).source(node)
 
     def _disk(self, node):
-        disk = None
-        if (InfoGraphNode.get_type(node) == NODE_TYPE.PHYSICAL_DISK or
-                InfoGraphNode.get_type(node) == NODE_TYPE.PHYSICAL_MACHINE):
-            attrs = InfoGraphNode.get_attributes(node)
-            if 'osdev_storage-name' in attrs:
-                disk = attrs["osdev_storage-name"]
-            elif 'name' in attrs:
-                disk = attrs["name"]
-        elif InfoGraphNode.get_type(node) == NODE_TYPE.INSTANCE_DISK:
-            disk = InfoGraphNode.get_name(node).split("_")[1]
-        return disk
+        return self._tags_of(node).disk(node)
 
     def _pu(self, node, metric):
-        pu = None
-        if (InfoGraphNode.get_type(node) == NODE_TYPE.PHYSICAL_PU or
-                    InfoGraphNode.get_type(node) == NODE_TYPE.PHYSICAL_MACHINE):
-            attrs = InfoGraphNode.get_attributes(node)
-            # fix attributes from landscaper - fixing
-            # permanently on the fly if needed
-
-            while attrs.get('attributes', None):
-                attrs = attrs['attributes']
-
-            if 'os_index' in attrs:
-                pu = attrs["os_index"]
+        pu = self._tags_of(node).pu(node)
         # metric prefix 'cpu' on to the front of the cpu number.
         if pu and ('intel/proc/schedstat/cpu/' in metric or 'intel/psutil/cpu/' in metric):
             pu = "cpu{}".format(pu)
         return pu
 
-    def _nic(self, node, tag_key):
-        nic = None
-        if InfoGraphNode.get_type(node) == NODE_TYPE.PHYSICAL_NIC:
-            attrs = InfoGraphNode.get_attributes(node)
-            if tag_key == "hardware_addr":
-                nic = attrs["address"]
-            elif 'osdev_network-name' in attrs:
-                nic = attrs["osdev_network-name"]
-            elif 'name' in attrs:
-                nic = attrs["name"]
-        # if InfoGraphNode.get_type(node) == NODE_TYPE.PHYSICAL_MACHINE:
-        #     LOG.info('NODEEEEE: {}'.format(node))
-        return nic
+    def _nic(self, node, tag_key=None):
+        return self._tags_of(node).nic(node, tag_key)
 
     def _stack(self, node):
-        if InfoGraphNode.get_type(node) == NODE_TYPE.VIRTUAL_MACHINE:
-            # Taking service node to which the VM is connected
-            predecessors = self.landscape.predecessors(
-                InfoGraphNode.get_name(node))
-            for predecessor in predecessors:
-                predecessor_node = self.landscape.node[predecessor]
-                if predecessor_node['type'] == NODE_TYPE.SERVICE_COMPUTE:
-                    if 'stack_name' in predecessor_node:
-                        return predecessor_node["stack_name"]
-        return None
+        return self._tags_of(node).stack(node)
 
-    def _nova_uuid(self, node):
-        if InfoGraphNode.get_type(node) == NODE_TYPE.INSTANCE_DISK:
-            disk_name = InfoGraphNode.get_name(node)
-            vm = self.landscape.get_neighbour_by_type(disk_name, "vm")
-            return vm
-        if InfoGraphNode.get_type(node) == NODE_TYPE.PHYSICAL_MACHINE:
-            vm = self.vms.pop()
-            return vm
-        return None
+    def _tags_of(self, node):
+        """
+        Returns the tag index of the landscape being annotated.
+        """
+        if self.tag_index is None:
+            raise ValueError("No landscape indexed to resolve the tags of "
+                             "node {}".format(InfoGraphNode.get_name(node)))
+        return self.tag_index
 
     def _cached_metrics(self, identifier, query_tags):
         """
@@ -347,23 +305,12 @@ class SnapAnnotation(GraphTelemetry):
                             and not self._exception(node, metric):
                         if metric.startswith("intel/net/"):
                             nic_id = self._nic(node)
-                            if nic_id in metric:
-                                metrics.append(metric)
-                        if metric.startswith('intel/libvirt/'):
-                            self._get_nova_uuids(node)
-                            for x in range(0, len(self.vms)):
-                                #LOG.info('Adding {}'.format(metric))
+                            if nic_id and nic_id in metric:
                                 metrics.append(metric)
                         else:
                             metrics.append(metric)
         return metrics
 
-    def _get_nova_uuids(self, node):
-        if InfoGraphNode.get_type(node) == NODE_TYPE.PHYSICAL_MACHINE:
-            phy_name = InfoGraphNode.get_name(node)
-            self.vms = self.landscape.get_neighbours_by_type(phy_name, "vm")
-            #LOG.info('Collecting nova uuids: {}'.format(self.vms))
-
     def _source_metrics(self, node):
         """
         Retrieves metrics associated with a source/host.  The source is 
@@ -0,0 +1,217 @@
+# Copyright (c) 2017, Intel Research and Development Ireland Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = 'Giuliana Carullo'
+__copyright__ = "Copyright (c) 2017, Intel Research and Development Ireland Ltd."
+__license__ = "Apache 2.0"
+__maintainer__ = "Giuliana Carullo"
+__email__ = "giuliana.carullo@intel.com"
+__status__ = "Development"
+
+from analytics_engine import common
+from analytics_engine.heuristics.beans.infograph import InfoGraphNode
+from analytics_engine.heuristics.beans.infograph import InfoGraphNodeLayer as GRAPH_LAYER
+from analytics_engine.heuristics.beans.infograph import InfoGraphNodeType as NODE_TYPE
+
+LOG = common.LOG
+
+
+class SnapTagIndex(object):
+    """
+    Values of the snap tags of all the nodes of a landscape, resolved in a
+    single pass when the landscape is indexed.
+
+    Resolving the source, stack or VMs of a node requires scanning its
+    neighbours: the index does it once per node instead of once per metric,
+    so that building the queries of a node only takes dictionary lookups.
+    The index is never modified once built and can be shared by threads.
+    """
+
+    def __init__(self, landscape):
+        """
+        :param landscape: (InfoGraph) graph whose nodes are indexed
+        """
+        self.landscape = landscape
+        self.sources = dict()
+        self.stacks = dict()
+        self.vms = dict()
+        self.disks = dict()
+        self.nics = dict()
+        self.nic_addresses = dict()
+        self.pus = dict()
+        for node in landscape.nodes(data=True):
+            try:
+                self._add(node)
+            except Exception as e:
+                # Tags missing from the index are resolved again on lookup,
+                # raising for the metrics which need them
+                LOG.debug('Tags of node {} not indexed: {}'.
+                          format(InfoGraphNode.get_name(node), e))
+
+    def _add(self, node):
+        name = InfoGraphNode.get_name(node)
+        self.sources[name] = SnapTagIndex.resolve_source(self.landscape, node)
+        node_type = InfoGraphNode.get_type(node)
+        if node_type == NODE_TYPE.VIRTUAL_MACHINE:
+            self.stacks[name] = SnapTagIndex.resolve_stack(
+                self.landscape, node)
+        elif node_type == NODE_TYPE.PHYSICAL_MACHINE:
+            self.vms[name] = self.landscape.get_neighbours_by_type(
+                name, NODE_TYPE.VIRTUAL_MACHINE)
+        elif node_type == NODE_TYPE.INSTANCE_DISK:
+            self.vms[name] = [self.landscape.get_neighbour_by_type(
+                name, NODE_TYPE.VIRTUAL_MACHINE)]
+        if node_type in [NODE_TYPE.PHYSICAL_DISK, NODE_TYPE.PHYSICAL_MACHINE,
+                         NODE_TYPE.INSTANCE_DISK]:
+            self.disks[name] = SnapTagIndex.resolve_disk(node)
+        if node_type == NODE_TYPE.PHYSICAL_NIC:
+            attrs = InfoGraphNode.get_attributes(node)
+            self.nics[name] = attrs.get('osdev_network-name',
+                                        attrs.get('name'))
+            if 'address' in attrs:
+                self.nic_addresses[name] = attrs['address']
+        if node_type in [NODE_TYPE.PHYSICAL_PU, NODE_TYPE.PHYSICAL_MACHINE]:
+            self.pus[name] = self.pu(node)
+
+    def source(self, node):
+        """
+        :return: (str) name of the machine (or VM) the telemetry of the node
+                 is reported by
+        """
+        name = InfoGraphNode.get_name(node)
+        if name in self.sources:
+            return self.sources[name]
+        return SnapTagIndex.resolve_source(self.landscape, node)
+
+    def stack(self, node):
+        """
+        :return: (str) name of the stack of a VM, None for other nodes
+        """
+        name = InfoGraphNode.get_name(node)
+        if name in self.stacks:
+            return self.stacks[name]
+        return SnapTagIndex.resolve_stack(self.landscape, node)
+
+    def disk(self, node):
+        """
+        :return: (str) device name of a disk
+        """
+        name = InfoGraphNode.get_name(node)
+        if name in self.disks:
+            return self.disks[name]
+        return SnapTagIndex.resolve_disk(node)
+
+    def nic(self, node, tag_key=None):
+        """
+        :return: (str) device name of a NIC, or its hardware address if
+                 tag_key is 'hardware_addr'
+        """
+        if InfoGraphNode.get_type(node) != NODE_TYPE.PHYSICAL_NIC:
+            return None
+        name = InfoGraphNode.get_name(node)
+        if tag_key == "hardware_addr":
+            if name in self.nic_addresses:
+                return self.nic_addresses[name]
+            return InfoGraphNode.get_attributes(node)["address"]
+        if name in self.nics:
+            return self.nics[name]
+        attrs = InfoGraphNode.get_attributes(node)
+        return attrs.get('osdev_network-name', attrs.get('name'))
+
+    def pu(self, node):
+        """
+        :return: (int) OS index of a PU
+        """
+        name = InfoGraphNode.get_name(node)
+        if name in self.pus:
+            return self.pus[name]
+        if InfoGraphNode.get_type(node) in [NODE_TYPE.PHYSICAL_PU,
+                                            NODE_TYPE.PHYSICAL_MACHINE]:
+            return SnapTagIndex._unwrap(
+                InfoGraphNode.get_attributes(node)).get('os_index')
+        return None
+
+    def nova_uuids(self, node):
+        """
+        :return: (list of str) VMs whose libvirt telemetry is reported for
+                 the node: all the VMs of a machine, the VM of a disk
+        """
+        return self.vms.get(InfoGraphNode.get_name(node), [])
+
+    @staticmethod
+    def _unwrap(attrs):
+        # fix attributes from landscaper
+        while attrs.get('attributes', None):
+            attrs = attrs['attributes']
+        return attrs
+
+    @staticmethod
+    def resolve_source(landscape, node):
+        attrs = InfoGraphNode.get_attributes(node)
+        if InfoGraphNode.get_layer(node) == GRAPH_LAYER.PHYSICAL:
+            if 'allocation' in attrs:
+                return attrs['allocation']
+            # fix due to the landscape
+            attrs = SnapTagIndex._unwrap(attrs)
+            if 'allocation' in attrs:
+                return attrs['allocation']
+        if InfoGraphNode.get_type(node) == NODE_TYPE.VIRTUAL_MACHINE:
+            if 'vm_name' in attrs:
+                return attrs['vm_name']
+        if InfoGraphNode.get_type(node) == NODE_TYPE.INSTANCE_DISK:
+            # The machine is the source as this is a libvirt disk.
+            disk_name = InfoGraphNode.get_name(node)
+            vm = landscape.get_neighbour_by_type(
+                disk_name, NODE_TYPE.VIRTUAL_MACHINE)
+            machine = landscape.get_neighbour_by_type(
+                vm, NODE_TYPE.PHYSICAL_MACHINE)
+            return machine
+        if InfoGraphNode.get_type(node) == NODE_TYPE.PHYSICAL_MACHINE:
+            if 'name' in attrs:
+                return attrs['name']
+        if InfoGraphNode.get_type(node) == NODE_TYPE.DOCKER_CONTAINER:
+            docker_node = landscape.get_neighbour_by_type(
+                InfoGraphNode.get_name(node), 'docker_node')
+            if docker_node:
+                machine = landscape.get_neighbour_by_type(docker_node,
+                                                          'machine')
+                return machine
+        return None
+
+    @staticmethod
+    def resolve_stack(landscape, node):
+        if InfoGraphNode.get_type(node) == NODE_TYPE.VIRTUAL_MACHINE:
+            # Taking service node to which the VM is connected
+            predecessors = landscape.predecessors(
+                InfoGraphNode.get_name(node))
+            for predecessor in predecessors:
+                predecessor_node = landscape.node[predecessor]
+                if predecessor_node['type'] == NODE_TYPE.SERVICE_COMPUTE:
+                    if 'stack_name' in predecessor_node:
+                        return predecessor_node["stack_name"]
+        return None
+
+    @staticmethod
+    def resolve_disk(node):
+        disk = None
+        if (InfoGraphNode.get_type(node) == NODE_TYPE.PHYSICAL_DISK or
+                InfoGraphNode.get_type(node) == NODE_TYPE.PHYSICAL_MACHINE):
+            attrs = InfoGraphNode.get_attributes(node)
+            if 'osdev_storage-name' in attrs:
+                disk = attrs["osdev_storage-name"]
+            elif 'name' in attrs:
+                disk = attrs["name"]
+        elif InfoGraphNode.get_type(node) == NODE_TYPE.INSTANCE_DISK:
+            disk = InfoGraphNode.get_name(node).split("_")[1]
+        return disk
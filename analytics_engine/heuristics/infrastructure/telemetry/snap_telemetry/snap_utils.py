@@ -20,11 +20,31 @@ __email__ = "giuliana.carullo@intel.com"
 __status__ = "Development"
 
 import pandas
-from analytics_engine.heuristics.beans.infograph import InfoGraphNode
+from analytics_engine.heuristics.beans.infograph import \
+    InfoGraphNode, InfoGraphNodeProperty, InfoGraphNodeType
+from analytics_engine.heuristics.infrastructure.telemetry.snap_telemetry.derived_metrics import DerivedMetrics
 from analytics_engine import common
 
 LOG = common.LOG
 
+# Machine utilization built from the utilization of its PUs, disks and NICs
+# when no /use/ metric is available for the machine:
+# (getter, setter, machine metric, child metric)
+MACHINE_ROLLUPS = {
+    'compute': (InfoGraphNode.get_compute_utilization,
+                InfoGraphNode.set_compute_utilization,
+                'intel/use/compute/utilization',
+                'intel/procfs/cpu/utilization_percentage'),
+    'disk': (InfoGraphNode.get_disk_utilization,
+             InfoGraphNode.set_disk_utilization,
+             'intel/use/disk/utilization',
+             'intel/procfs/disk/utilization_percentage'),
+    'network': (InfoGraphNode.get_network_utilization,
+                InfoGraphNode.set_network_utilization,
+                'intel/use/network/utilization',
+                'intel/psutil/net/utilization_percentage')
+}
+
 class SnapUtils(object):
 
     @staticmethod
@@ -83,113 +103,93 @@ class SnapUtils(object):
             LOG.debug('Found use network for node {}'.format(InfoGraphNode.get_name(node)))
 
     @staticmethod
-    def utilization(internal_graph, node, telemetry):
-        # machine usage
-        telemetry_data = telemetry.get_data(node)
-        if 'intel/use/compute/utilization' in telemetry_data:
-            InfoGraphNode.set_compute_utilization(node,
-                                                  pandas.DataFrame(telemetry_data['intel/use/compute/utilization'],
-                                                                   columns=['intel/use/compute/utilization']))
-        # pu usage
-        if 'intel/procfs/cpu/utilization_percentage' in telemetry_data:
-                InfoGraphNode.set_compute_utilization(node,
-                                                      pandas.DataFrame(
-                                                          telemetry_data['intel/procfs/cpu/utilization_percentage'],
-                                                          columns=['intel/procfs/cpu/utilization_percentage']))
-        if 'intel/use/memory/utilization' in telemetry_data:
-            InfoGraphNode.set_memory_utilization(node, pandas.DataFrame(telemetry_data['intel/use/memory/utilization']))
-        if 'intel/use/disk/utilization' in telemetry_data:
-            InfoGraphNode.set_disk_utilization(node, pandas.DataFrame(telemetry_data['intel/use/disk/utilization']))
-        if 'intel/use/network/utilization' in telemetry_data:
-            InfoGraphNode.set_network_utilization(node,
-                                                  pandas.DataFrame(telemetry_data['intel/use/network/utilization']))
-        # supporting not available /use/ metrics
+    def annotate_machine_utils(internal_graph, nodes):
+        """
+        Propagates the utilization of the given PUs, disks and NICs to the
+        machines they belong to, as the annotate_machine_*_util methods do
+        node by node.
+        Nodes are grouped by machine first, so that the utilization frame of
+        each machine is built once with the columns of all its children.
+
+        :param internal_graph: (InfoGraph) annotated graph
+        :param nodes: (list of InfoGraph nodes) nodes with utilization
+        :return: None
+        """
+        children = dict()
+        for node in nodes:
+            if InfoGraphNode.get_type(node) == InfoGraphNodeType.PHYSICAL_PU:
+                key = (InfoGraphNode.get_machine_name_of_pu(node), 'compute')
+            elif InfoGraphNode.node_is_disk(node):
+                key = (node[1].get('allocation'), 'disk')
+            elif InfoGraphNode.node_is_nic(node):
+                key = (node[1].get('allocation'), 'network')
+            else:
+                continue
+            children.setdefault(key, list()).append(node)
 
-        if 'intel/procfs/meminfo/mem_total' in telemetry_data and 'intel/procfs/meminfo/mem_used' in telemetry_data:
-            # LOG.info('Found memory utilization procfs')
-            mem_used = telemetry_data['intel/procfs/meminfo/mem_used'].fillna(0)
-            mem_total = telemetry_data['intel/procfs/meminfo/mem_total'].fillna(0)
-            mem_util = mem_used * 100 / mem_total
-            mem_util.name = 'intel/procfs/memory/utilization_percentage'
-            InfoGraphNode.set_memory_utilization(node, pandas.DataFrame(mem_util))
-        if 'intel/procfs/disk/io_time' in telemetry_data:
-            io_time = telemetry_data['intel/procfs/disk/io_time'].fillna(0)
-            disk_util = io_time*100/1000
-            disk_util.name = 'intel/procfs/disk/utilization_percentage'
-            InfoGraphNode.set_disk_utilization(node, pandas.DataFrame(disk_util))
-        if 'intel/psutil/net/bytes_recv' in telemetry_data and 'intel/psutil/net/bytes_sent' in telemetry_data:
-            source=telemetry._source(node)
-            machine = InfoGraphNode.get_node(internal_graph, source)
-            nic_speed = InfoGraphNode.get_nic_speed_mbps(machine) * 1000000
-            net_data = telemetry_data.filter(['timestamp', 'intel/psutil/net/bytes_recv','intel/psutil/net/bytes_sent'], axis=1)
-            net_data.fillna(0)
-            net_data['intel/psutil/net/bytes_total'] = net_data['intel/psutil/net/bytes_recv']+net_data['intel/psutil/net/bytes_sent']
-            net_data_interval = net_data.set_index('timestamp').diff()
-            net_data_interval['intel/psutil/net/utilization_percentage'] = net_data_interval['intel/psutil/net/bytes_total'] * 100 /nic_speed
-            net_data_pct = pandas.DataFrame(net_data_interval['intel/psutil/net/utilization_percentage'])
-            InfoGraphNode.set_network_utilization(node, net_data_pct)
-        elif 'intel/procfs/iface/bytes_recv' in telemetry_data and 'intel/procfs/iface/bytes_recv' in telemetry_data:
-            source=telemetry._source(node)
-            machine = InfoGraphNode.get_node(internal_graph, source)
-            nic_speed = InfoGraphNode.get_nic_speed_mbps(machine) * 1000000
-            net_data = telemetry_data.filter(['timestamp', 'intel/procfs/iface/bytes_recv','intel/procfs/iface/bytes_sent'], axis=1)
-            net_data.fillna(0)
-            net_data['intel/psutil/net/bytes_total'] = net_data['intel/procfs/iface/bytes_recv']+net_data['intel/procfs/iface/bytes_sent']
-            net_data_interval = net_data.set_index('timestamp').diff()
-            net_data_interval['intel/psutil/net/utilization_percentage'] = net_data_interval['intel/psutil/net/bytes_total'] * 100 /nic_speed
-            net_data_pct = pandas.DataFrame(net_data_interval['intel/psutil/net/utilization_percentage'])
-            InfoGraphNode.set_network_utilization(node, net_data_pct)
-        if 'intel/docker/stats/cgroups/cpu_stats/cpu_usage/total' in telemetry_data:
-            # Container node
-            #cpu util
-            cpu_data = telemetry_data.filter(['timestamp', 'intel/docker/stats/cgroups/cpu_stats/cpu_usage/total'], axis=1)
-            cpu_data_interval = cpu_data.set_index('timestamp').diff()
-            #util data in nanoseconds
-            cpu_data_interval['intel/docker/stats/cgroups/cpu_stats/cpu_usage/percentage'] = cpu_data_interval['intel/docker/stats/cgroups/cpu_stats/cpu_usage/total'] / 10000000
-            cpu_data_pct = pandas.DataFrame(cpu_data_interval['intel/docker/stats/cgroups/cpu_stats/cpu_usage/percentage'])
-            InfoGraphNode.set_compute_utilization(node, cpu_data_pct)
-        if "intel/docker/stats/cgroups/memory_stats/usage/usage" in telemetry_data:
-            #container mem util
-            source=telemetry._source(node)
-            machine = InfoGraphNode.get_node(internal_graph, source)
-            local_mem = int(InfoGraphNode.get_attributes(machine).get("local_memory"))
-            mem_data = telemetry_data.filter(['timestamp', "intel/docker/stats/cgroups/memory_stats/usage/usage"], axis=1)
-            mem_data["intel/docker/stats/cgroups/memory_stats/usage/percentage"] = mem_data["intel/docker/stats/cgroups/memory_stats/usage/usage"]/local_mem * 100
-            mem_data_pct = pandas.DataFrame(mem_data["intel/docker/stats/cgroups/memory_stats/usage/percentage"])
-            InfoGraphNode.set_memory_utilization(node, mem_data_pct)
-        if "intel/docker/stats/network/tx_bytes" in telemetry_data:
-            #container network util
-            source=telemetry._source(node)
-            machine = InfoGraphNode.get_node(internal_graph, source)
-            nic_speed = InfoGraphNode.get_nic_speed_mbps(machine) * 1000000
-            net_data = telemetry_data.filter(['timestamp', "intel/docker/stats/network/tx_bytes","intel/docker/stats/network/rx_bytes"], axis=1)
-            net_data.fillna(0)
-            net_data['intel/docker/stats/network/bytes_total'] = net_data["intel/docker/stats/network/tx_bytes"]+net_data["intel/docker/stats/network/rx_bytes"]
-            net_data_interval = net_data.set_index('timestamp').diff()
-            net_data_interval['intel/docker/stats/network/utilization_percentage'] = net_data_interval['intel/docker/stats/network/bytes_total'] * 100 /nic_speed
-            net_data_pct = pandas.DataFrame(net_data_interval['intel/docker/stats/network/utilization_percentage'])
-            InfoGraphNode.set_network_utilization(node, net_data_pct)
-        if "intel/docker/stats/cgroups/blkio_stats/io_time_recursive/value" in telemetry_data:
-            #container disk util
-            disk_data = telemetry_data.filter(['timestamp', "intel/docker/stats/cgroups/blkio_stats/io_time_recursive/value"], axis=1)
-            disk_data_interval = disk_data.set_index('timestamp').diff()
-            #util data in milliseconds
-            disk_data_interval["intel/docker/stats/cgroups/blkio_stats/io_time_recursive/percentage"] = \
-                disk_data_interval["intel/docker/stats/cgroups/blkio_stats/io_time_recursive/value"] / 1000000
-            disk_data_pct = pandas.DataFrame(disk_data_interval["intel/docker/stats/cgroups/blkio_stats/io_time_recursive/percentage"])
-            InfoGraphNode.set_disk_utilization(node, disk_data_pct)
+        for (source, category), machine_children in children.items():
+            try:
+                machine = InfoGraphNode.get_node(internal_graph, source)
+            except (KeyError, ValueError):
+                # Machine not in the graph, or no allocation for the children
+                LOG.debug('Machine {} not found in the graph'.format(source))
+                continue
+            get_util, set_util, machine_metric, child_metric = \
+                MACHINE_ROLLUPS[category]
+            machine_util = get_util(machine)
+            if machine_metric in machine_util.columns:
+                LOG.debug('Found use {} for node {}'.format(
+                    category, InfoGraphNode.get_name(machine)))
+                continue
+            columns = list()
+            for child in machine_children:
+                child_util = get_util(child)
+                if child_metric in child_util.columns:
+                    column = child_util[child_metric].fillna(0)
+                    column.name = child[1]['name']
+                    columns.append(column)
+                else:
+                    LOG.info('{} util not Found use for node {}'.format(
+                        category, InfoGraphNode.get_name(child)))
+            if not columns:
+                continue
+            # Rows are the ones of the machine or, if it has none yet, the
+            # ones of its first child with samples
+            index = machine_util.index
+            if not len(index):
+                index = next((column.index for column in columns
+                              if len(column.index)), index)
+            machine_util = machine_util.drop(
+                [column.name for column in columns
+                 if column.name in machine_util.columns], axis=1)
+            set_util(machine,
+                     pandas.concat([machine_util] + [
+                         column.reindex(index) for column in columns],
+                         axis=1).reindex(index))
 
+    @staticmethod
+    def utilization(internal_graph, node, telemetry):
+        """
+        Annotates the node with the utilization derived from its telemetry,
+        according to the DERIVED_METRICS rules.
+        """
+        SnapUtils._derive(internal_graph, node, telemetry,
+                          utilization=True, saturation=False)
 
     @staticmethod
     def saturation(internal_graph, node, telemetry):
-        telemetry_data = telemetry.get_data(node)
-        if 'intel/use/compute/saturation' in telemetry_data:
-            InfoGraphNode.set_compute_saturation(node,
-                                                 pandas.DataFrame(telemetry_data['intel/use/compute/saturation']))
-        if 'intel/use/memory/saturation' in telemetry_data:
-            InfoGraphNode.set_memory_saturation(node, pandas.DataFrame(telemetry_data['intel/use/memory/saturation']))
-        if 'intel/use/disk/saturation' in telemetry_data:
-            InfoGraphNode.set_disk_saturation(node, pandas.DataFrame(telemetry_data['intel/use/disk/saturation']))
-        if 'intel/use/network/saturation' in telemetry_data:
-            InfoGraphNode.set_network_saturation(node,
-                                                 pandas.DataFrame(telemetry_data['intel/use/network/saturation']))
+        """
+        Annotates the node with the saturation derived from its telemetry,
+        according to the DERIVED_METRICS rules.
+        """
+        SnapUtils._derive(internal_graph, node, telemetry,
+                          utilization=False, saturation=True)
+
+    @staticmethod
+    def _derive(internal_graph, node, telemetry, utilization, saturation):
+        # Telemetry already fetched for the node is not fetched again
+        if node[1].get(InfoGraphNodeProperty.TELEMETRY_DATA) is None:
+            InfoGraphNode.set_telemetry_data(node, telemetry.get_data(node))
+        DerivedMetrics.annotate(internal_graph, telemetry, [node],
+                                utilization=utilization,
+                                saturation=saturation)
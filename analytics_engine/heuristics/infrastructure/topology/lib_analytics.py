@@ -21,15 +21,16 @@ __status__ = "Development"
 
 from analytics_engine import common
 from analytics_engine.heuristics.beans.infograph import InfoGraphNode, InfoGraphUtilities
+from analytics_engine.heuristics.beans.compact_node import CompactNodeRecord
+from analytics_engine.heuristics.beans.telemetry_store import TelemetryStore
 from analytics_engine.heuristics.filters import telemetry_annotation as ta
 from analytics_engine.heuristics.filters import parallelized_telemetry_annotation as pta
 from analytics_engine.infrastructure_manager import graphs
 from analytics_engine.infrastructure_manager.config_helper import ConfigHelper
-import threading
-import multiprocessing
 
 # ApexLake dependencies
 from analytics_engine.infrastructure_manager import landscape
+from analytics_engine.infrastructure_manager.landscape_sync import LandscapeSync
 import time
 LOG = common.LOG
 
@@ -101,12 +102,9 @@ class SubGraphExtraction(object):
                     str(stack_name), ts_from, ts_to)
                 if len(graph.nodes()) > 0:
                     temp_res.append(graph)
-            for graph in temp_res:
-                if not res and len(graph.nodes()) > 0:
-                    res = graph
-                elif len(graph.nodes()) > 0:
-                    # TODO - URGENT: Fix this. Put Merge within the analytics
-                    res = graphs.merge_graph(res, graph)
+            if temp_res:
+                # TODO - URGENT: Fix this. Put Merge within the analytics
+                res = graphs.GraphMerger(temp_res).merged()
         # TODO - URGENT: Check this with the new Lanscape
         machine_count = 0
         for node in res.nodes(data=True):
@@ -155,12 +153,7 @@ class SubGraphExtraction(object):
         except:
             time_window = 600
         landscape_res = landscape.get_subgraph(
-            node_id, ts_from, time_window)
-
-        for node in landscape_res.nodes(data=True):
-            attrs = InfoGraphNode.get_attributes(node)
-            attrs = InfoGraphUtilities.str_to_dict(attrs)
-            InfoGraphNode.set_attributes(node, attrs)
+            node_id, ts_from, time_window, decode_attributes=True)
 
         return landscape_res
 
@@ -187,15 +180,12 @@ class SubGraphExtraction(object):
                     LOG.info("No graph for a service returned from analytics")
                     return None
 
-            res = landscape.get_subgraph(landscape_res.nodes()[0], ts_from, time_window)
+            res = landscape.get_subgraph(landscape_res.nodes()[0], ts_from,
+                                         time_window, decode_attributes=True)
         except Exception as e:
             LOG.debug('Something went seriously wrong.')
             LOG.error(e)
 
-        for node in res.nodes(data=True):
-            attrs = InfoGraphNode.get_attributes(node)
-            attrs = InfoGraphUtilities.str_to_dict(attrs)
-            InfoGraphNode.set_attributes(node, attrs)
         return res
 
     def _get_network_subgraph(self, ts_from=None, ts_to=None):
@@ -270,7 +260,9 @@ class SubgraphUtilities(object):
     @staticmethod
     def extract_infrastructure_graph(workload_name, ts_from, ts_to):
         """
-        Returns the entire landscape at the current time
+        Returns the entire landscape at the current time, copied from the
+        local landscape if kept in sync (see LandscapeSync), the
+        synchronization being started by the first call.
 
         :return:
         """
@@ -281,46 +273,35 @@ class SubgraphUtilities(object):
         # res = subgraph_extraction.get_workload_view_graph(
         #     workload_name, int(ts_from), int(ts_to),
         #     name_filtering_support=True)
-        res = landscape.get_graph()
-        #PARALLEL = True
-        if PARALLEL:
-            i = 0
-            threads = []
-            cpu_count = multiprocessing.cpu_count()
-            all_node = res.nodes(data=True)
-            no_node_thread = len(res.nodes()) / cpu_count
-            node_pool = []
-
-            for node in all_node:
-                if i < no_node_thread:
-                    node_pool.append(node)
-                    i = i + 1
-                else:
-                    thread1 = ParallelLandscape(i, "Thread-{}".format(InfoGraphNode.get_name(node)), i,
-                                                          node_pool)
-                    # thread1 = ParallelTelemetryAnnotation(i, "Thread-{}".format(InfoGraphNode.get_name(node)), i,
-                    #                                       node_pool, internal_graph, self.telemetry, ts_to, ts_from)
-                    thread1.start()
-                    threads.append(thread1)
-                    i = 0
-                    node_pool = []
-            if len(node_pool) != 0:
-                thread1 = ParallelLandscape(i, "Thread-{}".format(InfoGraphNode.get_name(node)), i,
-                                            node_pool)
-                thread1.start()
-                threads.append(thread1)
-
-            [t.join() for t in threads]
-        else:
-            for node in res.nodes(data=True):
-                attrs = InfoGraphNode.get_attributes(node)
-                attrs = InfoGraphUtilities.str_to_dict(attrs)
-                InfoGraphNode.set_attributes(node, attrs)
+        compact = SubgraphUtilities._compact_landscape()
+        # The local landscape is compacted once, when synchronized
+        sync = LandscapeSync.start_sync(
+            prepare=CompactNodeRecord.compact_graph if compact else None)
+        if sync:
+            return sync.get_graph()
+        # Attributes are decoded while loading the landscape
+        res = landscape.get_graph(decode_attributes=True)
+        if compact:
+            CompactNodeRecord.compact_graph(res)
         return res
 
+    @staticmethod
+    def _compact_landscape():
+        """
+        Whether whole landscapes are held as compact node records, as set by
+        the optional compact attribute of the LANDSCAPE configuration.
+        """
+        try:
+            compact = ConfigHelper.get("LANDSCAPE", "compact")
+        except Exception:
+            return False
+        return str(compact).lower() in ['true', '1', 'yes']
+
 
     @staticmethod
-    def graph_telemetry_annotation(graph, ts_from, ts_to, telemetry_type='snap'):
+    def graph_telemetry_annotation(graph, ts_from, ts_to, telemetry_type='snap',
+                                   lazy=False, columnar=False, previous=None,
+                                   deadline=None, node_types=None):
         """
         Annotates the provided graph with telemetry information
 
@@ -329,6 +310,18 @@ class SubgraphUtilities(object):
                         time window)
         :param ts_to: (int) epoch end time of the experiment (or of the
                         time window)
+        :param lazy: (bool) if True telemetry is fetched for each node only
+                     when first accessed
+        :param columnar: (bool) if True the telemetry of all the nodes is
+                         moved into a TelemetryStore attached to the graph
+        :param previous: (InfoGraph) graph annotated over an earlier window:
+                         its telemetry is reused, only fetching the samples
+                         collected after that window
+        :param deadline: (float) epoch by which the annotation has to
+                         complete: nodes whose telemetry is not fetched by
+                         then are marked as telemetry incomplete
+        :param node_types: (list of str) node types needed downstream, the
+                           only ones annotated when a deadline is set
         :return: TBD
         """
         # TODO - P5: Validate Graph
@@ -345,7 +338,8 @@ class SubgraphUtilities(object):
             ts_to = int(time.time())
             ts_from = ts_to - (MILLISECONDS*MINUTES_TF)
         #PARALLEL = True
-        if PARALLEL and telemetry_type=='snap':
+        if PARALLEL and telemetry_type=='snap' and not lazy and \
+                previous is None and deadline is None:
             annotation = \
                 pta.TelemetryAnnotation(
                     telemetry_system=telemetry_type)
@@ -353,8 +347,15 @@ class SubgraphUtilities(object):
             annotation = \
                 ta.TelemetryAnnotation(
                     telemetry_system=telemetry_type)
+        if lazy:
+            return annotation.get_annotated_graph(
+                graph, ts_from, ts_to, utilization=True, saturation=True,
+                lazy=True)
         res = annotation.get_annotated_graph(
-            graph, ts_from, ts_to, utilization=True, saturation=True)
+            graph, ts_from, ts_to, utilization=True, saturation=True,
+            previous=previous, deadline=deadline, node_types=node_types)
+        if columnar:
+            TelemetryStore.attach(res)
         return res
 
 
@@ -374,25 +375,3 @@ class LandscapeUtils(object):
             tf = 0
         res = landscape.get_node_by_properties(properties, from_ts, tf)
         return res
-
-class ParallelLandscape(threading.Thread):
-
-    def __init__(self, threadID, name, counter, node):
-        threading.Thread.__init__(self)
-        self.threadID = threadID
-        self.name = name
-        self.counter = counter
-        self.node_pool = node
-
-    def run(self):
-        for node in self.node_pool:
-            attrs = InfoGraphNode.get_attributes(node)
-            attrs = InfoGraphUtilities.str_to_dict(attrs)
-            InfoGraphNode.set_attributes(node, attrs)
-
-
-
-
-
-
-
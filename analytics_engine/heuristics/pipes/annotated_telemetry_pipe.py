@@ -38,7 +38,8 @@ class AnnotatedTelemetryPipe(Pipe):
     :param workload
     :return: workload decorated with the annotated graph (landscape and telemetry).
     """
-    def run(self, workload):
+    def run(self, workload, lazy=False, previous=None, deadline=None,
+            node_types=None, columnar=False):
         telemetry_system = ConfigHelper.get("DEFAULT","telemetry")
         if not telemetry_system:
             telemetry_system = 'snap'
@@ -59,10 +60,17 @@ class AnnotatedTelemetryPipe(Pipe):
             graph_filter = GraphFilter()
             graph_filter.run(workload)
         sub_filter_ann = SubgraphAnnotatedFilter()
-        sub_filter_ann.run(workload, telemetry_system)
+        sub_filter_ann.run(workload, telemetry_system, lazy=lazy,
+                           columnar=columnar and not lazy,
+                           previous=previous,
+                           deadline=deadline, node_types=node_types)
         # sub_filter_ann_filtered = SubgraphFilteredTelemetryFilter()
         # sub_filter_ann_filtered.run(workload)
-        fs = FileSink()
-        fs.save(workload)
+        # With lazy telemetry nothing has been fetched yet, and with a
+        # deadline the caller is waiting: leave the export to the pipe
+        # consuming the graph.
+        if not lazy and deadline is None:
+            fs = FileSink()
+            fs.save(workload)
         return workload
 
@@ -0,0 +1,216 @@
+# Copyright (c) 2017, Intel Research and Development Ireland Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = 'Giuliana Carullo'
+__copyright__ = "Copyright (c) 2017, Intel Research and Development Ireland Ltd."
+__license__ = "Apache 2.0"
+__maintainer__ = "Giuliana Carullo"
+__email__ = "giuliana.carullo@intel.com"
+__status__ = "Development"
+
+import threading
+import time
+from analytics_engine import common
+from analytics_engine.heuristics.beans.infograph import InfoGraphNodeProperty
+from analytics_engine.heuristics.beans.ring_buffer_series import RingBufferFrame
+from analytics_engine.heuristics.infrastructure.telemetry.snap_telemetry.derived_metrics import GETTERS
+from analytics_engine.heuristics.infrastructure.topology.lib_analytics import SubgraphUtilities
+from analytics_engine.infrastructure_manager.config_helper import ConfigHelper
+
+LOG = common.LOG
+
+# Kinds of telemetry kept in the buffers
+BUFFERED = [InfoGraphNodeProperty.TELEMETRY_DATA] + sorted(GETTERS.keys())
+
+# Seconds between two telemetry polls
+DEFAULT_INTERVAL = 10
+# Seconds of telemetry kept in memory for each node
+DEFAULT_WINDOW = 600
+# Samples kept in memory for each metric
+DEFAULT_CAPACITY = 600
+
+
+class AnnotationDaemon(threading.Thread):
+    """
+    Keeps the whole landscape annotated with the telemetry of the last
+    window seconds, polling new telemetry every interval seconds.
+
+    Each poll annotates the landscape from the end of the previous poll
+    (minus one interval, so that rates of the new samples can be derived),
+    reusing the telemetry of the previous poll, and appends the new samples
+    to fixed-size ring buffers: telemetry, utilization and saturation of
+    each node use at most capacity samples per metric.
+    Readers get graphs built on demand from the buffers, restricted to the
+    time range they ask for.
+    """
+
+    _instance = None
+
+    def __init__(self, interval=None, window=None, capacity=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = int(interval or
+                            AnnotationDaemon._conf('interval', DEFAULT_INTERVAL))
+        self.window = int(window or
+                          AnnotationDaemon._conf('window', DEFAULT_WINDOW))
+        self.capacity = int(capacity or
+                            AnnotationDaemon._conf('capacity', DEFAULT_CAPACITY))
+        if self.interval <= 0 or self.window <= 0 or self.capacity <= 0:
+            raise ValueError("Interval, window and capacity must be positive")
+        self.telemetry_system = ConfigHelper.get("DEFAULT", "telemetry") or 'snap'
+        # Graph annotated by the latest poll
+        self._graph = None
+        self._ts_to = None
+        # node name -> telemetry kind (e.g. UTILIZATION_DISK) -> buffer
+        self._buffers = dict()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    @staticmethod
+    def _conf(attribute, default):
+        try:
+            value = ConfigHelper.get("DAEMON", attribute)
+        except Exception:
+            value = None
+        return value or default
+
+    @staticmethod
+    def start_daemon(interval=None, window=None, capacity=None):
+        """
+        Starts the daemon used by the REST API to answer from memory.
+
+        :param interval: (int) seconds between two telemetry polls
+        :param window: (int) seconds of telemetry kept in memory
+        :param capacity: (int) samples kept in memory for each metric
+        :return: (AnnotationDaemon)
+        """
+        daemon = AnnotationDaemon(interval, window, capacity)
+        AnnotationDaemon._instance = daemon
+        daemon.start()
+        return daemon
+
+    @staticmethod
+    def get_instance():
+        """
+        Returns the running daemon, if any.
+
+        :return: (AnnotationDaemon) or None
+        """
+        return AnnotationDaemon._instance
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        LOG.info('Annotating the landscape every {}s over the last {}s'.
+                 format(self.interval, self.window))
+        while not self._stop_event.is_set():
+            started = time.time()
+            try:
+                self.refresh()
+            except Exception as e:
+                LOG.error("Landscape annotation failed: {}".format(e))
+                import traceback
+                traceback.print_exc()
+            self._stop_event.wait(
+                max(0, self.interval - (time.time() - started)))
+
+    def refresh(self):
+        """
+        Annotates the current landscape since the previous poll and adds
+        the new samples to the buffers.
+
+        :return: None
+        """
+        ts_to = int(time.time())
+        ts_from = ts_to - self.window
+        if self._ts_to is not None:
+            ts_from = max(ts_from, self._ts_to - self.interval)
+        graph = SubgraphUtilities.extract_infrastructure_graph(
+            'annotation_daemon_{}'.format(ts_to), ts_from, ts_to)
+        try:
+            annotated = SubgraphUtilities.graph_telemetry_annotation(
+                graph, ts_from, ts_to, self.telemetry_system,
+                previous=self._graph)
+        except Exception as e:
+            if self._graph is None:
+                raise
+            # The landscape is annotated again from scratch rather than
+            # never being updated again
+            LOG.warning("Incremental annotation failed, annotating the "
+                        "whole landscape: {}".format(e))
+            annotated = SubgraphUtilities.graph_telemetry_annotation(
+                graph, ts_from, ts_to, self.telemetry_system)
+        with self._lock:
+            buffers = dict()
+            for node_name, attrs in annotated.nodes(data=True):
+                node_buffers = self._buffers.get(node_name, dict())
+                for key in BUFFERED:
+                    frame = attrs.get(key)
+                    if frame is None:
+                        continue
+                    if key not in node_buffers:
+                        node_buffers[key] = RingBufferFrame(self.capacity)
+                    node_buffers[key].append_frame(frame)
+                buffers[node_name] = node_buffers
+            # Nodes no longer in the landscape are dropped
+            self._buffers = buffers
+            self._graph = annotated
+            self._ts_to = ts_to
+        LOG.debug('Landscape annotated up to {}'.format(ts_to))
+
+    def get_series(self, node_name, metric,
+                   key=InfoGraphNodeProperty.TELEMETRY_DATA):
+        """
+        Returns the buffer of a metric of a node, e.g. to compute its mean
+        over a window without building DataFrames.
+
+        :param node_name: (str)
+        :param metric: (str) metric name
+        :param key: (str) InfoGraphNodeProperty of the kind of telemetry
+        :return: (RingBufferSeries) or None
+        """
+        with self._lock:
+            buffer = self._buffers.get(node_name, dict()).get(key)
+            return buffer.series.get(metric) if buffer else None
+
+    def get_graph(self, seconds=None):
+        """
+        Returns the landscape annotated with the telemetry of the given
+        number of seconds before the last poll.
+
+        :param seconds: (int) time range, all the buffered samples if None
+        :return: (InfoGraph) or None if the landscape has not been
+                 annotated yet
+        """
+        with self._lock:
+            graph = self._graph
+            if graph is None:
+                return None
+            ts_from = None
+            if seconds is not None:
+                ts_from = self._ts_to - int(seconds)
+            res = graph.__class__()
+            res.graph.update(graph.graph)
+            for node_name, attrs in graph.nodes(data=True):
+                attrs = dict(attrs)
+                for key in BUFFERED:
+                    attrs.pop(key, None)
+                for key, buffer in self._buffers.get(node_name, {}).items():
+                    attrs[key] = buffer.to_frame(
+                        ts_from, timestamp_column=(
+                            key == InfoGraphNodeProperty.TELEMETRY_DATA))
+                res.add_node(node_name, attrs)
+            res.add_edges_from(graph.edges(data=True))
+        return res
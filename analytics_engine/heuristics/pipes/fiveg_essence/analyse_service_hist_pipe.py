@@ -25,6 +25,7 @@ from analytics_engine.heuristics.filters.fiveg_essence.service_hist_subgraph_fil
 from analytics_engine.heuristics.filters.fiveg_essence.analyse_service_hist_filter import AnalyseServiceHistoryFilter
 from analytics_engine.infrastructure_manager.config_helper import ConfigHelper
 from analytics_engine.heuristics.sinks.file_sink import FileSink
+from analytics_engine.heuristics.sinks.snapshot_sink import SnapshotSink
 from analytics_engine.heuristics.infrastructure.topology.lib_analytics import SubgraphUtilities
 import time
 
@@ -59,22 +60,7 @@ class AnalyseServiceHistPipe(Pipe):
         # influx_sink.save(workload)
         fs = FileSink()
         fs.save(workload, topology=False)
-        # temp code
-        import os
-        import pickle
-        LOCAL_RES_DIR = os.path.join(common.INSTALL_BASE_DIR, "exported_data")
-        exp_dir = os.path.join(LOCAL_RES_DIR, str(workload.get_workload_name()))
-        if not os.path.exists(LOCAL_RES_DIR):
-            os.mkdir(LOCAL_RES_DIR)
-
-        if not os.path.exists(exp_dir):
-            os.mkdir(exp_dir)
-        filename = os.path.join(
-            exp_dir,
-            "{}.pickle".format(workload.get_workload_name()))
-        subgraph_topology = workload.get_latest_graph()
-        with open(filename, 'w') as outfile:
-            pickle.dump(subgraph_topology, outfile)
-        ##########################
+        snapshot_sink = SnapshotSink()
+        snapshot_sink.save(workload)
         print "Data saved in AnalyseServiceHistPipe Pipe: {}".format(time.time())
         return workload
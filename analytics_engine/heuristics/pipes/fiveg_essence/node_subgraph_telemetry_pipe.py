@@ -24,6 +24,7 @@ from analytics_engine.heuristics.pipes.base import Pipe
 from analytics_engine.heuristics.filters.node_subgraph_filter import NodeSubgraphFilter
 from analytics_engine.heuristics.filters.subgraph_annotated_filter import SubgraphAnnotatedFilter
 from analytics_engine.heuristics.sinks.file_sink import FileSink
+from analytics_engine.heuristics.sinks.snapshot_sink import SnapshotSink
 import time
 
 LOG = common.LOG
@@ -47,21 +48,6 @@ class NodeSubgraphTelemetryPipe(Pipe):
         print "Returning NodeSubgraph Telemetry data for NodeSubgraphTelemetry Pipe: {}".format(time.time())
         fs = FileSink()
         fs.save(workload, topology=False)
-        # temp code for research
-        import os
-        import pickle
-        LOCAL_RES_DIR = os.path.join(common.INSTALL_BASE_DIR, "exported_data")
-        exp_dir = os.path.join(LOCAL_RES_DIR, str(workload.get_workload_name()))
-        if not os.path.exists(LOCAL_RES_DIR):
-            os.mkdir(LOCAL_RES_DIR)
-
-        if not os.path.exists(exp_dir):
-            os.mkdir(exp_dir)
-        filename = os.path.join(
-            exp_dir,
-            "{}.pickle".format(workload.get_workload_name()))
-        subgraph_topology = workload.get_latest_graph()
-        with open(filename, 'w') as outfile:
-            pickle.dump(subgraph_topology, outfile)
-        ##########################
+        snapshot_sink = SnapshotSink()
+        snapshot_sink.save(workload)
         return workload
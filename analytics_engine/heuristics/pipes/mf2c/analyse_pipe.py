@@ -23,6 +23,7 @@ from analytics_engine import common
 from analytics_engine.heuristics.filters.mf2c.analyse_and_refine_recipe_filter import AnalyseAndRefineRecipeFilter
 from analytics_engine.heuristics.pipes.annotated_telemetry_pipe import AnnotatedTelemetryPipe
 from analytics_engine.heuristics.sinks.file_sink import FileSink
+from analytics_engine.heuristics.sinks.snapshot_sink import SnapshotSink
 from analytics_engine.heuristics.sinks.mf2c.influx_sink import InfluxSink
 from analytics_engine.heuristics.filters.cimi_filter import CimiFilter
 import time
@@ -56,21 +57,6 @@ class AnalysePipe(AnnotatedTelemetryPipe):
         influx_sink.save(workload)
         fs = FileSink()
         fs.save(workload)
-        # temp code for research
-        import os
-        import pickle
-        LOCAL_RES_DIR = os.path.join(common.INSTALL_BASE_DIR, "exported_data")
-        exp_dir = os.path.join(LOCAL_RES_DIR, str(workload.get_workload_name()))
-        if not os.path.exists(LOCAL_RES_DIR):
-            os.mkdir(LOCAL_RES_DIR)
-
-        if not os.path.exists(exp_dir):
-            os.mkdir(exp_dir)
-        filename = os.path.join(
-            exp_dir,
-            "{}.pickle".format(workload.get_workload_name()))
-        subgraph_topology = workload.get_latest_graph()
-        with open(filename, 'w') as outfile:
-            pickle.dump(subgraph_topology, outfile)
-        ##########################
+        snapshot_sink = SnapshotSink()
+        snapshot_sink.save(workload)
         return workload
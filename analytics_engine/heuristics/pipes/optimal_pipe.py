@@ -21,6 +21,7 @@ __status__ = "Development"
 
 from analytics_engine import common
 from analytics_engine.heuristics.filters.optimal_filter import OptimalFilter
+from analytics_engine.heuristics.filters.subgraph_annotated_filter import SubgraphAnnotatedFilter
 from analytics_engine.heuristics.pipes.annotated_telemetry_pipe import AnnotatedTelemetryPipe
 from analytics_engine.heuristics.sinks.file_sink import FileSink
 from analytics_engine.heuristics.sinks.mf2c.influx_sink import InfluxSink
@@ -36,16 +37,37 @@ class OptimalPipe(AnnotatedTelemetryPipe):
     :return: producing infrastructure suggestions based on optimal usage.
     """
 
-    def run(self, workload, optimal_node_type='machine'):
+    def run(self, workload, optimal_node_type='machine', graph=None,
+            deadline=None):
+        """
+        :param graph: (InfoGraph) graph already annotated with telemetry
+                      (e.g. by the AnnotationDaemon): if provided, topology
+                      and telemetry are not fetched again
+        :param deadline: (float) epoch by which telemetry has to be
+                         collected: the nodes ranked by the optimal filter
+                         are annotated first and those not annotated in time
+                         are ranked as having no telemetry
+        """
         if not workload:
             raise IOError('A workload needs to be specified')
-        super(OptimalPipe, self).run(workload)
+        if graph is not None:
+            workload.save_results(SubgraphAnnotatedFilter.__filter_name__,
+                                  graph)
+        elif deadline is not None:
+            node_types = OptimalFilter.ranked_node_types(workload,
+                                                         optimal_node_type)
+            super(OptimalPipe, self).run(workload, deadline=deadline,
+                                         node_types=node_types)
+        else:
+            # Only the nodes ranked by the optimal filter need telemetry
+            super(OptimalPipe, self).run(workload, lazy=True)
         if workload.get_latest_graph() is None:
             return workload
         avg_filter = OptimalFilter()
         avg_filter.run(workload, optimal_node_type)
-        fs = FileSink()
-        fs.save(workload)
+        if graph is None:
+            fs = FileSink()
+            fs.save(workload)
         influx_sink = InfluxSink()
         influx_sink.save(workload)
         return workload
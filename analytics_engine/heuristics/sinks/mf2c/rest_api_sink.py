@@ -37,6 +37,7 @@ from flask import request
 from flask import Response
 from analytics_engine.heuristics.beans.workload import Workload
 from analytics_engine.heuristics.pipes.optimal_pipe import OptimalPipe
+from analytics_engine.heuristics.pipes.annotation_daemon import AnnotationDaemon
 from analytics_engine.heuristics.filters.optimal_filter import OptimalFilter
 from analytics_engine.heuristics.pipes.mf2c.refine_recipe_pipe import RefineRecipePipe
 from analytics_engine.heuristics.pipes.mf2c.analyse_pipe import AnalysePipe
@@ -55,12 +56,43 @@ app = flask.Flask(__name__)
 
 MIME = "application/json"
 
+# Seconds of telemetry analysed by default by the optimal endpoints
+OPTIMAL_WINDOW = 10
+
+
+def _warm_graph(recipe, config=None):
+    """
+    Returns the landscape annotated by the AnnotationDaemon over the time
+    range requested ('minutes' in the recipe, 10 seconds by default), or
+    None if the request has to go through the telemetry pipes.
+    """
+    daemon = AnnotationDaemon.get_instance()
+    if daemon is None or (config and config.get('device_id')):
+        return None
+    seconds = OPTIMAL_WINDOW
+    if recipe.get('minutes'):
+        seconds = int(float(recipe['minutes']) * 60)
+    return daemon.get_graph(seconds)
+
+
+def _deadline(recipe, started):
+    """
+    Returns the epoch by which the telemetry of a request has to be
+    collected, given the latency budget in seconds ('deadline' in the
+    recipe), or None if the request has no budget.
+    """
+    if recipe.get('deadline') is None:
+        return None
+    return started + float(recipe['deadline'])
+
+
 
 @app.route("/mf2c/optimal", methods=['GET', 'POST'])
 def get_optimal():
     """
     Returns results from avg heuristic
     """
+    started = time.time()
     LOG.info("Retrieving Optimal with url : %s", request.url)
     recipe = request.get_json()
     LOG.info(recipe)
@@ -94,7 +126,9 @@ def get_optimal():
     workload.add_recipe(int("{}{}".format(int(round(time.time())), '000000000')), recipe_bean)
     pipe_exec = OptimalPipe()
     node_type = 'machine'
-    workload = pipe_exec.run(workload, node_type)
+    workload = pipe_exec.run(workload, node_type,
+                             graph=_warm_graph(recipe, config),
+                             deadline=_deadline(recipe, started))
     if workload.get_latest_graph() is None and config.get('device_id') is not None:
         return Response('Device not found', status=404)
     results = workload.get_metadata(OptimalFilter.__filter_name__)
@@ -175,6 +209,7 @@ def get_optimal_vms():
     """
     Returns results from avg heuristic
     """
+    started = time.time()
     LOG.info("Retrieving Optimal_VMs with url : %s", request.url)
     recipe = request.get_json()
     LOG.info(recipe)
@@ -188,7 +223,8 @@ def get_optimal_vms():
     workload.add_recipe(int("{}{}".format(int(round(time.time())), '000000000')), recipe_bean)
     pipe_exec = OptimalPipe()
     node_type = 'vm'
-    workload = pipe_exec.run(workload, node_type)
+    workload = pipe_exec.run(workload, node_type, graph=_warm_graph(recipe),
+                             deadline=_deadline(recipe, started))
     results = workload.get_metadata(OptimalFilter.__filter_name__)
     #return Response(results.to_json(), mimetype=MIME)
     #return Response(results.to_dict('results'), mimetype=MIME)
@@ -0,0 +1,256 @@
+# Copyright (c) 2017, Intel Research and Development Ireland Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = 'Giuliana Carullo'
+__copyright__ = "Copyright (c) 2017, Intel Research and Development Ireland Ltd."
+__license__ = "Apache 2.0"
+__maintainer__ = "Giuliana Carullo"
+__email__ = "giuliana.carullo@intel.com"
+__status__ = "Development"
+
+import json
+import os
+import time
+import numpy
+import analytics_engine.common as common
+from analytics_engine.heuristics.beans.infograph import InfoGraphNodeProperty
+from analytics_engine.heuristics.beans.telemetry_store import TelemetryStore, TelemetryStoreSection
+from analytics_engine.infrastructure_manager.infograph import InfoGraph
+from base import Sink
+
+LOG = common.LOG
+LOCAL_RES_DIR = os.path.join(common.INSTALL_BASE_DIR, "exported_data")
+
+SNAPSHOT_FORMAT = 'analytics-engine-snapshot'
+SNAPSHOT_VERSION = 2
+
+MANIFEST = 'manifest.json'
+TOPOLOGY = 'topology.json'
+
+# Node properties stored in the telemetry sections, not in the topology
+TELEMETRY_PROPERTIES = set(
+    [InfoGraphNodeProperty.TELEMETRY_STORE,
+     InfoGraphNodeProperty.TELEMETRY_HANDLE] +
+    list(TelemetryStore.SECTIONS) +
+    [group for groups in TelemetryStore.SECTIONS.values()
+     for group in groups])
+
+
+class SnapshotSink(Sink):
+    """
+    Saves annotated graphs as snapshots: directories holding
+
+    - manifest.json: format version, metadata and layout of the telemetry;
+    - topology.json: nodes, node properties and links, as node-link JSON;
+    - for each kind of telemetry (raw telemetry, utilization, saturation),
+      <section>.npy with the values of all the nodes and
+      <section>_timestamps.npy with the timestamps of the rows of each node.
+
+    Telemetry is laid out as in the TelemetryStore, each node having its
+    own rows and its values being contiguous on disk: snapshots are loaded
+    memory mapped and the telemetry of a node is only read when accessed.
+    """
+
+    def save(self, workload):
+        """
+        Saves the latest graph of the workload in the exported_data
+        directory of the workload.
+
+        :param workload: the workload to be saved
+        :return: (str) path of the snapshot
+        """
+        exp_dir = os.path.join(LOCAL_RES_DIR, str(workload.get_workload_name()))
+        if not os.path.exists(LOCAL_RES_DIR):
+            os.mkdir(LOCAL_RES_DIR)
+
+        if not os.path.exists(exp_dir):
+            os.mkdir(exp_dir)
+        path = os.path.join(
+            exp_dir, "{}.snapshot".format(workload.get_workload_name()))
+        metadata = {'workload': workload.get_workload_name(),
+                    'ts_from': workload.get_ts_from(),
+                    'ts_to': workload.get_ts_to()}
+        SnapshotSink.write(workload.get_latest_graph(), path, metadata)
+        return path
+
+    def show(self, source_type):
+        LOG.error('Snapshot sink does not implement show method')
+
+    @staticmethod
+    def write(graph, path, metadata=None):
+        """
+        Writes the graph as a snapshot.
+        Telemetry is taken from the telemetry store of the graph, or copied
+        into a new store if the graph has none; telemetry which cannot be
+        stored as numbers, or still to be fetched through lazy handles, is
+        not saved.
+
+        :param graph: (InfoGraph) annotated graph
+        :param path: (str) directory of the snapshot, created if needed
+        :param metadata: (dict) JSON serializable data saved in the manifest
+        :return: None
+        """
+        started = time.time()
+        if not os.path.exists(path):
+            os.makedirs(path)
+        # A snapshot without manifest is incomplete
+        manifest_file = os.path.join(path, MANIFEST)
+        if os.path.exists(manifest_file):
+            os.remove(manifest_file)
+
+        nodes = graph.nodes(data=True)
+        store = TelemetryStore.get_store(graph) or TelemetryStore.build(nodes)
+        skipped = [name for name, props in nodes
+                   for section, groups in TelemetryStore.SECTIONS.items()
+                   for group in groups
+                   if props.get(group) is not None and
+                   not store.has_group(section, name, group)]
+        if skipped:
+            LOG.warning("Telemetry of {} nodes cannot be saved in the "
+                        "snapshot".format(len(set(skipped))))
+        SnapshotSink._write_topology(graph, nodes, path)
+        sections = dict()
+        for name, section in store.sections.items():
+            sections[name] = SnapshotSink._write_section(name, section, path)
+
+        manifest = {'format': SNAPSHOT_FORMAT,
+                    'version': SNAPSHOT_VERSION,
+                    'created': time.time(),
+                    'metadata': metadata or dict(),
+                    'nodes': len(nodes),
+                    'sections': sections}
+        with open(manifest_file + '.tmp', 'w') as outfile:
+            json.dump(manifest, outfile)
+        os.rename(manifest_file + '.tmp', manifest_file)
+        LOG.info("Snapshot of {} nodes saved in {} in {:.3f}s".
+                 format(len(nodes), path, time.time() - started))
+
+    @staticmethod
+    def _write_topology(graph, nodes, path):
+        positions = dict()
+        topology_nodes = list()
+        for position, (name, props) in enumerate(nodes):
+            positions[name] = position
+            node_data = dict((key, value) for key, value in props.items()
+                             if key not in TELEMETRY_PROPERTIES)
+            node_data['id'] = name
+            topology_nodes.append(node_data)
+        links = list()
+        for src, dst, data in graph.edges(data=True):
+            link = dict(data)
+            link['source'] = positions[src]
+            link['target'] = positions[dst]
+            links.append(link)
+        graph_data = dict((key, value) for key, value in graph.graph.items()
+                          if key not in TELEMETRY_PROPERTIES)
+        topology = {'directed': graph.is_directed(),
+                    'multigraph': graph.is_multigraph(),
+                    'graph': graph_data,
+                    'nodes': topology_nodes,
+                    'links': links}
+        with open(os.path.join(path, TOPOLOGY), 'w') as outfile:
+            json.dump(topology, outfile, default=SnapshotSink._to_json)
+
+    @staticmethod
+    def _to_json(value):
+        # numpy scalars are saved as numbers, anything else as text
+        if isinstance(value, numpy.generic):
+            return value.item()
+        return str(value)
+
+    @staticmethod
+    def _write_section(name, section, path):
+        """
+        Saves the values and timestamps of a section as laid out in the
+        store and returns its layout for the manifest.
+        """
+        numpy.save(os.path.join(path, '{}.npy'.format(name)), section.values)
+        numpy.save(os.path.join(path, '{}_timestamps.npy'.format(name)),
+                   section.timestamps)
+        return {'columns': list(section.columns),
+                'nodes': dict((node_name, list(column_range))
+                              for node_name, column_range
+                              in section.nodes.items()),
+                'groups': [[node_name, group, start, stop]
+                           for (node_name, group), (start, stop)
+                           in section.groups.items()],
+                'rows': dict((node_name, [int(start), int(stop)])
+                             for node_name, (start, stop)
+                             in section.rows.items())}
+
+    @staticmethod
+    def read_manifest(path):
+        """
+        Returns the manifest of a snapshot, checking its format and version.
+
+        :param path: (str) directory of the snapshot
+        :return: (dict)
+        """
+        manifest_file = os.path.join(path, MANIFEST)
+        if not os.path.isfile(manifest_file):
+            msg = "{} is not a complete snapshot".format(path)
+            LOG.error(msg)
+            raise ValueError(msg)
+        with open(manifest_file) as infile:
+            manifest = json.load(infile)
+        if manifest.get('format') != SNAPSHOT_FORMAT or \
+                manifest.get('version', 0) != SNAPSHOT_VERSION:
+            msg = "Snapshot {} has unsupported format {} version {}".format(
+                path, manifest.get('format'), manifest.get('version'))
+            LOG.error(msg)
+            raise ValueError(msg)
+        return manifest
+
+    @staticmethod
+    def read(path, mmap=True, graph=None):
+        """
+        Loads a snapshot. Telemetry is attached to the graph as a telemetry
+        store, read through the usual InfoGraphNode accessors.
+
+        :param path: (str) directory of the snapshot
+        :param mmap: (bool) if True telemetry is memory mapped, reading
+                     from disk only the telemetry of the nodes accessed
+        :param graph: (InfoGraph) empty graph to be loaded, a new InfoGraph
+                      by default
+        :return: (InfoGraph)
+        """
+        started = time.time()
+        manifest = SnapshotSink.read_manifest(path)
+        mmap_mode = 'r' if mmap else None
+        if graph is None:
+            graph = InfoGraph()
+        with open(os.path.join(path, TOPOLOGY)) as infile:
+            graph.add_node_link_data(json.load(infile))
+
+        store = TelemetryStore()
+        for name, layout in manifest['sections'].items():
+            values = numpy.load(os.path.join(path, '{}.npy'.format(name)),
+                                mmap_mode=mmap_mode)
+            timestamps = numpy.load(
+                os.path.join(path, '{}_timestamps.npy'.format(name)),
+                mmap_mode=mmap_mode)
+            store.sections[name] = TelemetryStoreSection(
+                values, timestamps, layout['columns'],
+                dict((node_name, tuple(column_range))
+                     for node_name, column_range in layout['nodes'].items()),
+                dict(((node_name, group), (start, stop))
+                     for node_name, group, start, stop in layout['groups']),
+                dict((node_name, (start, stop))
+                     for node_name, (start, stop) in layout['rows'].items()))
+        for node_name in graph.nodes():
+            graph.node[node_name][InfoGraphNodeProperty.TELEMETRY_STORE] = store
+        graph.graph[InfoGraphNodeProperty.TELEMETRY_STORE] = store
+        LOG.info("Snapshot of {} nodes loaded from {} in {:.3f}s".
+                 format(len(graph.node), path, time.time() - started))
+        return graph
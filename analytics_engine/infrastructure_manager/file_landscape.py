@@ -0,0 +1,542 @@
+# Copyright (c) 2017, Intel Research and Development Ireland Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+File-backed landscape, serving exported topologies without a Landscaper.
+
+Usage: python file_landscape.py <index directory> <topology.json>...
+"""
+import os
+import sys
+import json
+import time
+import threading
+import numpy
+import analytics_engine.common as common
+
+LOG = common.LOG
+
+INDEX_FORMAT = 'analytics-engine-landscape-index'
+INDEX_VERSION = 1
+
+MANIFEST = 'manifest.json'
+
+# Node properties which are not indexed: unique or not scalar
+UNINDEXED_PROPERTIES = frozenset(['id', 'name', 'attributes'])
+
+OPERATORS = {'=': lambda a, b: a == b,
+             '!=': lambda a, b: a != b,
+             '<': lambda a, b: a < b,
+             '<=': lambda a, b: a <= b,
+             '>': lambda a, b: a > b,
+             '>=': lambda a, b: a >= b}
+
+
+def _text(value):
+    # Properties are matched as text, as sent to the Landscaper
+    if isinstance(value, basestring):
+        return value
+    return u"{}".format(value)
+
+
+def _comparable(text):
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+class FileLandscapeDump(object):
+    """
+    A topology of the index, valid from one time to another, memory mapped.
+
+    Each dump is a directory holding:
+
+    - names.json: names of the nodes, by position;
+    - records.bin and records.npy: properties of each node as JSON, and the
+      offset of each node in records.bin;
+    - succ_ptr.npy and succ_idx.npy: successors of each node (positions
+      succ_idx[succ_ptr[i]:succ_ptr[i + 1]] for the node at position i);
+    - links.bin and links.npy: properties of each link as JSON, in the
+      order of succ_idx;
+    - properties.json and postings.npy: for each property and value (as
+      text) the range of postings.npy holding the positions of the nodes
+      with that value.
+
+    Only names and the property index are loaded when the dump is opened:
+    properties of nodes and links are decoded when returned.
+    """
+
+    def __init__(self, path, info):
+        """
+        :param path: (str) directory of the dump
+        :param info: (dict) entry of the dump in the manifest
+        """
+        self.path = path
+        self.valid_from = info['valid_from']
+        self.valid_to = info.get('valid_to')
+        self.graph = info.get('graph', dict())
+        with open(os.path.join(path, 'names.json')) as infile:
+            self.names = json.load(infile)
+        self.positions = dict((name, position)
+                              for position, name in enumerate(self.names))
+        with open(os.path.join(path, 'properties.json')) as infile:
+            self.properties = json.load(infile)
+        self.records = FileLandscapeDump._bytes(path, 'records.bin')
+        self.record_offsets = FileLandscapeDump._array(path, 'records.npy')
+        self.links = FileLandscapeDump._bytes(path, 'links.bin')
+        self.link_offsets = FileLandscapeDump._array(path, 'links.npy')
+        self.succ_ptr = FileLandscapeDump._array(path, 'succ_ptr.npy')
+        self.succ_idx = FileLandscapeDump._array(path, 'succ_idx.npy')
+        self.postings = FileLandscapeDump._array(path, 'postings.npy')
+
+    @staticmethod
+    def _array(path, name):
+        return numpy.load(os.path.join(path, name), mmap_mode='r')
+
+    @staticmethod
+    def _bytes(path, name):
+        file_name = os.path.join(path, name)
+        if os.path.getsize(file_name) == 0:
+            return numpy.zeros(0, dtype=numpy.uint8)
+        return numpy.memmap(file_name, dtype=numpy.uint8, mode='r')
+
+    @staticmethod
+    def write(path, data):
+        """
+        Writes a topology as a dump.
+
+        :param path: (str) directory of the dump, created
+        :param data: (dict) topology as networkx node-link data
+        :return: (tuple) number of nodes and links
+        """
+        os.makedirs(path)
+        nodes = data.get('nodes', [])
+        names = [props.get('id', position)
+                 for position, props in enumerate(nodes)]
+        with open(os.path.join(path, 'names.json'), 'w') as outfile:
+            json.dump(names, outfile)
+
+        postings = dict()
+        records = list()
+        for position, props in enumerate(nodes):
+            records.append(json.dumps(
+                dict((key, value) for key, value in props.items()
+                     if key != 'id')).encode('utf-8'))
+            for key, value in props.items():
+                if key in UNINDEXED_PROPERTIES or \
+                        isinstance(value, (dict, list)):
+                    continue
+                postings.setdefault(key, dict()).setdefault(
+                    _text(value), list()).append(position)
+        FileLandscapeDump._write_records(path, 'records', records)
+
+        links = sorted(data.get('links', []),
+                       key=lambda link: link['source'])
+        counts = numpy.bincount(
+            numpy.array([link['source'] for link in links], dtype=numpy.int64),
+            minlength=len(nodes))
+        numpy.save(os.path.join(path, 'succ_ptr.npy'),
+                   numpy.concatenate([[0], numpy.cumsum(counts)]).
+                   astype(numpy.int64))
+        numpy.save(os.path.join(path, 'succ_idx.npy'),
+                   numpy.array([link['target'] for link in links],
+                               dtype=numpy.int64))
+        FileLandscapeDump._write_records(
+            path, 'links',
+            [json.dumps(dict((key, value) for key, value in link.items()
+                             if key not in ['source', 'target', 'key'])).
+             encode('utf-8') for link in links])
+
+        index = dict()
+        all_postings = list()
+        for key, values in postings.items():
+            index[key] = dict()
+            for value, positions in values.items():
+                index[key][value] = [len(all_postings),
+                                     len(all_postings) + len(positions)]
+                all_postings.extend(positions)
+        with open(os.path.join(path, 'properties.json'), 'w') as outfile:
+            json.dump(index, outfile)
+        numpy.save(os.path.join(path, 'postings.npy'),
+                   numpy.array(all_postings, dtype=numpy.int64))
+        return len(nodes), len(links)
+
+    @staticmethod
+    def _write_records(path, name, records):
+        with open(os.path.join(path, name + '.bin'), 'wb') as outfile:
+            for record in records:
+                outfile.write(record)
+        numpy.save(os.path.join(path, name + '.npy'),
+                   numpy.cumsum([0] + [len(record) for record in records]).
+                   astype(numpy.int64))
+
+    def node(self, position):
+        """
+        :return: (dict) properties of the node at position, with its id
+        """
+        props = json.loads(self.records[
+            self.record_offsets[position]:
+            self.record_offsets[position + 1]].tobytes())
+        props['id'] = self.names[position]
+        return props
+
+    def select(self, properties):
+        """
+        Returns the positions of the nodes matching all the properties.
+
+        :param properties: (list) tuples of key, value and, optionally,
+                           operator (default '=')
+        :return: (set) positions of the nodes
+        """
+        selected = None
+        for prop in properties:
+            key, value = prop[0], _text(prop[1])
+            operator = prop[2] if len(prop) > 2 else '='
+            if operator not in OPERATORS:
+                msg = "Operator {} is not supported".format(operator)
+                LOG.error(msg)
+                raise ValueError(msg)
+            if key == 'name':
+                matching = set(position for position, name
+                               in enumerate(self.names)
+                               if OPERATORS[operator](
+                                   _comparable(_text(name)),
+                                   _comparable(value)))
+            else:
+                matching = set()
+                for text, (start, stop) in \
+                        self.properties.get(key, dict()).items():
+                    if OPERATORS[operator](_comparable(text),
+                                           _comparable(value)):
+                        matching.update(
+                            int(position)
+                            for position in self.postings[start:stop])
+            selected = matching if selected is None else selected & matching
+        return selected if selected is not None else set()
+
+    def descendants(self, position):
+        """
+        Returns the positions of the node and of all the nodes reachable
+        from it following the links, in the order they are reached.
+        """
+        seen = set([position])
+        order = [position]
+        for current in order:
+            for successor in self.succ_idx[self.succ_ptr[current]:
+                                           self.succ_ptr[current + 1]]:
+                successor = int(successor)
+                if successor not in seen:
+                    seen.add(successor)
+                    order.append(successor)
+        return order
+
+    def payload(self, positions, with_links=True):
+        """
+        Returns the nodes at positions, and the links between them, as
+        networkx node-link data.
+        """
+        positions = list(positions)
+        new_positions = dict((position, new_position)
+                             for new_position, position
+                             in enumerate(positions))
+        links = list()
+        if with_links:
+            for position in positions:
+                first = int(self.succ_ptr[position])
+                for edge in range(first, int(self.succ_ptr[position + 1])):
+                    target = int(self.succ_idx[edge])
+                    if target not in new_positions:
+                        continue
+                    link = json.loads(self.links[
+                        self.link_offsets[edge]:
+                        self.link_offsets[edge + 1]].tobytes())
+                    link['source'] = new_positions[position]
+                    link['target'] = new_positions[target]
+                    links.append(link)
+        return {'directed': True, 'multigraph': False,
+                'graph': dict(self.graph),
+                'nodes': [self.node(position) for position in positions],
+                'links': links}
+
+
+class FileLandscape(object):
+    """
+    Landscape served from an index of exported topologies (networkx
+    node-link JSON, as returned by the Landscaper /graph endpoint), to
+    analyse archived landscapes offline.
+
+    Each topology ingested is a dump of the index, valid from the time it
+    was taken until the next dump. Topologies without a timestamp in their
+    graph (e.g. the ones exported by the FileSink) are undated: they are
+    valid from the start of time, one after the other in the order they
+    were ingested, so that windows preceding the dated dumps are answered
+    from the latest undated dump. Queries are answered from the latest dump
+    valid in the requested window, or from the earliest dump for windows
+    preceding all the dumps, in the same networkx node-link format as the
+    Landscaper; a dump can also be selected by name to answer all the
+    queries, whatever their window. The index is safe to share between
+    threads.
+    """
+
+    def __init__(self, path, dump=None):
+        """
+        :param path: (str) directory of the index
+        :param dump: (str) id or name of the dump answering all the queries
+                     (the name of a dump being the name of its file, e.g.
+                     <name>_topology.json), None to select dumps by window
+        """
+        self.path = path
+        self.manifest = FileLandscape.read_manifest(path)
+        self.dump = dump
+        self.selected = None
+        if dump is not None:
+            for info in reversed(self.manifest['dumps']):
+                if dump in [info['id'], info.get('name')]:
+                    self.selected = info
+                    break
+            else:
+                msg = "Landscape index {} has no dump {}".format(path, dump)
+                LOG.error(msg)
+                raise ValueError(msg)
+        self._dumps = dict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def read_manifest(path):
+        """
+        Returns the manifest of an index, checking its format and version.
+
+        :param path: (str) directory of the index
+        :return: (dict)
+        """
+        manifest_file = os.path.join(path, MANIFEST)
+        if not os.path.isfile(manifest_file):
+            msg = "{} is not a landscape index".format(path)
+            LOG.error(msg)
+            raise ValueError(msg)
+        with open(manifest_file) as infile:
+            manifest = json.load(infile)
+        if manifest.get('format') != INDEX_FORMAT or \
+                manifest.get('version', 0) > INDEX_VERSION:
+            msg = "Landscape index {} has unsupported format {} version {}".\
+                format(path, manifest.get('format'), manifest.get('version'))
+            LOG.error(msg)
+            raise ValueError(msg)
+        return manifest
+
+    @staticmethod
+    def ingest(path, file_names, valid_from=None):
+        """
+        Adds exported topologies to an index, created if needed.
+
+        :param path: (str) directory of the index
+        :param file_names: (list of str) node-link JSON files
+        :param valid_from: (list of float) time each topology was taken,
+                           by default the timestamp of the graph, if any
+        :return: None
+        """
+        started = time.time()
+        if os.path.isfile(os.path.join(path, MANIFEST)):
+            manifest = FileLandscape.read_manifest(path)
+        else:
+            if not os.path.exists(path):
+                os.makedirs(path)
+            manifest = {'format': INDEX_FORMAT, 'version': INDEX_VERSION,
+                        'dumps': []}
+        dumps = manifest['dumps']
+        for position, file_name in enumerate(file_names):
+            with open(file_name) as infile:
+                data = json.load(infile)
+            if valid_from is not None:
+                dump_from = valid_from[position]
+            else:
+                # Exports are written after the time they describe: their
+                # modification time is not when they started being valid
+                dump_from = data.get('graph', dict()).get('timestamp')
+            undated = dump_from is None
+            if undated:
+                # Valid from the start of time, after the undated dumps
+                # already ingested
+                dump_from = len([dump for dump in dumps
+                                 if dump.get('undated')])
+            dump_id = 'dump_{}'.format(
+                max([int(dump['id'][5:]) for dump in dumps] + [-1]) + 1)
+            nodes, links = FileLandscapeDump.write(
+                os.path.join(path, dump_id), data)
+            dumps.append({'id': dump_id,
+                          'name': FileLandscape._dump_name(file_name),
+                          'source': os.path.abspath(file_name),
+                          'valid_from': float(dump_from),
+                          'undated': undated,
+                          'nodes': nodes,
+                          'links': links,
+                          'graph': data.get('graph', dict())})
+            LOG.info("{}: {} nodes and {} links ingested as {}".format(
+                file_name, nodes, links, dump_id))
+        dumps.sort(key=lambda dump: dump['valid_from'])
+        for dump, next_dump in zip(dumps, dumps[1:] + [None]):
+            dump['valid_to'] = next_dump['valid_from'] \
+                if next_dump is not None else None
+        undated = [dump for dump in dumps if dump.get('undated')]
+        if len(undated) > 1:
+            LOG.warning("{} dumps of landscape index {} have no timestamp: "
+                        "windows preceding the dated dumps are answered "
+                        "from the last one ingested, {} ({}), unless a "
+                        "dump is selected by name".format(
+                            len(undated), path, undated[-1].get('name'),
+                            undated[-1]['id']))
+        manifest_file = os.path.join(path, MANIFEST)
+        with open(manifest_file + '.tmp', 'w') as outfile:
+            json.dump(manifest, outfile)
+        os.rename(manifest_file + '.tmp', manifest_file)
+        LOG.info("Landscape index {} updated in {:.3f}s".format(
+            path, time.time() - started))
+
+    @staticmethod
+    def _dump_name(file_name):
+        """
+        :return: (str) name of the dump of a file, e.g. <name> for
+                 <name>_topology.json
+        """
+        name = os.path.splitext(os.path.basename(file_name))[0]
+        if name.endswith('_topology'):
+            name = name[:-len('_topology')]
+        return name
+
+    def _dump(self, info):
+        with self._lock:
+            dump = self._dumps.get(info['id'])
+            if dump is None:
+                dump = FileLandscapeDump(
+                    os.path.join(self.path, info['id']), info)
+                self._dumps[info['id']] = dump
+            return dump
+
+    def dump_at(self, timestamp=None, timeframe=0):
+        """
+        Returns the latest dump valid in the window starting at timestamp
+        (ending at it, for negative timeframes), or the earliest dump if the
+        window precedes all the dumps. The dump selected by name, if any,
+        is returned for any window.
+
+        :param timestamp: (float) start of the window, None for the latest
+                          dump
+        :param timeframe: (float) length of the window in seconds
+        :return: (FileLandscapeDump) or None if the index has no dump
+        """
+        if self.selected is not None:
+            return self._dump(self.selected)
+        dumps = self.manifest['dumps']
+        if not dumps:
+            return None
+        if timestamp is None:
+            return self._dump(dumps[-1])
+        start = min(float(timestamp), float(timestamp) + float(timeframe or 0))
+        end = max(float(timestamp), float(timestamp) + float(timeframe or 0))
+        for info in reversed(dumps):
+            if info['valid_from'] <= end and \
+                    (info.get('valid_to') is None or info['valid_to'] > start):
+                return self._dump(info)
+        LOG.warning("No dump of landscape index {} for window {} to {}: "
+                    "using the earliest dump, valid from {}".format(
+                        self.path, start, end, dumps[0]['valid_from']))
+        return self._dump(dumps[0])
+
+    @staticmethod
+    def _empty():
+        return {'directed': True, 'multigraph': False, 'graph': {},
+                'nodes': [], 'links': []}
+
+    def get_graph(self):
+        """
+        :return: (dict) node-link data of the latest topology
+        """
+        dump = self.dump_at()
+        if dump is None:
+            return FileLandscape._empty()
+        return dump.payload(range(len(dump.names)))
+
+    def get_subgraph(self, node_id, timestamp=None, timeframe=0):
+        """
+        :return: (dict) node-link data of the node and of all the nodes
+                 reachable from it, None if the node is not found
+        """
+        dump = self.dump_at(timestamp, timeframe)
+        if dump is None:
+            LOG.error("No dump in landscape index {}".format(self.path))
+            return None
+        if node_id not in dump.positions:
+            LOG.error("Node {} not found in dump {}".format(
+                node_id, dump.path))
+            return None
+        return dump.payload(dump.descendants(dump.positions[node_id]))
+
+    def get_node_by_uuid(self, node_id):
+        """
+        :return: (dict) node-link data of the node, None if not found
+        """
+        dump = self.dump_at()
+        if dump is None:
+            LOG.error("No dump in landscape index {}".format(self.path))
+            return None
+        if node_id not in dump.positions:
+            LOG.error("Node {} not found in dump {}".format(
+                node_id, dump.path))
+            return None
+        return dump.payload([dump.positions[node_id]])
+
+    def get_node_by_properties(self, properties, start=None, timeframe=0):
+        """
+        :return: (dict) node-link data of the nodes matching the properties
+        """
+        dump = self.dump_at(start, timeframe)
+        if dump is None:
+            return FileLandscape._empty()
+        return dump.payload(sorted(dump.select(properties)),
+                            with_links=False)
+
+    def get_service_instance_hist_nodes(self, properties):
+        """
+        Returns the nodes matching the properties in any of the dumps, as
+        found in the latest dump, with the times from and to they have
+        been in the landscape.
+
+        :return: (dict) node-link data of the nodes
+        """
+        found = dict()
+        for info in self.manifest['dumps']:
+            dump = self._dump(info)
+            for position in dump.select(properties):
+                name = dump.names[position]
+                first = found[name][1] if name in found else info
+                found[name] = (dump, first, info, position)
+        nodes = list()
+        for name in sorted(found):
+            dump, first, last, position = found[name]
+            props = dump.node(position)
+            props['from'] = int(first['valid_from'])
+            props['to'] = int(last['valid_to'] if last.get('valid_to')
+                              is not None else time.time())
+            nodes.append(props)
+        res = FileLandscape._empty()
+        res['nodes'] = nodes
+        return res
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(__doc__.strip())
+        sys.exit(1)
+    FileLandscape.ingest(sys.argv[1], sys.argv[2:])
@@ -15,12 +15,24 @@
 """
 Graph utils.
 """
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+from collections import Counter
 import networkx as nx
 from networkx.algorithms import isomorphism
 import analytics_engine.common as common
 
 LOG = common.LOG
 
+# Weisfeiler-Lehman refinements of the canonical hash
+WL_ITERATIONS = 3
+
+# Results of compare_topology, by graphs and matchers compared
+_TOPOLOGY_MEMO = dict()
+TOPOLOGY_MEMO_SIZE = 256
+
 
 def _node_match(node_a_attr, node_b_attr):
     """
@@ -63,10 +75,103 @@ def match_type(one, another):
     return res
 
 
+def _freeze(value):
+    """
+    Hashable form of a value: equal values have equal forms.
+    Raises TypeError for values which cannot be made hashable.
+    """
+    if isinstance(value, Mapping):
+        return dict, frozenset((key, _freeze(item))
+                               for key, item in value.items())
+    if isinstance(value, list):
+        return list, tuple(_freeze(item) for item in value)
+    if isinstance(value, tuple):
+        return tuple, tuple(_freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset, frozenset(_freeze(item) for item in value)
+    hash(value)
+    return value
+
+
+def _signature(graph, node_attributes=True, edge_attributes=True,
+               iterations=WL_ITERATIONS):
+    """
+    Weisfeiler-Lehman signature of a graph: the canonical hash of the
+    graph and the number of nodes and edges with each initial label.
+    """
+    directed = graph.is_directed()
+    succ = graph.succ if directed else graph.adj
+    pred = graph.pred if directed else graph.adj
+    labels = dict()
+    outgoing = dict()
+    incoming = dict()
+    for node, attrs in graph.nodes(data=True):
+        labels[node] = hash(_freeze(attrs)) if node_attributes else 0
+        outgoing[node] = [(hash(_freeze(data)) if edge_attributes else 0,
+                           other) for other, data in succ[node].items()]
+        incoming[node] = [(hash(_freeze(data)) if edge_attributes else 0,
+                           other) for other, data in pred[node].items()]
+    node_labels = Counter(labels.values())
+    edge_labels = Counter((label, labels[node], labels[other])
+                          for node in outgoing
+                          for label, other in outgoing[node])
+    for _ in range(iterations):
+        labels = dict(
+            (node, hash((labels[node],
+                         tuple(sorted((label, labels[other])
+                                      for label, other in outgoing[node])),
+                         tuple(sorted((label, labels[other])
+                                      for label, other in incoming[node])))))
+            for node in labels)
+    canonical = hash((directed, len(labels), graph.number_of_edges(),
+                      tuple(sorted(labels.values()))))
+    return canonical, node_labels, edge_labels
+
+
+def canonical_hash(graph, node_attributes=True, edge_attributes=True):
+    """
+    Canonical hash of a graph, computed in linear time: isomorphic graphs
+    (whose nodes and edges have equal attributes) have equal hashes, so
+    graphs with different hashes are not isomorphic.
+
+    :param graph: The graph.
+    :param node_attributes: If False attributes of the nodes are ignored.
+    :param edge_attributes: If False attributes of the edges are ignored.
+    :return: The hash or None if some attributes are not hashable.
+    """
+    try:
+        return _signature(graph, node_attributes, edge_attributes)[0]
+    except TypeError:
+        return None
+
+
+def _contains(counter, other):
+    """
+    True if counter has at least as many occurrences of each key as other.
+    """
+    return all(counter[key] >= count for key, count in other.items())
+
+
+def _graph_key(graph):
+    """
+    Hashable form of a graph, identifying its nodes, edges and attributes.
+    """
+    return (graph.is_directed(),
+            frozenset((node, _freeze(attrs))
+                      for node, attrs in graph.nodes(data=True)),
+            frozenset((src, dst, _freeze(data))
+                      for src, dst, data in graph.edges(data=True)))
+
+
 def compare_topology(graph1, graph2, match1=_node_match, match2=_edge_match):
     """
     Compares the topology of two graphs.
 
+    Results are memoized by graphs and matchers. With the default matchers
+    (or None) graphs are prefiltered by their canonical hashes and labels,
+    so that isomorphism is only searched for between graphs which can be
+    isomorphic.
+
     :param graph1: The first graph.
     :param graph2: The second graph.
     :param match1: Matcher for attributes of the nodes.
@@ -75,28 +180,59 @@ def compare_topology(graph1, graph2, match1=_node_match, match2=_edge_match):
                          True if g2 is subgraph of g1 - otherwise False,
                          dict with the mappings and differences.
     """
+    try:
+        key = (_graph_key(graph1), _graph_key(graph2), match1, match2)
+    except TypeError:
+        key = None
+    if key in _TOPOLOGY_MEMO:
+        graph_equal, is_subgraph, result = _TOPOLOGY_MEMO[key]
+        return graph_equal, is_subgraph, {'mapping': dict(result['mapping']),
+                                          'diff': list(result['diff'])}
+
     graph_equal = False
     is_subgraph = False
     result = {'mapping': {}, 'diff': []}
 
-    comp = isomorphism.DiGraphMatcher(graph1,
-                                      graph2,
-                                      node_match=match1,
-                                      edge_match=match2)
-
-    if comp.is_isomorphic():
-        graph_equal = True
-    elif comp.subgraph_is_isomorphic():
-        is_subgraph = True
-        result['diff'] = list(set(graph1.nodes()) - set(comp.mapping.keys()) -
-                              set(comp.mapping.values()))
-
-    result['mapping'] = comp.mapping
-
+    may_be_equal = True
+    may_be_subgraph = True
+    if match1 in (_node_match, None) and match2 in (_edge_match, None):
+        try:
+            hash1, nodes1, edges1 = _signature(graph1, match1 is not None,
+                                               match2 is not None)
+            hash2, nodes2, edges2 = _signature(graph2, match1 is not None,
+                                               match2 is not None)
+            may_be_equal = hash1 == hash2
+            may_be_subgraph = _contains(nodes1, nodes2) and \
+                _contains(edges1, edges2)
+        except TypeError:
+            LOG.debug('Graphs with unhashable attributes, not prefiltered')
+
+    if may_be_equal or may_be_subgraph:
+        comp = isomorphism.DiGraphMatcher(graph1,
+                                          graph2,
+                                          node_match=match1,
+                                          edge_match=match2)
+
+        if may_be_equal and comp.is_isomorphic():
+            graph_equal = True
+        elif may_be_subgraph and comp.subgraph_is_isomorphic():
+            is_subgraph = True
+            result['diff'] = list(set(graph1.nodes()) -
+                                  set(comp.mapping.keys()) -
+                                  set(comp.mapping.values()))
+
+        result['mapping'] = comp.mapping
+
+    if key is not None:
+        if len(_TOPOLOGY_MEMO) >= TOPOLOGY_MEMO_SIZE:
+            _TOPOLOGY_MEMO.clear()
+        _TOPOLOGY_MEMO[key] = (graph_equal, is_subgraph,
+                               {'mapping': dict(result['mapping']),
+                                'diff': list(result['diff'])})
     return graph_equal, is_subgraph, result
 
 
-def compare_graphs(before, after):
+def compare_graphs(before, after, properties=False):
     """
     Compare two (sub)graphs.
 
@@ -104,6 +240,9 @@ def compare_graphs(before, after):
 
     :param before: A networkx (sub)graph.
     :param after: A networkx (sub)graph.
+    :param properties: If True all the properties of the nodes are
+        compared, not only their attributes, and so is the data of the
+        edges in both graphs (as chg_edge).
     :returns: A dict with changes.
     """
     res = {'added': [],
@@ -111,38 +250,132 @@ def compare_graphs(before, after):
            'added_edge': [],
            'removed_edge': [],
            'chg_attr': []}
+    if properties:
+        res['chg_edge'] = []
+    for kind, change in iter_graph_changes(before, after, properties):
+        res[kind].append(change)
+    return res
+
 
+def iter_graph_changes(before, after, properties=False):
+    """
+    Stream the changes between two (sub)graphs, for graphs too large to
+    hold all their differences in memory.
+
+    Changes of each kind come in the order compare_graphs lists them.
+    Nodes and edges are looked up in the adjacency dicts of the graphs, so
+    that the whole diff takes time linear in the size of the graphs.
+
+    :param before: A networkx (sub)graph.
+    :param after: A networkx (sub)graph.
+    :param properties: If True chg_attr compares all the properties of the
+        nodes, and edges in both graphs with different data are yielded as
+        chg_edge, ((source, target), data before, data after).
+    :returns: Generator of (kind, change) tuples, kind being one of the
+        keys of the dict returned by compare_graphs.
+    """
+    added = set()
     for node in after.nodes():
-        if node not in before.nodes():
+        if node not in before:
             # add missing nodes
-            if node not in res['added']:
-                res['added'].append(node)
+            if node not in added:
+                added.add(node)
+                yield 'added', node
             for link in after.out_edges([node]):
-                if link[1] not in before.nodes() \
-                        and link[1] not in res['added']:
-                    res['added'].append(link[1])
-                res['added_edge'].append(link)
+                if link[1] not in before and link[1] not in added:
+                    added.add(link[1])
+                    yield 'added', link[1]
+                yield 'added_edge', link
         else:
             # already there...
-            if before.node[node]['attributes'] != \
-                    after.node[node]['attributes']:
-                res['chg_attr'].append((node,
-                                        before.node[node]['attributes'],
-                                        after.node[node]['attributes']))
+            if properties:
+                attrs_before = before.node[node]
+                attrs_after = after.node[node]
+            else:
+                attrs_before = before.node[node]['attributes']
+                attrs_after = after.node[node]['attributes']
+            # Copies made with cow_copy share unchanged attributes
+            if attrs_before is not attrs_after and \
+                    attrs_before != attrs_after:
+                yield 'chg_attr', (node, attrs_before, attrs_after)
     for node in before.nodes():
-        if node not in after.nodes():
-            res['removed'].append(node)
+        if node not in after:
+            yield 'removed', node
             for link in before.out_edges([node]):
-                res['removed_edge'].append(link)
+                yield 'removed_edge', link
         else:
             # node exists lets check the edges.
             for link in after.out_edges([node]):
-                if link not in before.out_edges([node]):
-                    res['added_edge'].append(link)
+                if link[1] not in before.adj[node]:
+                    yield 'added_edge', link
+                elif properties:
+                    data_before = before.adj[node][link[1]]
+                    data_after = after.adj[node][link[1]]
+                    if data_before is not data_after and \
+                            data_before != data_after:
+                        yield 'chg_edge', (link, data_before, data_after)
             for link in before.out_edges([node]):
-                if link not in after.out_edges([node]):
-                    res['removed_edge'].append(link)
-    return res
+                if link[1] not in after.adj[node]:
+                    yield 'removed_edge', link
+
+
+def apply_graph_changes(graph, after, changes=None):
+    """
+    Patch a graph in place so that it matches another one, as compared by
+    iter_graph_changes: nodes and edges are added and removed, nodes whose
+    attributes (or properties) changed take the properties they have in
+    after, and so do edges whose data changed.
+    Unchanged nodes keep their property dicts, so that a graph kept up to
+    date this way is not rebuilt on each update.
+
+    :param graph: A networkx graph, patched.
+    :param after: A networkx graph, as the graph has to become.
+    :param changes: The changes from graph to after, as returned by
+        compare_graphs, if already computed.
+    :returns: A dict with the changes applied, as returned by
+        compare_graphs.
+    """
+    if changes is None:
+        changes = compare_graphs(graph, after)
+    for src, dst in changes['removed_edge']:
+        if graph.has_edge(src, dst):
+            graph.remove_edge(src, dst)
+    for node in changes['removed']:
+        graph.remove_node(node)
+    for node in changes['added']:
+        graph.add_node(node, after.node[node])
+    for node, _, _ in changes['chg_attr']:
+        props = after.node[node]
+        # Properties no longer set go through None before being dropped,
+        # so that InfoGraph indexes are updated by add_node
+        update = dict.fromkeys(key for key in graph.node[node]
+                               if key not in props)
+        update.update(props)
+        graph.add_node(node, update)
+        for key in [key for key in graph.node[node] if key not in props]:
+            del graph.node[node][key]
+    for src, dst in changes['added_edge']:
+        graph.add_edge(src, dst, after.edge[src][dst])
+    for (src, dst), _, data in changes.get('chg_edge', []):
+        # Successors and predecessors share the edge dict
+        edge_data = graph.edge[src][dst]
+        edge_data.clear()
+        edge_data.update(data)
+    return changes
+
+
+def cow_copy(graph):
+    """
+    Copy a graph to be filtered: InfoGraphs share the data of their nodes
+    and edges with the copy (see InfoGraph.cow_copy), other graphs are
+    copied entirely.
+
+    :param graph: The graph.
+    :return: A copy of the graph.
+    """
+    if hasattr(graph, 'cow_copy'):
+        return graph.cow_copy()
+    return graph.copy()
 
 
 def filter_graph(graph, layers=None):
@@ -154,13 +387,66 @@ def filter_graph(graph, layers=None):
     :return: A copy of the original graph.
     """
     layers = layers or []
-    res = graph.copy()
+    res = cow_copy(graph)
     for item in graph.nodes(data=True):
         if item[1]['layer'] not in layers:
             res.remove_node(item[0])
     return res
 
 
+class AllocationIndex(object):
+    """
+    Index of how entities of a higher layer (e.g. virtual) are allocated
+    upon entities of a lower layer (e.g. physical machines), built in a
+    single pass over the graph. An entity is allocated upon a machine if
+    they are neighbours, whatever the direction of the edge between them.
+    """
+
+    def __init__(self, graph, lower_type='machine', lower_layer=None,
+                 higher_layer=None, higher_type=None):
+        """
+        :param graph: The graph to be indexed.
+        :param lower_type: Type of the lower level entities.
+        :param lower_layer: Layers of the lower level entities (default: any).
+        :param higher_layer: Layers of the allocated entities (default: any).
+        :param higher_type: Types of the allocated entities (default: any).
+        """
+        self.graph = graph
+        # machine -> list of the entities allocated upon it
+        self.hosted = {}
+        # entity -> machine it is allocated upon
+        self.hosts = {}
+        for machine, attrs in graph.nodes(data=True):
+            if attrs['type'] != lower_type or \
+                    (lower_layer is not None and
+                     attrs['layer'] not in lower_layer):
+                continue
+            hosted = []
+            for node in self.neighbours(machine):
+                node_attrs = graph.node[node]
+                if higher_layer is not None and \
+                        node_attrs['layer'] not in higher_layer:
+                    continue
+                if higher_type is not None and \
+                        node_attrs['type'] not in higher_type:
+                    continue
+                hosted.append(node)
+                self.hosts[node] = machine
+            self.hosted[machine] = hosted
+
+    def neighbours(self, node):
+        """
+        Return the neighbours of a node, ignoring edge directions, without
+        copying the graph as to_undirected does.
+
+        :param node: The node.
+        :return: Set of neighbours.
+        """
+        if self.graph.is_directed():
+            return set(self.graph.succ[node]) | set(self.graph.pred[node])
+        return set(self.graph.adj[node])
+
+
 def get_allocation_graph(graph, lower_type='machine', higher_layer=None,
                          lower_layer=None):
     """
@@ -179,17 +465,19 @@ def get_allocation_graph(graph, lower_type='machine', higher_layer=None,
     if lower_layer is None:
         lower_layer = ['physical']
 
+    index = AllocationIndex(graph, lower_type=lower_type,
+                            lower_layer=lower_layer,
+                            higher_layer=higher_layer)
     tmp1 = nx.DiGraph()
-    for machine in filter_graph(graph, layers=lower_layer).nodes(
-            data=True):
-        if machine[1]['type'] == lower_type:
-            filtr = [machine[0]]
-            filtr.extend(graph.to_undirected().neighbors(machine[0]))
-            for node in graph.nodes(data=True):
-                if node[0] in filtr and node[1]['layer'] in higher_layer:
-                    tmp1.add_node(machine[0], machine[1])
-                    tmp1.add_node(node[0], node[1])
-                    tmp1.add_edge(node[0], machine[0])
+    for machine, hosted in index.hosted.items():
+        if graph.node[machine]['layer'] in higher_layer and \
+                machine not in hosted:
+            # Machines in both layers are allocated upon themselves
+            hosted = hosted + [machine]
+        for node in hosted:
+            tmp1.add_node(machine, graph.node[machine])
+            tmp1.add_node(node, graph.node[node])
+            tmp1.add_edge(node, machine)
     return tmp1
 
 
@@ -200,13 +488,7 @@ def get_vm_allocation(graph):
     :param graph: The subgraph to inspect.
     :return: Dictionary with the mapping.
     """
-    alloc_map = {}
-    for item in graph:
-        if graph.node[item]['type'] == 'compute':
-            for rel in nx.all_neighbors(graph, item):
-                if graph.node[rel]['type'] == 'machine':
-                    alloc_map[item] = rel
-    return alloc_map
+    return dict(AllocationIndex(graph, higher_type=['compute']).hosts)
 
 
 def find_placement_diffs(graph1, graph2, match1=_node_match,
@@ -310,16 +592,87 @@ def optimize_placement(mapping, map_a, map_b):
     return consol, deconsol
 
 
+class GraphMerger(object):
+    """
+    Merges any number of graphs into one, keeping track of the connected
+    components of the merged graph (ignoring edge directions) with a
+    union-find structure: adding a graph takes time linear in its size and
+    connectivity is checked once, when the merged graph is returned.
+    """
+
+    def __init__(self, graphs=None):
+        """
+        :param graphs: Graphs to be merged first.
+        """
+        self.graph = None
+        # node -> parent node, roots being their own parent
+        self._parents = {}
+        # root node -> number of nodes of its component
+        self._sizes = {}
+        self._components = 0
+        for graph in graphs or []:
+            self.add(graph)
+
+    def _find(self, node):
+        parents = self._parents
+        while parents[node] != node:
+            # Path halving
+            parents[node] = parents[parents[node]]
+            node = parents[node]
+        return node
+
+    def _union(self, node_a, node_b):
+        root_a = self._find(node_a)
+        root_b = self._find(node_b)
+        if root_a == root_b:
+            return
+        if self._sizes[root_a] < self._sizes[root_b]:
+            root_a, root_b = root_b, root_a
+        self._parents[root_b] = root_a
+        self._sizes[root_a] += self._sizes.pop(root_b)
+        self._components -= 1
+
+    def add(self, graph):
+        """
+        Adds the nodes and edges of a graph to the merged graph. Attributes
+        of nodes already merged are updated with those of the graph.
+
+        :param graph: The graph to be merged.
+        """
+        if self.graph is None:
+            # The first graph is copied, graphs being merged are not changed
+            self.graph = cow_copy(graph)
+        else:
+            self.graph.add_nodes_from(graph.nodes(data=True))
+            self.graph.add_edges_from(graph.edges(data=True))
+        for node in graph.nodes():
+            if node not in self._parents:
+                self._parents[node] = node
+                self._sizes[node] = 1
+                self._components += 1
+        for src, dst in graph.edges():
+            self._union(src, dst)
+
+    def is_connected(self):
+        """
+        :return: True if the merged graph is connected.
+        """
+        return self._components == 1
+
+    def merged(self):
+        """
+        Returns the merged graph.
+
+        :return: A merged Graph.
+        """
+        if not self.is_connected():
+            raise ValueError("Trying to merge graphs with no nodes in common!")
+        return self.graph
+
+
 def merge_graph(graph_1, graph_2):
     """
     Merge two graphs together.
     :return: A merged Graph.
     """
-    graph = graph_1.copy()
-    graph.add_nodes_from(graph_2.nodes(data=True))
-    graph.add_edges_from(graph_2.edges(data=True))
-    graph_undirected = graph.to_undirected()
-    if nx.is_connected(graph_undirected):
-        return graph
-    else:
-        raise ValueError("Trying to merge graphs with no nodes in common!")
+    return GraphMerger([graph_1, graph_2]).merged()
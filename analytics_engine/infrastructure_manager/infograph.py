@@ -18,6 +18,7 @@ Info core integration.
 import time
 import json
 import networkx as nx
+from collections import OrderedDict
 from config_helper import ConfigHelper
 import telemetry
 import analytics_engine.common as common
@@ -25,7 +26,12 @@ import analytics_engine.common as common
 LOG = common.LOG
 
 PROPS = ['name', 'layer', 'category', 'type', 'attributes']
+# Node properties InfoGraph keeps an index of
+INDEXED_PROPS = ['type', 'layer', 'allocation']
 EOT = 1924905600.0
+# Node property holding the lazy telemetry handle of the node (see
+# InfoGraphNodeProperty.TELEMETRY_HANDLE)
+TELEMETRY_HANDLE = 'telemetry_handle'
 
 
 def get_info_graph(info_graph=None, landscape=None):
@@ -50,6 +56,12 @@ def get_info_graph(info_graph=None, landscape=None):
 class InfoGraph(nx.DiGraph):
     """
     Graph object representing a (sub)graph of the landscape.
+
+    Nodes are indexed by type, layer and allocation (the host of physical
+    nodes), so that selecting nodes by one of those properties takes time
+    proportional to the result. The indexes are built on first use and
+    kept up to date as nodes are added or removed; nodes whose properties
+    are changed in place have to be added again to be reindexed.
     """
 
     def __init__(self):
@@ -57,8 +69,135 @@ class InfoGraph(nx.DiGraph):
         Initializes the InfoGraph.
         """
         super(InfoGraph, self).__init__()
+        self._indexes = None
         #self.telemetry = telemetry.get_telemetry()
 
+    def _get_index(self, prop):
+        """
+        Returns the index of the nodes by the given property, building the
+        indexes if nodes have been added bypassing add_node (e.g. by
+        networkx subgraph).
+        """
+        indexes = getattr(self, '_indexes', None)
+        if indexes is None or indexes['size'] != len(self.node):
+            indexes = {'size': 0}
+            for prop_name in INDEXED_PROPS:
+                indexes[prop_name] = dict()
+            self._indexes = indexes
+            for node in self.node:
+                self._index_node(node)
+        return indexes[prop]
+
+    def _index_node(self, node):
+        indexes = getattr(self, '_indexes', None)
+        if indexes is None:
+            return
+        attrs = self.node[node]
+        for prop in INDEXED_PROPS:
+            value = attrs.get(prop)
+            try:
+                if value is not None:
+                    indexes[prop].setdefault(value, OrderedDict())[node] = None
+            except TypeError:
+                LOG.debug('Property {} of node {} cannot be indexed'.
+                          format(prop, node))
+        indexes['size'] += 1
+
+    def _unindex_node(self, node):
+        indexes = getattr(self, '_indexes', None)
+        if indexes is None or node not in self.node:
+            return
+        attrs = self.node[node]
+        for prop in INDEXED_PROPS:
+            value = attrs.get(prop)
+            try:
+                nodes = indexes[prop].get(value)
+            except TypeError:
+                continue
+            if nodes is not None:
+                nodes.pop(node, None)
+                if not nodes:
+                    del indexes[prop][value]
+        indexes['size'] -= 1
+
+    def add_node(self, n, attr_dict=None, **attr):
+        self._unindex_node(n)
+        super(InfoGraph, self).add_node(n, attr_dict, **attr)
+        self._index_node(n)
+
+    def add_nodes_from(self, nodes, **attr):
+        super(InfoGraph, self).add_nodes_from(nodes, **attr)
+        # Rebuilt on next use
+        self._indexes = None
+
+    def remove_node(self, n):
+        self._unindex_node(n)
+        super(InfoGraph, self).remove_node(n)
+
+    def remove_nodes_from(self, nodes):
+        super(InfoGraph, self).remove_nodes_from(nodes)
+        self._indexes = None
+
+    def clear(self):
+        super(InfoGraph, self).clear()
+        self._indexes = None
+
+    def cow_copy(self):
+        """
+        Returns a copy of the graph sharing the data of its nodes and edges.
+
+        Unlike copy(), which deep copies the graph, telemetry DataFrames
+        included, only the dicts holding the properties of the nodes and
+        edges are copied: nodes and edges can be removed from the copy, and
+        their properties set, without changing this graph. The values of the
+        properties are shared, so they have to be replaced rather than
+        modified in place (e.g. through the InfoGraphNode setters), but for
+        lazy telemetry handles, which are copied.
+
+        :return: (InfoGraph) of the same class
+        """
+        res = self.__class__.__new__(self.__class__)
+        res.__dict__.update(self.__dict__)
+        res.graph = dict(self.graph)
+        res.node = dict((node, attrs.copy())
+                        for node, attrs in self.node.items())
+        # Lazy telemetry handles load into their own graph: each copy gets
+        # its own handles
+        for attrs in res.node.values():
+            handle = attrs.get(TELEMETRY_HANDLE)
+            if handle is not None:
+                attrs[TELEMETRY_HANDLE] = handle.copy(res)
+        res.succ = dict((node, dict()) for node in self.succ)
+        res.pred = dict((node, dict()) for node in self.pred)
+        for src, neighbours in self.succ.items():
+            for dst, data in neighbours.items():
+                # Successors and predecessors share the edge dict
+                data = dict(data)
+                res.succ[src][dst] = data
+                res.pred[dst][src] = data
+        res.adj = res.succ
+        res.edge = res.succ
+        res._indexes = None
+        return res
+
+    def get_nodes_by_layer(self, layer):
+        """
+        Get the nodes of a given layer.
+
+        :param layer: The layer you are looking for
+        :return: List of nodes
+        """
+        return list(self._get_index('layer').get(layer, ()))
+
+    def get_nodes_by_allocation(self, allocation):
+        """
+        Get the nodes allocated on a given host.
+
+        :param allocation: Name of the host
+        :return: List of nodes
+        """
+        return list(self._get_index('allocation').get(allocation, ()))
+
     def add_landscape(self, graph):
         """
         replace all nodes and edges in the graph.
@@ -69,6 +208,49 @@ class InfoGraph(nx.DiGraph):
         self.add_nodes_from(graph.nodes(data=True))
         self.add_edges_from(graph.edges())
 
+    def add_node_link_data(self, data, decode_attributes=False):
+        """
+        Adds the nodes and links of a graph in networkx node-link format
+        (as returned by the Landscaper), taking over the property dicts of
+        the data instead of copying them as node_link_graph and the
+        InfoGraph constructors do.
+
+        :param data: (dict) node-link data, modified by the call
+        :param decode_attributes: (bool) if True the attributes of each
+                                  node are set to a copy of its properties
+                                  but layer and category, as expected by
+                                  the heuristics (see SubGraphExtraction)
+        :return: None
+        """
+        multigraph = data.get('multigraph', False)
+        self.graph.update(data.get('graph', {}))
+        mapping = []
+        for position, props in enumerate(data.get('nodes', [])):
+            node = props.pop('id', position)
+            mapping.append(node)
+            if decode_attributes:
+                props['attributes'] = dict(
+                    (key, value) for key, value in props.items()
+                    if key not in ['layer', 'category'])
+            if node in self.node:
+                self.node[node].update(props)
+                continue
+            self.succ[node] = dict()
+            self.pred[node] = dict()
+            self.node[node] = props
+        for link in data.get('links', []):
+            src = mapping[link.pop('source')]
+            dst = mapping[link.pop('target')]
+            if multigraph:
+                link.pop('key', None)
+            if dst in self.succ[src]:
+                self.succ[src][dst].update(link)
+            else:
+                self.succ[src][dst] = link
+                self.pred[dst][src] = link
+        # Nodes have been added bypassing add_node
+        self._indexes = None
+
     def get_nodes_by_type(self, qtype):
         """
         Get a set of nodes by a give type.
@@ -76,18 +258,13 @@ class InfoGraph(nx.DiGraph):
         :param qtype: The type you are looking for
         :return: List of nodes
         """
-        res = []
-        for node in self.nodes():
-            if qtype == self.node[node].get('type'):
-                res.append(node)
-        return res
+        return list(self._get_index('type').get(qtype, ()))
 
     def get_machine_cores(self, machine):
         cores = []
-        for node in self.nodes(data=True):
-            if node[1]["type"] == "core":
-                if node[1]["attributes"]["allocation"] == machine:
-                    cores.append(node[0])
+        for node in self.get_nodes_by_type("core"):
+            if self.node[node]["attributes"]["allocation"] == machine:
+                cores.append(node)
         return cores
 
     def get_neighbour_by_type(self, node_id, ntype):
@@ -163,11 +340,7 @@ class InfoGraph(nx.DiGraph):
         :return: List of nodes
         """
         res = []
-        tmp = self.copy()
-        if not directed:
-            tmp = tmp.to_undirected()
-
-        for relation in tmp.neighbors(node_id):
+        for relation in self._relations(node_id, directed):
             if self.node[relation]['layer'] != self.node[node_id]['layer']:
                 res.append(relation)
         return res
@@ -181,15 +354,20 @@ class InfoGraph(nx.DiGraph):
         :return: List of nodes
         """
         res = []
-        tmp = self.copy()
-        if not directed:
-            tmp = tmp.to_undirected()
-
-        for relation in tmp.neighbors(node_id):
+        for relation in self._relations(node_id, directed):
             if self.node[relation]['layer'] == self.node[node_id]['layer']:
                 res.append(relation)
         return res
 
+    def _relations(self, node_id, directed=True):
+        """
+        Successors of the node, or all its neighbours if not directed,
+        without copying the graph.
+        """
+        if directed:
+            return self.successors(node_id)
+        return list(OrderedDict.fromkeys(nx.all_neighbors(self, node_id)))
+
     def filter_nodes(self, key, val):
         """
         Removes all of the nodes with the key value pair. When a node is
@@ -197,8 +375,18 @@ class InfoGraph(nx.DiGraph):
         connections are maintained.
         """
         if key is not None and val is not None:
-            nodes_to_filter = self.select_nodes(key, val)
-            for node in nodes_to_filter:
+            self.filter_node_list(self.select_nodes(key, val))
+
+    def filter_node_list(self, nodes):
+        """
+        Removes all of the nodes in the list, connecting their neighbours
+        together as filter_nodes does. Nodes which are not in the graph
+        (e.g. listed twice) are ignored.
+
+        :param nodes: (list) names of the nodes to be removed
+        """
+        for node in nodes:
+            if node in self:
                 self._filter_node(node)
 
     def select_nodes(self, key, val):
@@ -224,7 +412,9 @@ class InfoGraph(nx.DiGraph):
                     if key in attr:
                         nodes.append(node)
             else:
-                attributes = json.loads(attr['attributes'])
+                attributes = attr['attributes']
+                if isinstance(attributes, basestring):
+                    attributes = json.loads(attributes)
                 if val:
                     if key in attributes and attributes[key] == val:
                         nodes.append(node)
@@ -16,66 +16,124 @@
 Graph Database Base class and factory.
 """
 import time
-import requests
-from networkx.readwrite import json_graph
+import threading
 from config_helper import ConfigHelper as config
+from landscaper_client import LandscaperClient
+from topology_cache import TopologyCache
+from file_landscape import FileLandscape, MANIFEST as INDEX_MANIFEST
 import infograph
 import json
 import os
 import analytics_engine.common as common
 
+# Faster JSON decoders are used, if installed, to parse landscapes
+try:
+    import ujson as json_decoder
+except ImportError:
+    try:
+        import simplejson as json_decoder
+    except ImportError:
+        json_decoder = json
+
 LOG = common.LOG
 # HOST = '10.1.24.14'
 # PORT = 9001
-config.get("LANDSCAPE", "host")
-config.get("LANDSCAPE", "port")
+HOST = config.get("LANDSCAPE", "host")
+PORT = config.get("LANDSCAPE", "port")
+
+# Client of the Landscaper at HOST:PORT, shared by all the threads
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+# Cache of the topologies retrieved, for any Landscaper
+_CACHE = None
 
-def get_graph():
+# Landscape index served instead of a Landscaper (see get_file_landscape)
+_FILE_LANDSCAPE = None
+
+
+def load_graph(payload, source='landscape', decode_attributes=False):
+    """
+    Builds an InfoGraph from a Landscaper payload in a single pass: the
+    payload is decoded (with ujson or simplejson if installed) and its
+    nodes and links are added to the InfoGraph as they are, without going
+    through an intermediate networkx graph.
+    The time taken is logged for each call.
+
+    :param payload: (str) networkx node-link JSON, or the decoded dict
+    :param source: (str) what the payload is, for the log
+    :param decode_attributes: (bool) if True node attributes are decoded
+                              as the heuristics expect them
+    :return: (InfoGraph)
+    """
+    started = time.time()
+    if isinstance(payload, (bytes, type(u''))):
+        payload = json_decoder.loads(payload)
+    decoded = time.time()
+    graph = infograph.get_info_graph()
+    graph.add_node_link_data(payload, decode_attributes=decode_attributes)
+    LOG.info("{}: {} nodes and {} links loaded in {:.3f}s "
+             "({:.3f}s decoding with {})".
+             format(source, len(graph.node), graph.number_of_edges(),
+                    time.time() - started, decoded - started,
+                    json_decoder.__name__))
+    return graph
+
+
+def get_graph(decode_attributes=False):
     """
     Retrieves the entire landscape graph.
+    :param decode_attributes: Decode the attributes of the nodes.
     :return: Landscape as a networkx graph.
     """
+    file_landscape = get_file_landscape()
+    if file_landscape:
+        return load_graph(file_landscape.get_graph(), file_landscape.path,
+                          decode_attributes)
     landscape = _get("/graph")
     landscape.raise_for_status()  # Raise an exception if we get an error.
 
-    nx_graph = json_graph.node_link_graph(landscape.json())
-    return infograph.get_info_graph(landscape=nx_graph)
+    return load_graph(landscape.content, "/graph", decode_attributes)
 
 
-def get_subgraph(node_id, timestamp=None, timeframe=0):
+def get_subgraph(node_id, timestamp=None, timeframe=0,
+                 decode_attributes=False):
     """
     Grab the subgraph starting from the specified node.
     :param node_id: THe id of the node which will be used to extract the sub.
+    :param decode_attributes: Decode the attributes of the nodes.
     :return: A networkx graph of the subgraph. None if the ID is not found.
     """
-    if HOST == 'localhost_file':
-        exp_id = None
-        # testing
-        node_id = '1iozone'
-        directory = os.path.join(common.INSTALL_BASE_DIR, "input_data")
-        landscape = os.path.join(directory, node_id)
-        for x in os.walk(landscape):
-            exp_id = x[1][0]
-            break
-        topology_folder = os.path.join(landscape, exp_id)
-        topology_json = os.path.join(topology_folder, "{}_topology.json".format(exp_id))
-        LOG.info(topology_json)
-        with open(topology_json) as json_data:
-            subgraph = json.load(json_data)
-            nx_subgraph = json_graph.node_link_graph(subgraph)
-            LOG.info(nx_subgraph)
-    else:
-        timestamp = timestamp or time.time()
-        path = "/subgraph/{}".format(node_id)
-        subgraph = _get(path, {"timestamp": timestamp, "timeframe": timeframe})
-
-        if subgraph.status_code == 400:
-            LOG.error(error_message(subgraph))
+    file_landscape = get_file_landscape()
+    if file_landscape:
+        subgraph = file_landscape.get_subgraph(node_id, timestamp, timeframe)
+        if subgraph is None:
             return None
-        subgraph.raise_for_status()
+        return load_graph(subgraph, file_landscape.path, decode_attributes)
+    cache = get_cache()
+    historical, bucket = cache.time_bucket(timestamp, timeframe)
+    if historical:
+        timestamp = bucket
+    key = ('subgraph', HOST, PORT, node_id, bucket, timeframe,
+           decode_attributes)
+    return cache.get(key, lambda: _get_subgraph(
+        node_id, timestamp, timeframe, decode_attributes), historical)
+
+
+def _get_subgraph(node_id, timestamp, timeframe, decode_attributes):
+    """
+    Retrieves the subgraph from the Landscaper.
+    """
+    timestamp = timestamp or time.time()
+    path = "/subgraph/{}".format(node_id)
+    subgraph = _get(path, {"timestamp": timestamp, "timeframe": timeframe})
 
-        nx_subgraph = json_graph.node_link_graph(subgraph.json())
-    return infograph.get_info_graph(landscape=nx_subgraph)
+    if subgraph.status_code == 400:
+        LOG.error(error_message(subgraph))
+        return None
+    subgraph.raise_for_status()
+
+    return load_graph(subgraph.content, path, decode_attributes)
 
 
 def get_node_by_uuid(node_id):
@@ -85,6 +143,12 @@ def get_node_by_uuid(node_id):
     :param node_id: The name of the node to be retrieved.
     :return: Returns the node inside a networkx Graph object.
     """
+    file_landscape = get_file_landscape()
+    if file_landscape:
+        node = file_landscape.get_node_by_uuid(node_id)
+        if node is None:
+            return None
+        return load_graph(node, file_landscape.path)
     path = "/node/{}".format(node_id)
     node_graph_resp = _get(path)
 
@@ -92,8 +156,7 @@ def get_node_by_uuid(node_id):
         LOG.error(error_message(node_graph_resp))
         return None
     node_graph_resp.raise_for_status()
-    nx_node_graph = json_graph.node_link_graph(node_graph_resp.json())
-    return infograph.get_info_graph(landscape=nx_node_graph)
+    return load_graph(node_graph_resp.content, path)
 
 
 def get_node_by_properties(properties, start=None, timeframe=0):
@@ -105,61 +168,143 @@ def get_node_by_properties(properties, start=None, timeframe=0):
     Example: [(k, v, o), (k, v)]
     :return: A matching nodes in a networkx graph.
     """
-    if HOST == 'localhost_file':
-        exp_id = None
-        # testing
-        node_id = '1iozone'
-        directory = os.path.join(common.INSTALL_BASE_DIR, "input_data")
-        landscape = os.path.join(directory, node_id)
-        for x in os.walk(landscape):
-            exp_id = x[1][0]
-            break
-        topology_folder= os.path.join(landscape, exp_id)
-        topology_json = os.path.join(topology_folder, "{}_topology.json".format(exp_id))
-        LOG.info(topology_json)
-        with open(topology_json) as json_data:
-            subgraph = json.load(json_data)
-            nx_prop_graph = json_graph.node_link_graph(subgraph)
-            LOG.info(nx_prop_graph)
-    else:
-        start = start or time.time()
-        response = _get("/nodes", params={"properties": properties,
-                                          "timestamp": start,
-                                          "timeframe": timeframe})
-        response.raise_for_status()
-        nx_prop_graph = json_graph.node_link_graph(response.json())
-    return infograph.get_info_graph(landscape=nx_prop_graph)
+    file_landscape = get_file_landscape()
+    if file_landscape:
+        return load_graph(file_landscape.get_node_by_properties(
+            properties, start, timeframe), file_landscape.path)
+    cache = get_cache()
+    historical, bucket = cache.time_bucket(start, timeframe)
+    if historical:
+        start = bucket
+    key = ('nodes', HOST, PORT, repr(properties), bucket, timeframe)
+    return cache.get(key, lambda: _get_node_by_properties(
+        properties, start, timeframe), historical)
+
+
+def _get_node_by_properties(properties, start, timeframe):
+    """
+    Retrieves the nodes matching the properties from the Landscaper.
+    """
+    start = start or time.time()
+    response = _get("/nodes", params={"properties": properties,
+                                      "timestamp": start,
+                                      "timeframe": timeframe})
+    response.raise_for_status()
+    return load_graph(response.content, "/nodes")
 
 
 def get_service_instance_hist_nodes(properties):
+    file_landscape = get_file_landscape()
+    if file_landscape:
+        return load_graph(file_landscape.get_service_instance_hist_nodes(
+            properties), file_landscape.path)
     response = _get("/service_instances", params={"properties": properties})
     response.raise_for_status()
-    nx_prop_graph = json_graph.node_link_graph(response.json())
-    return infograph.get_info_graph(landscape=nx_prop_graph)
+    return load_graph(response.content, "/service_instances")
 
 def get_service_instance_hist_subgraphs(properties):
+    file_landscape = get_file_landscape()
+    if file_landscape:
+        return load_graph(file_landscape.get_service_instance_hist_nodes(
+            properties), file_landscape.path)
     response = _get("/service_instances", params={"properties": properties})
     response.raise_for_status()
-    nx_prop_graph = json_graph.node_link_graph(response.json())
-    return infograph.get_info_graph(landscape=nx_prop_graph)
+    return load_graph(response.content, "/service_instances")
+
+def get_client():
+    """
+    Returns the client of the Landscaper currently set, created with the
+    optional timeout, retries and backoff attributes of the LANDSCAPE
+    configuration.
+    :return: (LandscaperClient)
+    """
+    global _CLIENT
+
+    with _CLIENT_LOCK:
+        if _CLIENT is None or (_CLIENT.host, _CLIENT.port) != (HOST, PORT):
+            settings = dict()
+            for setting in ['timeout', 'retries', 'backoff']:
+                try:
+                    settings[setting] = config.get("LANDSCAPE", setting)
+                except Exception:
+                    pass
+            _CLIENT = LandscaperClient(HOST, PORT, **settings)
+        return _CLIENT
+
+
+def get_cache():
+    """
+    Returns the cache of the topologies retrieved by get_subgraph and
+    get_node_by_properties, created with the optional cache_ttl and
+    cache_size attributes of the LANDSCAPE configuration.
+    :return: (TopologyCache)
+    """
+    global _CACHE
+
+    with _CLIENT_LOCK:
+        if _CACHE is None:
+            settings = dict()
+            for setting, name in [('cache_ttl', 'ttl'),
+                                  ('cache_size', 'max_elements')]:
+                try:
+                    settings[name] = config.get("LANDSCAPE", setting)
+                except Exception:
+                    pass
+            _CACHE = TopologyCache(**settings)
+        return _CACHE
+
+
+def get_file_landscape():
+    """
+    Returns the landscape index served instead of a Landscaper, if the host
+    set is file:<directory of the index> or localhost_file. With
+    localhost_file the index is the index attribute of the LANDSCAPE
+    configuration (input_data/landscape_index by default) and, if it does
+    not exist yet, it is built from the <name>_topology.json files found
+    in input_data. The optional dump attribute of the LANDSCAPE
+    configuration selects the dump answering all the queries (e.g. <name>).
+    :return: (FileLandscape) or None if a Landscaper is used
+    """
+    global _FILE_LANDSCAPE
+
+    host = str(HOST)
+    if host.startswith('file:'):
+        path = host[len('file:'):]
+    elif host == 'localhost_file':
+        try:
+            path = config.get("LANDSCAPE", "index")
+        except Exception:
+            path = os.path.join(common.INSTALL_BASE_DIR, "input_data",
+                                "landscape_index")
+    else:
+        return None
+    try:
+        dump = config.get("LANDSCAPE", "dump") or None
+    except Exception:
+        dump = None
+    with _CLIENT_LOCK:
+        if _FILE_LANDSCAPE is None or _FILE_LANDSCAPE.path != path or \
+                _FILE_LANDSCAPE.dump != dump:
+            if host == 'localhost_file' and \
+                    not os.path.isfile(os.path.join(path, INDEX_MANIFEST)):
+                directory = os.path.join(common.INSTALL_BASE_DIR, "input_data")
+                dumps = [os.path.join(root, file_name)
+                         for root, _, file_names in os.walk(directory)
+                         for file_name in sorted(file_names)
+                         if file_name.endswith('_topology.json')]
+                FileLandscape.ingest(path, dumps)
+            _FILE_LANDSCAPE = FileLandscape(path, dump)
+        return _FILE_LANDSCAPE
+
 
 def _get(path, params=None):
     """
-    Builds the uri to the service and then retrieves from the host.
+    Retrieves a resource from the Landscaper through the shared client.
     :param path: The path of the service. Host and port are already known.
+    :param params: Query parameters, None values being skipped.
     :return: A response object of the request.
     """
-    uri = "http://{}:{}{}".format(HOST, PORT, path)
-
-    if params:
-        uri += "?"
-        for param_name, param in params.iteritems():
-            if param is None:  # Skip parameters that are none.
-                continue
-            uri += "{}={}&".format(param_name, param)
-        uri = uri[:len(uri)]  # Remove ? or & from the  end of query string
-        LOG.debug(uri)
-    return requests.get(uri)
+    return get_client().get(path, params)
 
 
 def error_message(response):
@@ -0,0 +1,196 @@
+# Copyright (c) 2017, Intel Research and Development Ireland Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Local copy of the whole landscape, kept in sync with the Landscaper.
+"""
+import time
+import threading
+import graphs
+import landscape
+from config_helper import ConfigHelper as config
+import analytics_engine.common as common
+
+LOG = common.LOG
+
+# Seconds between two synchronizations, 0 if disabled
+DEFAULT_INTERVAL = 0
+
+
+class LandscapeSync(threading.Thread):
+    """
+    Keeps a local graph of the whole landscape, patched with the changes
+    of the landscape every interval seconds.
+
+    The Landscaper has no change feed: each synchronization retrieves the
+    landscape in the background, compares it with the local graph (see
+    graphs.iter_graph_changes) and applies the changes only, so that
+    unchanged nodes keep their properties from one synchronization to the
+    next. Whole-landscape pipes start from a copy of the local graph (see
+    graphs.cow_copy) instead of retrieving the landscape on each run.
+
+    The synchronization is disabled unless a sync_interval is configured,
+    and started by the first whole-landscape pipe (see start_sync).
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, interval=None, prepare=None):
+        """
+        :param interval: (float) seconds between two synchronizations
+        :param prepare: callable applied to the local graph, in place, after
+                        each synchronization (e.g. to compact its nodes)
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = float(interval or LandscapeSync._interval())
+        if self.interval <= 0:
+            raise ValueError("Interval must be positive")
+        self.prepare = prepare
+        # Local graph, only modified by sync
+        self._graph = None
+        self._synced = None
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    @staticmethod
+    def _interval():
+        """
+        Seconds between two synchronizations, as set by the optional
+        sync_interval attribute of the LANDSCAPE configuration.
+        """
+        try:
+            value = config.get("LANDSCAPE", "sync_interval")
+        except Exception:
+            value = None
+        return float(value) if value not in [None, ''] else DEFAULT_INTERVAL
+
+    @staticmethod
+    def start_sync(interval=None, prepare=None):
+        """
+        Starts the synchronization used by the whole-landscape pipes, unless
+        already started or disabled (sync_interval of 0, the default).
+
+        :param interval: (float) seconds between two synchronizations
+        :param prepare: callable applied to the local graph after each
+                        synchronization
+        :return: (LandscapeSync) or None if disabled
+        """
+        with LandscapeSync._instance_lock:
+            if LandscapeSync._instance is not None:
+                return LandscapeSync._instance
+            if not interval and LandscapeSync._interval() <= 0:
+                return None
+            sync = LandscapeSync(interval, prepare)
+            LandscapeSync._instance = sync
+            sync.start()
+            return sync
+
+    @staticmethod
+    def get_instance():
+        """
+        Returns the running synchronization, if any.
+
+        :return: (LandscapeSync) or None
+        """
+        return LandscapeSync._instance
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        LOG.info('Synchronizing the landscape every {}s'.format(self.interval))
+        while not self._stop_event.is_set():
+            started = time.time()
+            try:
+                with self._sync_lock:
+                    # Possibly synchronized by get_graph in the meantime
+                    if self._is_stale(self.interval):
+                        self._sync()
+            except Exception as e:
+                LOG.error("Landscape synchronization failed: {}".format(e))
+            self._stop_event.wait(
+                max(0, self.interval - (time.time() - started)))
+
+    def sync(self):
+        """
+        Retrieves the landscape and applies its changes to the local graph.
+
+        :return: (dict) the changes applied, as returned by
+                 graphs.compare_graphs
+        """
+        with self._sync_lock:
+            return self._sync()
+
+    def _sync(self):
+        started = time.time()
+        after = landscape.get_graph(decode_attributes=True)
+        if self._graph is None:
+            changes = graphs.compare_graphs(after.__class__(), after,
+                                            properties=True)
+            with self._lock:
+                self._graph = after
+                self._prepare()
+                self._synced = started
+        else:
+            # Readers only copy the local graph: it can be compared without
+            # holding the lock
+            changes = graphs.compare_graphs(self._graph, after,
+                                            properties=True)
+            with self._lock:
+                graphs.apply_graph_changes(self._graph, after, changes)
+                self._prepare()
+                self._synced = started
+        LOG.info("Landscape synchronized in {:.3f}s: {}".format(
+            time.time() - started,
+            ", ".join("{} {}".format(len(value), kind)
+                      for kind, value in sorted(changes.items()))))
+        return changes
+
+    def _prepare(self):
+        if self.prepare is not None:
+            self.prepare(self._graph)
+
+    def _is_stale(self, max_age):
+        with self._lock:
+            return self._synced is None or \
+                time.time() - self._synced > max_age
+
+    def get_graph(self, max_age=None):
+        """
+        Returns a copy of the local graph, synchronizing it first if it has
+        never been, or not for max_age seconds (e.g. if the background
+        synchronization fails).
+
+        :param max_age: (float) seconds, twice the interval if None
+        :return: (InfoGraph)
+        """
+        max_age = 2 * self.interval if max_age is None else max_age
+        if self._is_stale(max_age):
+            with self._sync_lock:
+                # Possibly synchronized while waiting for the lock
+                if self._is_stale(max_age):
+                    self._sync()
+        with self._lock:
+            return graphs.cow_copy(self._graph)
+
+    def get_last_sync(self):
+        """
+        :return: (float) time the local graph was last synchronized, None
+                 if never
+        """
+        with self._lock:
+            return self._synced
@@ -0,0 +1,168 @@
+# Copyright (c) 2017, Intel Research and Development Ireland Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+HTTP client of the Landscaper REST API.
+"""
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+import analytics_engine.common as common
+
+LOG = common.LOG
+
+# Responses retried as the Landscaper (or a proxy) may be restarting
+RETRY_STATUS = frozenset([502, 503, 504])
+
+
+class LandscaperClient(object):
+    """
+    Client of the Landscaper REST API, to be shared by all the threads of
+    the engine.
+
+    Connections are kept alive in a pool shared by the threads, each
+    thread having its own session on top of it. Responses are requested
+    gzip compressed. Each request has a timeout and, optionally, a
+    deadline; requests failing to connect, timing out or answered with
+    502, 503 or 504 are retried with exponential backoff until the
+    retries (or the deadline) run out.
+
+    Latency, bytes and errors are counted for each endpoint, the first
+    segment of the path (e.g. /subgraph).
+    """
+
+    def __init__(self, host, port, timeout=30, retries=3, backoff=0.5,
+                 pool_size=10):
+        """
+        :param host: (str) host of the Landscaper
+        :param port: (int) port of the Landscaper
+        :param timeout: (float) seconds to wait for the connection and for
+                        each read
+        :param retries: (int) times a failed request is retried
+        :param backoff: (float) seconds before the first retry, doubled at
+                        each retry
+        :param pool_size: (int) connections kept alive
+        """
+        self.host = host
+        self.port = port
+        self.base_url = "http://{}:{}".format(host, port)
+        self.timeout = float(timeout)
+        self.retries = int(retries)
+        self.backoff = float(backoff)
+        self._adapter = HTTPAdapter(pool_connections=1,
+                                    pool_maxsize=pool_size,
+                                    max_retries=0)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = dict()
+
+    def _session(self):
+        """
+        Returns the session of the calling thread, using the shared pool.
+        """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', self._adapter)
+            session.mount('https://', self._adapter)
+            session.headers.update({'Accept': 'application/json',
+                                    'Accept-Encoding': 'gzip'})
+            self._local.session = session
+        return session
+
+    def get(self, path, params=None, deadline=None):
+        """
+        Retrieves a resource from the Landscaper.
+
+        :param path: (str) path of the resource, e.g. /graph
+        :param params: (dict) query parameters, None values being skipped
+        :param deadline: (float) time (as time.time()) by which the response
+                         is needed, or None
+        :return: (requests.Response) the last response received
+        """
+        endpoint = '/' + path.strip('/').split('/')[0]
+        query = [(name, "{}".format(value))
+                 for name, value in (params or dict()).items()
+                 if value is not None]
+        attempt = 0
+        while True:
+            timeout = self.timeout
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.time())
+                if timeout <= 0:
+                    self._count(endpoint, errors=1)
+                    raise requests.Timeout(
+                        "Deadline passed requesting {}".format(path))
+            started = time.time()
+            response = None
+            error = None
+            try:
+                response = self._session().get(self.base_url + path,
+                                               params=query,
+                                               timeout=timeout)
+                # Read here, to be timed
+                content = response.content
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            elapsed = time.time() - started
+            if error is None:
+                wire_bytes = response.raw.tell() \
+                    if hasattr(response.raw, 'tell') else len(content)
+                self._count(endpoint, requests=1, seconds=elapsed,
+                            bytes=len(content), wire_bytes=wire_bytes,
+                            errors=int(response.status_code >= 400))
+                LOG.debug("GET {} {} ({} bytes) in {:.3f}s".format(
+                    response.url, response.status_code, len(content),
+                    elapsed))
+                if response.status_code not in RETRY_STATUS:
+                    return response
+            else:
+                self._count(endpoint, requests=1, seconds=elapsed, errors=1)
+                LOG.debug("GET {} failed in {:.3f}s: {}".format(
+                    path, elapsed, error))
+
+            wait = self.backoff * (2 ** attempt)
+            if attempt >= self.retries or \
+                    (deadline is not None and time.time() + wait >= deadline):
+                if error is not None:
+                    raise error
+                return response
+            attempt += 1
+            self._count(endpoint, retries=1)
+            LOG.warning("Retrying GET {} in {:.1f}s ({}/{})".format(
+                path, wait, attempt, self.retries))
+            time.sleep(wait)
+
+    def _count(self, endpoint, **counters):
+        with self._lock:
+            stats = self._stats.setdefault(
+                endpoint, dict(requests=0, retries=0, errors=0, seconds=0.0,
+                               max_seconds=0.0, bytes=0, wire_bytes=0))
+            for name, value in counters.items():
+                stats[name] += value
+            stats['max_seconds'] = max(stats['max_seconds'],
+                                       counters.get('seconds', 0.0))
+
+    def get_stats(self):
+        """
+        Returns the counters of each endpoint: requests, retries, errors,
+        seconds spent (total and maximum), bytes received (decoded) and
+        bytes received over the wire (compressed).
+
+        :return: (dict) endpoint -> dict of counters
+        """
+        with self._lock:
+            return dict((endpoint, dict(stats))
+                        for endpoint, stats in self._stats.items())
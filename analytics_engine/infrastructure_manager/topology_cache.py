@@ -0,0 +1,150 @@
+# Copyright (c) 2017, Intel Research and Development Ireland Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Time-versioned cache of the topologies retrieved from the Landscaper.
+"""
+import math
+import time
+import threading
+from collections import OrderedDict
+import graphs
+import analytics_engine.common as common
+
+LOG = common.LOG
+
+
+class TopologyCache(object):
+    """
+    Cache of Landscaper query results, keyed by query and time bucket.
+
+    Topologies of windows fully in the past do not change: they are kept
+    until evicted. Topologies of current windows are kept for ttl seconds,
+    so that queries made within the same ttl seconds share them.
+    The least recently used topologies are evicted when the cached graphs
+    hold more than max_elements nodes and edges altogether.
+
+    Cached graphs are never handed out: each lookup returns a copy sharing
+    the node data with the cached graph (see graphs.cow_copy).
+    """
+
+    def __init__(self, ttl=5, max_elements=1000000):
+        """
+        :param ttl: (float) seconds current topologies are kept for
+        :param max_elements: (int) nodes and edges kept altogether
+        """
+        self.ttl = float(ttl)
+        self.max_elements = int(max_elements)
+        # key -> (expiry time or None, graph, number of elements)
+        self._entries = OrderedDict()
+        self._elements = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def is_historical(self, timestamp, timeframe=0):
+        """
+        Whether the window starting at timestamp is fully in the past,
+        allowing ttl seconds for the Landscaper to catch up.
+
+        :param timestamp: (float) start of the window, None for now
+        :param timeframe: (float) length of the window in seconds, negative
+                          for windows ending at timestamp
+        :return: (bool)
+        """
+        if timestamp is None:
+            return False
+        return float(timestamp) + max(float(timeframe or 0), 0) < \
+            time.time() - self.ttl
+
+    def time_bucket(self, timestamp, timeframe=0):
+        """
+        Returns the bucket of a window: the second it starts at for
+        historical windows, the ttl seconds long period it starts in for
+        current ones.
+
+        :param timestamp: (float) start of the window, None for now
+        :param timeframe: (float) length of the window in seconds
+        :return: (tuple) whether the window is historical and its bucket
+        """
+        if self.is_historical(timestamp, timeframe):
+            return True, int(math.floor(float(timestamp)))
+        timestamp = time.time() if timestamp is None else float(timestamp)
+        return False, int(math.floor(timestamp / self.ttl)) \
+            if self.ttl > 0 else timestamp
+
+    def get(self, key, loader, historical=False):
+        """
+        Returns the cached graph of the key, calling the loader to retrieve
+        it if not cached yet (or expired). None results are not cached.
+
+        :param key: (tuple) query and time bucket
+        :param loader: (callable) returning the graph of the key
+        :param historical: (bool) if True the graph never expires
+        :return: (InfoGraph) copy of the cached graph
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                if entry[0] is None or entry[0] > now:
+                    self._entries[key] = entry
+                    self.hits += 1
+                    return graphs.cow_copy(entry[1])
+                self._elements -= entry[2]
+            self.misses += 1
+
+        graph = loader()
+        if graph is None:
+            return None
+        elements = len(graph.node) + graph.number_of_edges()
+        if elements <= self.max_elements:
+            expiry = None if historical else time.time() + self.ttl
+            with self._lock:
+                previous = self._entries.pop(key, None)
+                if previous is not None:
+                    self._elements -= previous[2]
+                self._entries[key] = (expiry, graph, elements)
+                self._elements += elements
+                self._evict()
+        return graphs.cow_copy(graph)
+
+    def _evict(self):
+        # Expired entries first, then the least recently used ones
+        now = time.time()
+        for key, entry in list(self._entries.items()):
+            if entry[0] is not None and entry[0] <= now:
+                del self._entries[key]
+                self._elements -= entry[2]
+        while self._elements > self.max_elements:
+            key, entry = self._entries.popitem(last=False)
+            self._elements -= entry[2]
+            LOG.debug("Topology {} evicted from the cache".format(key))
+
+    def clear(self):
+        """
+        Empties the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._elements = 0
+
+    def get_stats(self):
+        """
+        :return: (dict) hits, misses, topologies and elements cached
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'topologies': len(self._entries),
+                    'elements': self._elements}
@@ -0,0 +1,123 @@
+# Copyright (c) 2017, Intel Research and Development Ireland Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = 'Giuliana Carullo'
+__copyright__ = "Copyright (c) 2017, Intel Research and Development Ireland Ltd."
+__license__ = "Apache 2.0"
+__maintainer__ = "Giuliana Carullo"
+__email__ = "giuliana.carullo@intel.com"
+__status__ = "Development"
+
+# Memory used by the node properties of a synthetic landscape, loaded from
+# a Landscaper-shaped payload and held as dicts (default) and as compact
+# node records ([LANDSCAPE] compact=True).
+# Usage: python compact_landscape_memory.py [number of machines]
+
+import sys
+import json
+from analytics_engine.heuristics.beans.compact_node import CompactNodeRecord
+from analytics_engine.infrastructure_manager.infograph import InfoGraph
+
+PUS_PER_MACHINE = 16
+VMS_PER_MACHINE = 4
+
+
+def deep_size(value, seen):
+    # Bytes used by the value and everything it references, once
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += deep_size(key, seen) + deep_size(item, seen)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += deep_size(item, seen)
+    elif hasattr(value, '__slots__'):
+        for slot in value.__slots__:
+            if hasattr(value, slot):
+                size += deep_size(getattr(value, slot), seen)
+    return size
+
+
+def node(name, node_type, layer, category, **properties):
+    # Node of a Landscaper payload: properties next to name, type, layer
+    # and category
+    properties.update({'id': name, 'name': name, 'type': node_type,
+                       'layer': layer, 'category': category})
+    return properties
+
+
+def payload(machines):
+    nodes = []
+    links = []
+
+    def add(properties):
+        nodes.append(properties)
+        return len(nodes) - 1
+
+    for m in range(machines):
+        machine = 'machine-{}'.format(m)
+        machine_id = add(node(machine, 'machine', 'physical', 'compute',
+                              local_memory=65536, os_index=0))
+        for p in range(PUS_PER_MACHINE):
+            pu = '{}_pu_{}'.format(machine, p)
+            links.append({'source': machine_id,
+                          'target': add(node(pu, 'pu', 'physical',
+                                             'compute', allocation=machine,
+                                             os_index=p))})
+        nic = '{}_eno1'.format(machine)
+        links.append({'source': machine_id,
+                      'target': add(node(
+                          nic, 'osdev_network', 'physical', 'network',
+                          allocation=machine, os_index=0,
+                          address='00:00:00:00:{:02x}:{:02x}'.format(
+                              m // 256 % 256, m % 256),
+                          linkspeed=10000, **{'osdev_network-name': 'eno1'}))})
+        for v in range(VMS_PER_MACHINE):
+            vm = '{}_vm_{}'.format(machine, v)
+            links.append({'source': add(node(vm, 'vm', 'virtual', 'compute',
+                                             allocation=machine, vm_name=vm,
+                                             flavor='m1.small', vcpus=2)),
+                          'target': machine_id})
+    # As decoded from the response of the Landscaper
+    return json.loads(json.dumps({'directed': True, 'multigraph': False,
+                                  'graph': {}, 'nodes': nodes,
+                                  'links': links}))
+
+
+def landscape(machines):
+    graph = InfoGraph()
+    # Properties kept at the top level and copied as attributes, as by
+    # landscape.get_graph(decode_attributes=True)
+    graph.add_node_link_data(payload(machines), decode_attributes=True)
+    return graph
+
+
+def properties_size(graph):
+    seen = set()
+    return sum(deep_size(graph.node[n], seen) for n in graph.nodes())
+
+
+if __name__ == '__main__':
+    machines = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    graph = landscape(machines)
+    before = properties_size(graph)
+    CompactNodeRecord.compact_graph(graph)
+    after = properties_size(graph)
+    print('Nodes: {}'.format(len(graph.nodes())))
+    print('Node properties as dicts: {:.1f} MB'.format(before / 1048576.0))
+    print('Node properties as compact records: {:.1f} MB ({:.0f}% less)'.
+          format(after / 1048576.0, 100.0 * (before - after) / before))